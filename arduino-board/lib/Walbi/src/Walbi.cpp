@@ -70,10 +70,13 @@ State* Walbi::getState()
     return &lastState_;
 }
 
-void Walbi::act(Action* action)
+void Walbi::act(Action* action, uint16_t mask)
 {
     for (uint8_t i = 0; i < MOTOR_NB; i++)
     {
+        if (!(mask & (1 << i))) {
+            continue; // keeps its last command
+        }
         if (action->activate[i]){
             this->servoBus_->MoveTime(this->motorIds[i], action->position[i], action->span[i]);
         } else {
@@ -143,6 +146,23 @@ bool Walbi::receiveAction(Action* action)
     return true;
 }
 
+bool Walbi::receiveActionDelta(Action* action, uint16_t* mask)
+{
+    // assume ACTION_DELTA msg already received
+    *mask = read_i16();
+    for (uint8_t i = 0; i < MOTOR_NB; i++)
+    {
+        if (*mask & (1 << i))
+        {
+            action->position[i] = read_i16(); // position
+            action->span[i] = read_i16(); // span
+            action->activate[i] = bool(read_i8()); // activate
+        }
+    }
+    write_message(OK);
+    return true;
+}
+
 bool Walbi::sendState(State* state)
 {
     write_message(STATE);
@@ -220,7 +240,14 @@ bool Walbi::handleMessagesFromSerial()
                 int8_t version = read_i8();
                 write_message(OK);
                 write_message(VERSION);
-                write_i8(PROTOCOL_VERSION);
+                if (MIN_PROTOCOL_VERSION <= version && version < PROTOCOL_VERSION)
+                {
+                    write_i8(version); // an older host, e.g. without ACTION_DELTA
+                }
+                else
+                {
+                    write_i8(PROTOCOL_VERSION);
+                }
                 return waitAcknowledge();
             }
             case SET:
@@ -243,6 +270,20 @@ bool Walbi::handleMessagesFromSerial()
                     return false; // receiving action has failed
                 }
             }
+            case ACTION_DELTA:
+            {
+                Action action;
+                uint16_t mask;
+                if (this->receiveActionDelta(&action, &mask))
+                {
+                    this->act(&action, mask);
+                    return true;
+                }
+                else
+                {
+                    return false;
+                }
+            }
             case STATE:
             {
                 write_message(OK);
@@ -15,11 +15,13 @@
 namespace walbi_ns
 {
 
-#define PROTOCOL_VERSION 8
+#define PROTOCOL_VERSION 9
+#define MIN_PROTOCOL_VERSION 8 // VERSION is answered with the version of an older host, down to this one
 
 const long DEBUG_BOARD_BAUD = 115200;  // Baudrate to DebugBoard
 const uint8_t MOTOR_NB = 10;
 const uint8_t MOTOR_IDS[MOTOR_NB] = {0, 1, 2, 3, 4, 5, 6, 7, 8, 9}; // IDs different than [0..9] is not supported
+const uint16_t ALL_MOTORS = (1 << MOTOR_NB) - 1; // bit i for motor i
 
 // Define the messages that can be sent and received
 enum Message {
@@ -31,6 +33,7 @@ enum Message {
     SET = 6,
     ACTION = 7,
     STATE = 8,
+    ACTION_DELTA = 9, // motor mask, then [position, span, activate] for each motor in the mask
 };
 typedef enum Message Message;
 Message read_message();
@@ -92,11 +95,12 @@ public:
 
     // interact with hardware
     State* getState(); // collect from sensors
-    void act(Action* action); // send to actuators
+    void act(Action* action, uint16_t mask = ALL_MOTORS); // send to actuators, only the motors in mask
 
     // Serial communication
     bool handleMessagesFromSerial();
     bool receiveAction(Action* action);
+    bool receiveActionDelta(Action* action, uint16_t* mask);
     bool sendState(State* state);
 
     // run in loop
@@ -1,14 +1,17 @@
 import gym
 import walbi_gym
-import time
+from walbi_gym.envs import ControlLoop
 
 if __name__ == '__main__':
     with gym.make('Walbi-v0') as walbi:
         walbi.debug = True
         print('reset', walbi.reset())
-        for _ in range(50):
+
+        def policy(observation):
             action = walbi.action_space.sample() / 4
             action[:, 1] = -0.8
             print('action', action)
-            print('step', walbi.step(action))
-            time.sleep(0.5)
+            return action
+
+        loop = ControlLoop(walbi, rate=2)
+        print(loop.run(policy, steps=50, on_step=lambda *step: print('step', step)))
@@ -5,7 +5,6 @@ from pathlib import Path
 
 extras = {
   'bluetooth': ['pybluez'],  # requires libbluetooth-dev
-  'pid': ['pid_controller'],
 }
 
 # Meta dependency groups.
@@ -57,7 +56,7 @@ setup(
     name='walbi-gym',
     url='https://github.com/vtalpaert/Walbi-gym',
     # TODO download_url='git+https://github.com/vtalpaert/Walbi-gym#egg=walbi-gym-dev',
-    version='0.2.0',
+    version='0.2.1',
     description='Gym interface for Walbi robot',
     long_description='Walbi Gym interacts with the Walbi robot following the OpenAI gym API.',
     install_requires=[
@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from walbi_gym import errors
+from walbi_gym.protocol import Message
+from walbi_gym.walbi import Walbi, AsyncWalbi
+from walbi_gym.emulator import WalbiEmulator, EXPECTED_OK
+from walbi_gym.envs.kinematics import WalbiKinematics
+
+NO_STREAMING = 2 ** 31 - 1  # [ms]
+
+
+class LossyEmulator(WalbiEmulator):
+    """Loses the next OK it writes once drop_next_ok is set, refuses the next action once refuse_next_action is set"""
+    drop_next_ok = False
+    refuse_next_action = False
+    _refused = False
+
+    def _write(self, data):
+        if self.drop_next_ok and bytes(data) == bytes((Message.OK.value,)):
+            self.drop_next_ok = False
+            return
+        if self.refuse_next_action and bytes(data) == bytes((Message.OK.value,)):  # written before act
+            self.refuse_next_action, self._refused = False, True
+            self._write_error(EXPECTED_OK)
+            return
+        super()._write(data)
+
+    def act(self, action):
+        if self._refused:
+            self._refused = False
+            return
+        super().act(action)
+
+
+@pytest.fixture
+def robot():
+    with LossyEmulator(link='socketpair') as emulator:
+        walbi = Walbi('socket_pair', client_socket=emulator.host_socket)
+        walbi.apply_settings(NO_STREAMING)
+        walbi.interface.expect_or_raise_timeout = 0.2
+        yield emulator, walbi
+        walbi.close()
+
+
+def _action(offset=0):
+    action = np.zeros((10, 3), dtype=np.int16)
+    action[:, 0], action[:, 2] = WalbiKinematics.neutral_positions + offset, 1
+    return action
+
+
+def test_lost_ok_does_not_shift_later_acknowledgements(robot):
+    emulator, walbi = robot
+    walbi.send_action(_action())
+    emulator.drop_next_ok = True
+    with pytest.raises(errors.WalbiTimeoutError):
+        walbi.send_action(_action(1))
+    for i in range(5):
+        walbi.send_action(_action(i))  # each acknowledged by its own OK
+    assert not walbi.interface._pending_ok
+
+
+def test_refused_action_delta_does_not_corrupt_the_next_one():
+    with LossyEmulator(link='socketpair', latency=0.01) as emulator:  # both actions are sent before the ERROR
+        walbi = Walbi('socket_pair', client_socket=emulator.host_socket)
+        try:
+            walbi.apply_settings(NO_STREAMING)
+            walbi.send_action(_action())
+            first, second = _action(), _action()
+            first[0, 0] += 5
+            second[0, 0] += 5
+            second[1, 0] += 5  # a delta against first would only hold motor 1
+            emulator.refuse_next_action = True
+            refused = walbi.send_action(first, block=False)
+            sent = walbi.send_action(second, block=False)
+            with pytest.raises(errors.WalbiArduinoError):
+                walbi.interface.wait_ok(refused)
+            walbi.interface.wait_ok(sent)
+            np.testing.assert_array_equal(emulator.last_action, second)
+        finally:
+            walbi.close()
+
+
+def test_error_is_not_acknowledged(robot):
+    emulator, walbi = robot
+    emulator.refuse_next_action = True
+    with pytest.raises(errors.WalbiArduinoError):
+        walbi.send_action(_action())
+    for i in range(5):
+        walbi.send_action(_action(i))
+    time.sleep(0.05)
+    assert emulator.errors_sent == 1  # an OK would be answered with ERROR RECEIVED_UNKNOWN_MESSAGE
+
+
+def test_failing_state_callback_does_not_stop_the_listener(robot):
+    emulator, walbi = robot
+
+    def callback(state):
+        raise RuntimeError('callback bug')
+
+    walbi.interface.set_state_callback(callback)
+    walbi.apply_settings(5)
+    deadline = time.monotonic() + 1
+    while walbi.interface.state_callback is not None and time.monotonic() < deadline:
+        walbi.interface.get_state(new=True)  # the callback runs after the STATE is delivered
+    assert walbi.interface.state_callback is None
+    assert isinstance(walbi.interface.state_callback_exception, RuntimeError)
+    walbi.apply_settings(NO_STREAMING)
+    walbi.send_action(_action())
+
+
+def test_async_lost_ok_does_not_shift_later_acknowledgements():
+    async def control(emulator):
+        async with AsyncWalbi('serial', emulator.port) as walbi:
+            walbi.interface.expect_or_raise_timeout = 0.2
+            await walbi.apply_settings(NO_STREAMING)
+            await walbi.send_action(_action())
+            emulator.drop_next_ok = True
+            with pytest.raises(errors.WalbiTimeoutError):
+                await walbi.send_action(_action(1))
+            for i in range(5):
+                await walbi.send_action(_action(i))
+            assert not walbi.interface._pending_ok
+
+    with LossyEmulator() as emulator:
+        asyncio.run(control(emulator))
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from walbi_gym import errors
+from walbi_gym.protocol import Message, PROTOCOL_VERSION
+from walbi_gym.walbi import AsyncWalbi
+from walbi_gym.emulator import WalbiEmulator
+from walbi_gym.envs.kinematics import WalbiKinematics
+
+
+class SilentEmulator(WalbiEmulator):
+    """Stops writing the OK of actions once silent is set"""
+    silent = False
+
+    def _write(self, data):
+        if self.silent and bytes(data) == bytes((Message.OK.value,)):
+            return
+        super()._write(data)
+
+
+def _action():
+    action = np.zeros((10, 3), dtype=np.int16)
+    action[:, 0], action[:, 2] = WalbiKinematics.neutral_positions + 10, 1
+    return action
+
+
+def test_control_loop():
+    async def control(emulator):
+        async with AsyncWalbi('socket_pair', emulator.host_socket) as walbi:
+            assert walbi.interface.protocol_version == PROTOCOL_VERSION
+            await walbi.apply_settings(5)
+            timestamps = []
+            async for state in walbi:
+                timestamps.append(state[0])
+                await walbi.send_action(_action())
+                if len(timestamps) == 5:
+                    break
+            return timestamps
+
+    with WalbiEmulator(link='socketpair') as emulator:
+        timestamps = asyncio.run(control(emulator))
+        assert np.all(np.diff(timestamps) > 0)
+        np.testing.assert_array_equal(emulator.last_action, _action())
+
+
+def test_closed_link_ends_the_states_and_fails_pending_sends():
+    async def control(emulator):
+        async with AsyncWalbi('socket_pair', emulator.host_socket) as walbi:
+            walbi.interface.expect_or_raise_timeout = 5
+            await walbi.apply_settings(5)
+
+            async def iterate():
+                return len([state async for state in walbi])
+
+            states = asyncio.ensure_future(iterate())
+            await walbi.next_state()
+            emulator.silent = True
+            send = asyncio.ensure_future(walbi.send_action(_action()))
+            await asyncio.sleep(0.05)
+            start = time.monotonic()
+            await asyncio.get_running_loop().run_in_executor(None, emulator.close)
+            with pytest.raises(errors.WalbiCommunicationError):
+                await asyncio.wait_for(send, 1)
+            assert await asyncio.wait_for(states, 1) > 0
+            assert time.monotonic() - start < 2
+            with pytest.raises(errors.WalbiCommunicationError):
+                await walbi.next_state(timeout=1)
+            with pytest.raises(errors.WalbiCommunicationError):
+                await walbi.send_action(_action())
+
+    with SilentEmulator(link='socketpair') as emulator:
+        asyncio.run(control(emulator))
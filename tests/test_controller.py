@@ -0,0 +1,33 @@
+import time
+
+import numpy as np
+
+from walbi_gym.walbi import Walbi
+from walbi_gym.controller import StateController
+from walbi_gym.envs.kinematics import WalbiKinematics
+
+from tests.test_acknowledgements import LossyEmulator
+
+
+def test_controller_recovers_from_a_lost_ok():
+    with LossyEmulator(link='socketpair') as emulator:
+        walbi = Walbi('socket_pair', client_socket=emulator.host_socket)
+        walbi.interface.expect_or_raise_timeout = 0.05
+        walbi.apply_settings(10)
+        controller = StateController(walbi, span=20)
+        controller.set_setpoint(WalbiKinematics.neutral_positions)
+        controller.start()
+        time.sleep(0.2)
+        emulator.drop_next_ok = True
+        time.sleep(0.3)
+        actions_sent, actions_received = controller.actions_sent, emulator.actions_received
+        time.sleep(0.3)
+        controller.stop()
+        time.sleep(0.05)
+        walbi.close()
+    assert controller.exception is None
+    assert controller.errors == 1  # the lost OK only
+    # each STATE after the loss is answered by an acknowledged ACTION again
+    assert controller.actions_sent - actions_sent >= 20
+    assert emulator.actions_received - actions_received >= 20
+    assert controller._ok_future.done() and not controller._ok_future.cancelled()
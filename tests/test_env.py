@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+
+from walbi_gym.emulator import WalbiEmulator
+from walbi_gym.envs.env import WalbiEnv
+from walbi_gym.envs.wrappers.record import RecordWrapper, TransitionDataset
+
+
+def test_recorded_observations_are_not_overwritten_by_the_next_step(tmp_path):
+    with WalbiEmulator(link='socketpair') as emulator:
+        env = RecordWrapper(WalbiEnv('socket_pair', client_socket=emulator.host_socket, reuse_observation=True),
+                            str(tmp_path))
+        try:
+            env.unwrapped.walbi.apply_settings(5)
+            first = env.reset()
+            observations = [first.copy()]
+            for i in range(3):
+                action = np.zeros((10, 2))
+                action[:, 0] = 0.2 * (i + 1)
+                time.sleep(0.05)  # the motors move between the states
+                observation, _, _, info = env.step(action)
+                observations.append(observation.copy())
+            assert observation is first  # written in place
+            assert len(np.unique(observations, axis=0)) > 1
+            assert info['is_position_updated'].dtype == np.bool_
+        finally:
+            env.close()
+    rows = TransitionDataset(str(tmp_path))[:]
+    np.testing.assert_array_equal(rows['observation'], observations[:-1])
+    np.testing.assert_array_equal(rows['next_observation'], observations[1:])
+
+
+def test_observations_are_new_arrays_by_default():
+    with WalbiEmulator(link='socketpair') as emulator:
+        env = WalbiEnv('socket_pair', client_socket=emulator.host_socket)
+        try:
+            first = env.reset()
+            kept = first.copy()
+            observation, _, _, info = env.step(np.full((10, 2), 0.5))
+            assert observation is not first and not np.shares_memory(observation, first)
+            np.testing.assert_array_equal(first, kept)
+            _, _, _, next_info = env.step(np.full((10, 2), 0.5))
+            assert next_info['is_position_updated'] is not info['is_position_updated']
+        finally:
+            env.close()
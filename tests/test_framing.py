@@ -0,0 +1,43 @@
+import numpy as np
+
+from walbi_gym.protocol import Message
+from walbi_gym.communication.framing import FrameEncoder
+
+
+def _action(**positions):
+    action = np.zeros((10, 3), dtype=np.int16)
+    action[:, 0], action[:, 1], action[:, 2] = 500, 20, 1
+    for motor, position in positions.items():
+        action[int(motor[1:]), 0] = position
+    return action
+
+
+def _motors(frame) -> int:
+    """Number of motors in an encoded action frame"""
+    frame = bytes(frame)
+    if frame[0] == Message.ACTION.value:
+        return 10
+    return bin(int.from_bytes(frame[1:3], 'little')).count('1')
+
+
+def test_action_delta_is_encoded_against_the_acknowledged_and_in_flight_actions():
+    encoder = FrameEncoder()
+    first, second, third = object(), object(), object()
+    assert _motors(encoder.encode(Message.ACTION_DELTA, _action(), first)) == 10  # nothing acknowledged yet
+    encoder.acknowledge(first)
+    assert _motors(encoder.encode(Message.ACTION_DELTA, _action(m0=510), second)) == 1
+    # motor 0 differs from the acknowledged action, in case second is refused
+    assert _motors(encoder.encode(Message.ACTION_DELTA, _action(m0=510, m1=510), third)) == 2
+    encoder.acknowledge(second)
+    assert _motors(encoder.encode(Message.ACTION_DELTA, _action(m0=510, m1=510), object())) == 1
+    encoder.refuse(third)
+    assert _motors(encoder.encode(Message.ACTION_DELTA, _action(m0=510, m1=510), object())) == 10
+
+
+def test_action_without_acknowledgement_leaves_the_robot_state_unknown():
+    encoder = FrameEncoder()
+    token = object()
+    encoder.encode(Message.ACTION, _action(), token)
+    encoder.acknowledge(token)
+    encoder.encode(Message.ACTION_DELTA, _action(m0=510))
+    assert _motors(encoder.encode(Message.ACTION_DELTA, _action(m0=510), object())) == 10
@@ -0,0 +1,34 @@
+import socket
+import time
+
+import pytest
+
+from walbi_gym import errors
+from walbi_gym.communication.socket_interface import SocketPairInterface, SocketFile
+from walbi_gym.protocol import Message
+
+
+@pytest.fixture
+def link():
+    host, robot = socket.socketpair()
+    interface = SocketPairInterface(host)
+    interface.file = SocketFile(host)  # no handshake, nobody answers
+    yield interface, robot
+    robot.close()
+    interface.close()
+
+
+def test_closed_link_stops_the_listener_and_fails_pending_futures(link):
+    interface, robot = link
+    ok_future = interface.put_command(Message.CONNECT, expect_ok=True, block=False)
+    deadline = time.monotonic() + 2
+    while not interface._pending_ok and time.monotonic() < deadline:  # written by the command thread
+        time.sleep(0.001)
+    robot.close()
+    with pytest.raises(errors.WalbiCommunicationError):
+        ok_future.result(timeout=1)
+    listener = interface._threads[1]
+    listener.join(timeout=1)
+    assert not listener.is_alive()
+    with pytest.raises(errors.WalbiCommunicationError):
+        interface.put_command(Message.CONNECT, expect_ok=True, block=False).result(timeout=1)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from walbi_gym.envs import WalbiMockEnv
+from walbi_gym.envs.wrappers.pid_control import PidWrapper
+
+pid = pytest.importorskip('pid_controller.pid')
+
+
+def _old_action(pids, action, observation, timestamp, low, tolerance):
+    """PidWrapper.action before ArrayPID, one pid_controller PID per motor"""
+    new_action = np.zeros((10, 2))
+    new_action[:, 0] = action
+    new_action[:, 1] = low[:, 1]
+    for i, motor_pid in enumerate(pids):
+        feedback = float(observation[i])
+        motor_pid.target = action[i] if abs(motor_pid.target - feedback) > tolerance else feedback
+        new_action[i, 0] = feedback - motor_pid(feedback=feedback, curr_tm=timestamp / 1000)
+    return new_action
+
+
+@pytest.mark.parametrize('K', [(0.01, 0.001, 0), (0.5, 0.2, 0.001)])
+def test_pid_wrapper_matches_the_per_motor_pids(K):
+    np.random.seed(0)
+    env = PidWrapper(WalbiMockEnv(), [K] * 10)
+    pids = [pid.PID(p=K[0], i=K[1], d=K[2], get_time=lambda: 0) for _ in range(10)]
+    env.reset()
+    rng = np.random.RandomState(1)
+    action = None
+    for step in range(300):
+        if step % 50 == 0:
+            action = rng.uniform(-1, 1, 10)
+        expected = _old_action(pids, action, env.last_observation, env.last_timestamp, env.env.action_space.low, 0.002)
+        env.step(action, clip=False)
+        np.testing.assert_allclose(env.last_action, expected, rtol=1e-9, atol=1e-12)
+        np.testing.assert_array_equal(env.action_target(), np.array([p.target for p in pids], dtype=np.float32))
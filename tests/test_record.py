@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from gym import spaces
+
+from walbi_gym.envs.wrappers.record import ChunkedRecorder, TransitionDataset
+
+
+def _record(folder, observation_dtype, rows=3):
+    observation_space = spaces.Box(-1, 1, shape=(10,), dtype=observation_dtype)
+    recorder = ChunkedRecorder(str(folder), observation_space, spaces.Box(-1, 1, shape=(10, 2)), chunk_size=2)
+    for step in range(rows):
+        observation = np.full(10, step, dtype=observation_dtype)
+        recorder.record(observation, np.zeros((10, 2)), observation, 0., False, step, agent_info={'step': step})
+    recorder.close()
+
+
+def test_sessions_are_read_as_one_table(tmp_path):
+    _record(tmp_path / 'a', np.float32)
+    _record(tmp_path / 'b', np.float32, rows=2)
+    dataset = TransitionDataset(str(tmp_path))
+    assert len(dataset) == 5
+    np.testing.assert_array_equal(dataset.take([4, 0])['step'], [1, 0])
+    assert dataset.agent_infos()[3] == {'step': 0}
+
+
+def test_sessions_with_other_columns_are_refused(tmp_path):
+    _record(tmp_path / 'a', np.float32)
+    _record(tmp_path / 'b', np.float64)
+    with pytest.raises(ValueError):
+        TransitionDataset(str(tmp_path))
@@ -0,0 +1,45 @@
+import numpy as np
+
+from walbi_gym.protocol import Message, STATE_WIRE_DTYPE
+from walbi_gym.communication.wire_log import WireLogger, RECEIVED, read_wire_log_header
+from walbi_gym.emulator import WalbiEmulator
+from walbi_gym.envs.env import WalbiEnv
+from walbi_gym.walbi import Walbi
+
+
+def _write_log(path, frames):
+    logger = WireLogger(str(path))
+    state = np.zeros((), dtype=STATE_WIRE_DTYPE)
+    for i in range(frames):
+        state['timestamp'] = i
+        logger.log(RECEIVED, bytes((Message.STATE.value,)) + state.tobytes())
+    logger.close()
+
+
+def test_replay_as_fast_as_possible_keeps_acknowledging(tmp_path):
+    path = tmp_path / 'session.log'
+    _write_log(path, 20000)
+    env = WalbiEnv('replay', log_path=str(path), speed=0)
+    try:
+        env.reset()
+        for _ in range(50):
+            env.step(env.action_space.sample())
+        assert env.walbi.interface.states_received > 0
+    finally:
+        env.close()
+
+
+def test_wire_log_header_has_the_negotiated_version(tmp_path):
+    path = tmp_path / 'session.log'
+    with WalbiEmulator(link='socketpair', protocol_version=8) as emulator:
+        walbi = Walbi('socket_pair', client_socket=emulator.host_socket, wire_log=str(path))
+        try:
+            assert walbi.interface.protocol_version == 8
+        finally:
+            walbi.close()
+    assert read_wire_log_header(str(path)) == 8
+    replayed = Walbi('replay', log_path=str(path), speed=0)
+    try:
+        assert replayed.interface.protocol_version == 8
+    finally:
+        replayed.close()
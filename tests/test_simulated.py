@@ -0,0 +1,39 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from walbi_gym.envs.simulated import LX16AArray
+
+
+def test_motor_next_to_its_target_settles_on_it():
+    motors = LX16AArray(initial_position=np.full(10, 500.0001), integrator='exact')
+    motors.max_events = 10
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        positions = motors.step(1., np.full(10, 500.))
+    np.testing.assert_array_equal(positions, 500)
+    np.testing.assert_array_equal(motors.speed, 0)
+
+
+def test_too_many_events_warn():
+    motors = LX16AArray(initial_position=np.full(10, 100.), integrator='exact')
+    motors.max_events = 2
+    with pytest.warns(RuntimeWarning, match='still moving'):
+        motors.step(2., np.full(10, 800.))
+    np.testing.assert_array_equal(motors.speed, 0)
+
+
+def test_exact_integrator_matches_a_fine_euler_integration():
+    rng = np.random.RandomState(0)
+    initial_position = rng.uniform(100, 900, 10)
+    exact = LX16AArray(initial_position=initial_position, integrator='exact')
+    euler = LX16AArray(initial_position=initial_position)
+    top_speed = 0.
+    for target in rng.uniform(100, 900, (12, 10)):  # long enough to accelerate, cruise and approach
+        exact.step(0.25, target)
+        euler.step(1e-5, target, substeps=25000)
+        np.testing.assert_allclose(exact.position_encoder, euler.position_encoder, rtol=0, atol=0.1)  # [tick]
+        np.testing.assert_allclose(exact.speed, euler.speed, rtol=0, atol=0.5)  # [tick/s], up to max_speed
+        top_speed = max(top_speed, np.abs(euler.speed).max())
+    assert top_speed == LX16AArray.max_speed  # the cruise was covered
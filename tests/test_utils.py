@@ -0,0 +1,17 @@
+import numpy as np
+
+from walbi_gym.envs.env import WalbiEnv
+from walbi_gym.envs.utils import SpaceConverter
+
+
+def test_space_converter_reuses_its_work_buffer_safely():
+    converter = SpaceConverter(WalbiEnv.raw_observation_space, WalbiEnv.observation_space, clip=False)
+    low, high = WalbiEnv.raw_observation_space.low, WalbiEnv.raw_observation_space.high
+    first, second = converter(low), converter(high)
+    assert not np.shares_memory(first, second)
+    np.testing.assert_array_equal(first, -1)
+    np.testing.assert_array_equal(second, 1)
+    out = np.empty((3, 10))  # float64, converted in place
+    assert converter(np.stack([low, high, low]), out=out) is out
+    np.testing.assert_array_equal(out, [[-1] * 10, [1] * 10, [-1] * 10])
+    np.testing.assert_array_equal(converter(low), first)  # back to the unbatched shape
@@ -0,0 +1,60 @@
+import functools
+
+import numpy as np
+
+from walbi_gym.envs import WalbiMockEnv
+from walbi_gym.envs.vector import SubprocVecEnv
+
+
+class _BufferEnv(object):
+    """Returns the same observation buffer from step and reset, as WalbiEnv does, and is done at every step"""
+
+    def __init__(self):
+        self._observation = np.zeros(WalbiMockEnv.observation_space.shape, dtype=WalbiMockEnv.observation_space.dtype)
+
+    def reset(self):
+        self._observation[:] = 0
+        return self._observation
+
+    def step(self, action):
+        self._observation[:] = 1
+        return self._observation, 0., True, {}
+
+    def close(self):
+        pass
+
+
+def _kill_worker(envs, index):
+    envs._processes[index].kill()
+    envs._processes[index].join()
+
+
+def test_dead_worker_is_restarted_by_step_and_reset():
+    envs = SubprocVecEnv([functools.partial(WalbiMockEnv)] * 2, seed=0)
+    try:
+        envs.reset()
+        _kill_worker(envs, 1)
+        observations, rewards, dones, infos = envs.step(envs.action_space.sample())
+        assert 'worker_error' in infos[1] and 'worker_error' not in infos[0]
+        assert dones[1] and envs.restarts == 1
+        _kill_worker(envs, 0)
+        observations = envs.reset()
+        assert 'worker_error' in envs.reset_infos[0] and envs.reset_infos[1] == {}
+        assert envs.restarts == 2
+        assert np.all(np.isfinite(observations))
+        envs.step(envs.action_space.sample())
+    finally:
+        envs.close()
+
+
+def test_terminal_observation_is_not_overwritten_by_reset():
+    envs = SubprocVecEnv([_BufferEnv] * 2, start_method='fork')  # the env class is local to the tests
+    try:
+        envs.reset()
+        observations, rewards, dones, infos = envs.step(envs.action_space.sample())
+        assert np.all(dones)
+        np.testing.assert_array_equal(observations, 0)
+        for info in infos:
+            np.testing.assert_array_equal(info['terminal_observation'], 1)
+    finally:
+        envs.close()
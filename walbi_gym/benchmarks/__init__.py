@@ -0,0 +1 @@
+"""Benchmarks for the communication stack, run them with python -m walbi_gym.benchmarks.<name>"""
@@ -0,0 +1,64 @@
+"""Compares the field by field decoding of a frame with the precompiled whole-frame decoding"""
+import io
+import random
+import timeit
+
+from walbi_gym.protocol import Message, MESSAGE_TYPES, MESSAGE_STRUCTS
+from walbi_gym.communication.base import read_types
+from walbi_gym.communication.framing import ReceiveBuffer
+
+
+def read_frame(message, file):
+    """Reads the whole payload of message at once and decodes it in one call, file must hold the whole payload"""
+    return MESSAGE_STRUCTS[message].unpack(file.read(MESSAGE_STRUCTS[message].size))
+
+
+def random_payload(message):
+    frame_struct = MESSAGE_STRUCTS[message]
+    values = []
+    for t in MESSAGE_TYPES[message]:
+        bits = {'int8': 7, 'int16': 15, 'int32': 31}[t]
+        values.append(random.randint(-2 ** bits, 2 ** bits - 1))
+    return frame_struct.pack(*values), values
+
+
+def time_decode(decode, payload, number):
+    f = io.BytesIO(payload * number)
+    start = timeit.default_timer()
+    for _ in range(number):
+        decode(f)
+    return (timeit.default_timer() - start) / number
+
+
+def time_receive_buffer(message, payload, number, chunk=4096):
+    """Frames parsed from the receive buffer, filled by chunks as the listener does"""
+    stream = memoryview((bytes((message.value,)) + payload) * number)
+    receive_buffer = ReceiveBuffer(size=2 * chunk)
+    start = timeit.default_timer()
+    for offset in range(0, len(stream), chunk):
+        receive_buffer.extend(stream[offset:offset + chunk])
+        for _ in receive_buffer.frames():
+            pass
+    return (timeit.default_timer() - start) / number
+
+
+def benchmark(message=Message.STATE, number=100000):
+    payload, values = random_payload(message)
+    type_list = MESSAGE_TYPES[message]
+    assert list(read_types(type_list, io.BytesIO(payload))) == values
+    assert list(read_frame(message, io.BytesIO(payload))) == values
+    return {
+        'fields': len(type_list),
+        'bytes': len(payload),
+        'read_types': time_decode(lambda f: read_types(type_list, f), payload, number),
+        'read_frame': time_decode(lambda f: read_frame(message, f), payload, number),
+        'receive_buffer': time_receive_buffer(message, payload, number),
+    }
+
+
+if __name__ == '__main__':
+    for message in MESSAGE_STRUCTS:
+        result = benchmark(message)
+        print('%-14s %2d fields %3d bytes: read_types %6.2f us, read_frame %6.2f us, receive_buffer %6.2f us per frame' % (
+            message.name, result['fields'], result['bytes'],
+            1e6 * result['read_types'], 1e6 * result['read_frame'], 1e6 * result['receive_buffer']))
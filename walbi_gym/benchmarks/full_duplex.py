@@ -0,0 +1,118 @@
+"""ACTION latency, from put_command to its arrival at the robot, while STATE frames stream in at full rate"""
+import os
+import selectors
+import threading
+import time
+import tty
+
+import numpy as np
+
+from walbi_gym.protocol import Message, MESSAGE_STRUCTS, PROTOCOL_VERSION
+from walbi_gym.communication import SerialInterface
+from walbi_gym.communication.framing import ReceiveBuffer
+
+
+class StreamingPeer(object):
+    """Minimal robot side over a pseudo-terminal, streams STATE as fast as the host reads them"""
+
+    def __init__(self, state_interval=0.):
+        self.master, slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.state_interval = state_interval
+        self.streaming = threading.Event()
+        self.stopped = threading.Event()
+        self.action_times = []
+        self.states_sent = 0
+        self._write_lock = threading.Lock()
+        state_struct = MESSAGE_STRUCTS[Message.STATE]
+        self._state_frame = bytes((Message.STATE.value,)) + state_struct.pack(*([0] * len(state_struct.unpack(bytes(state_struct.size)))))
+        self._threads = [threading.Thread(target=self._listen, daemon=True), threading.Thread(target=self._stream, daemon=True)]
+        for t in self._threads:
+            t.start()
+
+    def _write(self, data):
+        with self._write_lock:
+            os.write(self.master, data)
+
+    def _listen(self):
+        receive_buffer = ReceiveBuffer()
+        selector = selectors.DefaultSelector()
+        selector.register(self.master, selectors.EVENT_READ)
+        connected = False
+        while not self.stopped.is_set():
+            if not selector.select(0.1):
+                continue
+            receive_buffer.extend(os.read(self.master, len(receive_buffer.free_space())))
+            for message, _ in receive_buffer.frames():
+                if message == Message.ACTION:
+                    self.action_times.append(time.perf_counter())
+                    self._write(bytes((Message.OK.value,)))
+                elif message == Message.CONNECT:
+                    self._write(bytes((Message.ALREADY_CONNECTED.value if connected else Message.CONNECT.value,)))
+                    connected = True
+                elif message == Message.VERSION:
+                    self._write(bytes((Message.OK.value, Message.VERSION.value, PROTOCOL_VERSION)))
+                elif message == Message.SET:
+                    self._write(bytes((Message.OK.value,)))
+        selector.close()
+
+    def _stream(self):
+        while not self.stopped.is_set():
+            if not self.streaming.wait(0.1):
+                continue
+            self._write(self._state_frame)
+            self.states_sent += 1
+            if self.state_interval:
+                time.sleep(self.state_interval)
+
+    def close(self):
+        self.stopped.set()
+        for t in self._threads:
+            t.join(timeout=1)
+        os.close(self.master)
+
+
+def benchmark(nb_actions=1000, action_interval=0.002, stream_states=True):
+    peer = StreamingPeer()
+    interface = SerialInterface(peer.port)
+    interface.connect()
+    interface.verify_version()
+    if stream_states:
+        peer.streaming.set()
+        time.sleep(0.2)
+    action = np.zeros((10, 2), dtype=np.int16)
+    sent_times = []
+    start = time.perf_counter()
+    states_at_start = interface.states_received
+    for _ in range(nb_actions):
+        sent_times.append(time.perf_counter())
+        interface.put_command(Message.ACTION, param=action, delay=False)
+        time.sleep(action_interval)
+    time.sleep(0.2)
+    duration = time.perf_counter() - start
+    states_received = interface.states_received - states_at_start
+    peer.streaming.clear()
+    interface.close()
+    peer.close()
+    received = min(len(peer.action_times), len(sent_times))
+    latencies = np.array(peer.action_times[:received]) - np.array(sent_times[:received])
+    return {
+        'actions_sent': nb_actions,
+        'actions_received': len(peer.action_times),
+        'latency_p50': float(np.percentile(latencies, 50)),
+        'latency_p99': float(np.percentile(latencies, 99)),
+        'latency_max': float(latencies.max()),
+        'states_per_second': states_received / duration,
+        'states_overwritten': interface.states_overwritten,
+    }
+
+
+if __name__ == '__main__':
+    for stream_states in (False, True):
+        result = benchmark(stream_states=stream_states)
+        print('STATE streaming %-5s: %d/%d actions, latency p50 %.3f ms, p99 %.3f ms, max %.3f ms, %.0f STATE/s' % (
+            stream_states, result['actions_received'], result['actions_sent'],
+            1e3 * result['latency_p50'], 1e3 * result['latency_p99'], 1e3 * result['latency_max'],
+            result['states_per_second']))
@@ -0,0 +1,282 @@
+"""
+Throughput and latency of the communication stack against the firmware emulator, for every baud rate given.
+The emulator runs in its own process, so that CPU times only count the host side. Results are written as JSON
+to be compared between commits:
+    python -m walbi_gym.benchmarks.suite --baud-rates 0 115200 1000000 --output results.json
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+from walbi_gym import errors
+from walbi_gym.protocol import PROTOCOL_VERSION
+from walbi_gym.walbi import Walbi
+from walbi_gym.envs.env import WalbiEnv
+from walbi_gym.envs.kinematics import WalbiKinematics
+from walbi_gym.communication import base
+from walbi_gym.communication.base import BaseInterface
+from walbi_gym.emulator import WalbiEmulator
+
+NO_STREAMING = 2 ** 31 - 1  # [ms] SET interval which stops the STATE stream
+
+
+def _emulator_process(remote, emulator_kwargs):
+    emulator = WalbiEmulator(link='pty', **emulator_kwargs)
+    remote.send(emulator.port)
+    while True:
+        command, data = remote.recv()
+        if command == 'drop_rate':
+            emulator.uplink.drop_rate = emulator.downlink.drop_rate = data
+        elif command == 'stop':
+            break
+    counters = {
+        'states_sent': emulator.states_sent,
+        'actions_received': emulator.actions_received,
+        'errors_sent': emulator.errors_sent,
+        'acknowledge_timeouts': emulator.acknowledge_timeouts,
+        'bytes_dropped': emulator.uplink.bytes_dropped + emulator.downlink.bytes_dropped,
+    }
+    emulator.close()
+    remote.send(counters)
+
+
+class EmulatedRobot(object):
+    """
+    WalbiEmulator over a pseudo-terminal in a child process, stop returns its counters.
+    Bytes are only dropped once the host is connected, see start_drops
+    """
+
+    def __init__(self, drop_rate=0., **emulator_kwargs):
+        self.drop_rate = drop_rate
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        context = multiprocessing.get_context(method)
+        self._remote, remote = context.Pipe()
+        self._process = context.Process(target=_emulator_process, args=(remote, emulator_kwargs), daemon=True)
+        self._process.start()
+        remote.close()
+        self.port = self._remote.recv()
+        self.counters = None
+
+    def start_drops(self):
+        if self.drop_rate:
+            self._remote.send(('drop_rate', self.drop_rate))
+
+    def stop(self) -> dict:
+        if self.counters is None:
+            self._remote.send(('stop', None))
+            self.counters = self._remote.recv()
+            self._process.join(timeout=5)
+            self._remote.close()
+        return self.counters
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+@contextlib.contextmanager
+def communication_settings(thread_rate=None, delay_flush_message=None):
+    """Overrides the communication section of config.yaml for the interfaces created inside the block"""
+    saved = base._rate, BaseInterface.delay
+    if thread_rate is not None:
+        base._rate = thread_rate
+    if delay_flush_message is not None:
+        BaseInterface.delay = delay_flush_message
+    try:
+        yield
+    finally:
+        base._rate, BaseInterface.delay = saved
+
+
+def _percentiles(durations) -> dict:
+    durations = np.asarray(durations)
+    if not durations.size:
+        return dict.fromkeys(('mean', 'p50', 'p99', 'p99.9', 'max'), None)
+    p50, p99, p999 = np.percentile(durations, [50, 99, 99.9])
+    return {'mean': float(durations.mean()), 'p50': float(p50), 'p99': float(p99), 'p99.9': float(p999), 'max': float(durations.max())}
+
+
+def action_round_trip(number=1000, stream_states=True, **emulator_kwargs) -> dict:
+    """
+    Time from Walbi.send_action to its OK, one action at a time, with or without the STATE stream.
+    Each action moves two motors, as ACTION_DELTA only sends the motors which changed
+    """
+    action = np.zeros((10, 3), dtype=np.int16)
+    action[:, 0], action[:, 2] = WalbiKinematics.neutral_positions, 1
+    moves = np.array([1, -1], dtype=np.int16)
+    with EmulatedRobot(**emulator_kwargs) as robot:
+        walbi = Walbi('serial', serial_port=robot.port)
+        walbi.apply_settings(0 if stream_states else NO_STREAMING)
+        robot.start_drops()
+        durations = []
+        cpu_start = time.process_time()
+        for i in range(number):
+            action[[i % 10, (i + 5) % 10], 0] += moves[i // 10 % 2]
+            start = time.perf_counter()
+            try:
+                walbi.send_action(action)
+            except errors.WalbiError:  # lost action or OK, on a link dropping bytes
+                continue
+            durations.append(time.perf_counter() - start)
+        cpu = time.process_time() - cpu_start
+        action_message = walbi.action_message
+        walbi.close()
+        counters = robot.stop()
+    result = {'actions': number, 'actions_failed': number - len(durations), 'actions_received': counters['actions_received'],
+              'cpu_per_action': cpu / number, 'action_message': action_message.name}
+    result.update(('latency_' + key, value) for key, value in _percentiles(durations).items())
+    return result
+
+
+def state_rate(duration=2., **emulator_kwargs) -> dict:
+    """
+    STATE frames per second when the robot streams them as fast as they are acknowledged. The frames lost on the link
+    are the ones the emulator sent but the host never parsed, counted once the stream is stopped and drained
+    """
+    with EmulatedRobot(**emulator_kwargs) as robot:
+        walbi = Walbi('serial', serial_port=robot.port)
+        walbi.apply_settings(0)
+        robot.start_drops()
+        interface = walbi.interface
+        received_start, dropped_start = interface.states_received, interface.dropped_messages
+        cpu_start, start = time.process_time(), time.perf_counter()
+        time.sleep(duration)
+        received = interface.states_received - received_start
+        cpu, elapsed = time.process_time() - cpu_start, time.perf_counter() - start
+        try:  # the OK of SET follows the last STATE sent, every STATE not lost was parsed before it
+            walbi.apply_settings(NO_STREAMING)
+        except errors.WalbiError:  # lost SET or OK, on a link dropping bytes
+            time.sleep(0.1)
+        states_received = interface.states_received
+        walbi.close()
+        counters = robot.stop()
+    return {
+        'states_per_second': received / elapsed,
+        'states_sent': counters['states_sent'],  # since the handshake
+        'states_received': states_received,
+        'states_dropped': max(counters['states_sent'] - states_received, 0),  # lost or corrupted on the link
+        'messages_dropped': interface.dropped_messages - dropped_start,  # control messages not read in time
+        'states_overwritten': interface.states_overwritten,  # never read, expected as nothing reads them here
+        'cpu_per_state': cpu / max(received, 1),
+        'errors_received': counters['errors_sent'],
+        'bytes_dropped': counters['bytes_dropped'],
+    }
+
+
+def env_step(number=1000, **emulator_kwargs) -> dict:
+    """WalbiEnv.step from the normalised action to the observation, while STATE frames stream"""
+    with EmulatedRobot(**emulator_kwargs) as robot:
+        env = WalbiEnv('serial', serial_port=robot.port)
+        env.walbi.apply_settings(0)
+        env.reset()
+        robot.start_drops()
+        actions = np.random.uniform(-1, 1, (number,) + env.action_space.shape).astype(env.action_space.dtype)
+        durations = []
+        cpu_start = time.process_time()
+        for i in range(number):
+            start = time.perf_counter()
+            try:
+                env.step(actions[i])
+            except errors.WalbiError:
+                continue
+            durations.append(time.perf_counter() - start)
+        cpu = time.process_time() - cpu_start
+        env.close()
+        robot.stop()
+    result = {'steps': number, 'steps_failed': number - len(durations), 'cpu_per_step': cpu / number}
+    result.update(('step_' + key, value) for key, value in _percentiles(durations).items())
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(baud_rates=(0,), latency=0., drop_rate=0., thread_rate=None, delay_flush_message=None,
+        number=1000, duration=2., protocol_version=None) -> dict:
+    """
+    All benchmarks for each baud rate (0 for an unlimited link), as a JSON serialisable dict
+    :param protocol_version: of the emulated firmware, PROTOCOL_VERSION by default
+    """
+    results = []
+    with communication_settings(thread_rate, delay_flush_message):
+        for baud_rate in baud_rates:
+            link = {'baud_rate': baud_rate or None, 'latency': latency, 'drop_rate': drop_rate, 'seed': 0}
+            if drop_rate:
+                link['acknowledge_timeout'] = 0.1  # else a dropped OK stops the stream
+            if protocol_version is not None:
+                link['protocol_version'] = protocol_version
+            benchmarks = {
+                'action_round_trip': lambda: action_round_trip(number, stream_states=False, **link),
+                'action_round_trip_streaming': lambda: action_round_trip(number, stream_states=True, **link),
+                'state_rate': lambda: state_rate(duration, **link),
+                'env_step': lambda: env_step(number, **link),
+            }
+            for name, benchmark in benchmarks.items():
+                result = {'benchmark': name, 'baud_rate': baud_rate}
+                result.update(benchmark())
+                results.append(result)
+    return {
+        'commit': _git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'protocol_version': PROTOCOL_VERSION if protocol_version is None else min(protocol_version, PROTOCOL_VERSION),
+        'settings': {
+            'latency': latency,
+            'drop_rate': drop_rate,
+            'thread_rate': base._rate if thread_rate is None else thread_rate,
+            'delay_flush_message': BaseInterface.delay if delay_flush_message is None else delay_flush_message,
+            'number': number,
+            'duration': duration,
+        },
+        'results': results,
+    }
+
+
+def _print(report):
+    for result in report['results']:
+        baud_rate = result['baud_rate'] or 'unlimited'
+        if 'latency_p50' in result:
+            print('%-28s %9s baud: RTT p50 %7.3f ms, p99 %7.3f ms, p99.9 %7.3f ms, CPU %6.1f us/action' % (
+                result['benchmark'], baud_rate, 1e3 * result['latency_p50'], 1e3 * result['latency_p99'],
+                1e3 * result['latency_p99.9'], 1e6 * result['cpu_per_action']))
+        elif 'states_per_second' in result:
+            print('%-28s %9s baud: %7.0f STATE/s, %d dropped, CPU %6.1f us/state' % (
+                result['benchmark'], baud_rate, result['states_per_second'], result['states_dropped'],
+                1e6 * result['cpu_per_state']))
+        else:
+            print('%-28s %9s baud: step p50 %7.3f ms, p99 %7.3f ms, CPU %6.1f us/step' % (
+                result['benchmark'], baud_rate, 1e3 * result['step_p50'], 1e3 * result['step_p99'],
+                1e6 * result['cpu_per_step']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baud-rates', type=int, nargs='+', default=[0, 115200, 1000000], help='0 for an unlimited link')
+    parser.add_argument('--latency', type=float, default=0., help='[s] one way, added to every byte')
+    parser.add_argument('--drop-rate', type=float, default=0., help='probability for each byte to be lost')
+    parser.add_argument('--thread-rate', type=float, default=None, help='[s] overrides communication.thread_rate')
+    parser.add_argument('--delay-flush-message', type=float, default=None, help='[s] overrides communication.delay_flush_message')
+    parser.add_argument('--number', type=int, default=1000, help='actions and steps per benchmark')
+    parser.add_argument('--duration', type=float, default=2., help='[s] of STATE streaming')
+    parser.add_argument('--protocol-version', type=int, default=None, help='of the emulator, 8 has no ACTION_DELTA')
+    parser.add_argument('--output', default=None, help='JSON file for the results')
+    args = parser.parse_args()
+    report = run(args.baud_rates, args.latency, args.drop_rate, args.thread_rate, args.delay_flush_message,
+                 args.number, args.duration, args.protocol_version)
+    _print(report)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
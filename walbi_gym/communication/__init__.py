@@ -1,14 +1,26 @@
 from .base import BaseInterface
 from .serial_interface import SerialInterface
 from .bluetooth_interface import BluetoothClientInterface, BluetoothServerInterface
-from .socket_interface import SocketServerInterface
+from .socket_interface import SocketServerInterface, SocketPairInterface
+from .replay_interface import ReplayInterface
+from .asyncio_interface import AsyncBaseInterface, AsyncSerialInterface, AsyncSocketClientInterface, AsyncSocketServerInterface, \
+    AsyncSocketPairInterface
 
 
 INTERFACE_CLASS_MAPPING = {
     'serial': SerialInterface,
     'socket_server': SocketServerInterface,
+    'socket_pair': SocketPairInterface,
     'bluetooth_client': BluetoothClientInterface,
     'bluetooth_server': BluetoothServerInterface,
+    'replay': ReplayInterface,
+}
+
+ASYNC_INTERFACE_CLASS_MAPPING = {
+    'serial': AsyncSerialInterface,
+    'socket_client': AsyncSocketClientInterface,
+    'socket_server': AsyncSocketServerInterface,
+    'socket_pair': AsyncSocketPairInterface,
 }
 
 def make_interface(interface, *args, **kwargs):
@@ -18,3 +30,11 @@ def make_interface(interface, *args, **kwargs):
         return INTERFACE_CLASS_MAPPING[interface](*args, **kwargs)
     else:
         raise NotImplementedError('%s is not implemented yet, choose from %s' % (interface, INTERFACE_CLASS_MAPPING.keys()))
+
+def make_async_interface(interface, *args, **kwargs):
+    if isinstance(interface, AsyncBaseInterface):
+        return interface
+    elif interface in ASYNC_INTERFACE_CLASS_MAPPING:
+        return ASYNC_INTERFACE_CLASS_MAPPING[interface](*args, **kwargs)
+    else:
+        raise NotImplementedError('%s is not implemented yet, choose from %s' % (interface, ASYNC_INTERFACE_CLASS_MAPPING.keys()))
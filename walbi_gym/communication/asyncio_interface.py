@@ -0,0 +1,356 @@
+import asyncio
+import collections
+import typing
+from abc import ABC, abstractmethod
+
+import serial
+
+from walbi_gym import errors
+from walbi_gym import protocol
+from walbi_gym.protocol import Message
+from walbi_gym.communication.framing import ReceiveBuffer, FrameEncoder
+from walbi_gym.communication.serial_interface import get_serial_ports
+from walbi_gym.configuration import config
+
+
+class AsyncBaseInterface(ABC):
+    """
+    asyncio counterpart of BaseInterface, with the same framing but no thread. STATE frames are kept
+    apart from control messages and OK acknowledgements are matched in order with the commands expecting them
+    """
+    expect_or_raise_timeout = config['communication']['timeout_expect_message']
+    state_queue_size = 3  # oldest STATE frames are dropped rather than back-pressuring the link
+    debug = False
+    is_connected = False
+    protocol_version = None  # agreed with the robot by verify_version
+    link_error = None  # set once the link is lost or closed, later calls raise it
+
+    def __init__(self):
+        self._encoder = FrameEncoder()
+        self._receive_buffer = ReceiveBuffer()
+        self._pending_ok = collections.deque()  # futures, in the order their commands were sent
+        self._control_queue = None
+        self._state_queue = None
+        self.last_state = None
+        self.dropped_states = 0
+
+    @abstractmethod
+    async def _open(self):
+        """Opens the link, received bytes must be passed to _feed"""
+
+    @abstractmethod
+    def _write(self, data):
+        """Writes data without blocking, data may be reused once the call returns"""
+
+    @abstractmethod
+    async def _close(self):
+        pass
+
+    async def open(self):
+        self._control_queue = asyncio.Queue()
+        self._state_queue = asyncio.Queue(self.state_queue_size)
+        self.link_error = None
+        await self._open()
+
+    def _feed(self, nbytes: int):
+        """Parses the nbytes just written in the receive buffer"""
+        self._receive_buffer.commit(nbytes)
+        for message, param in self._receive_buffer.frames():
+            self._handle_message(message, param)
+
+    def _handle_message(self, message, param):
+        if self.debug:
+            print('Listener:', message, 'just in')
+        future = self._pop_pending() if message in (Message.OK, Message.ERROR) else None
+        if message == Message.OK and future is not None:
+            self._encoder.acknowledge(future)
+            future.set_result(None)
+        elif message == Message.ERROR and future is not None:
+            self._encoder.refuse(future)  # the refused command may have been an action
+            future.set_exception(errors.WalbiArduinoError(param[0]))
+        elif message == Message.STATE:
+            self.last_state = param
+            if self._state_queue.full():
+                self._state_queue.get_nowait()
+                self.dropped_states += 1
+            self._state_queue.put_nowait(param)
+        else:
+            self._control_queue.put_nowait((message, param))
+        if message in protocol.ACKNOWLEDGED_MESSAGES:
+            self._write(self._encoder.encode(Message.OK))
+
+    def _end_of_link(self, exception: errors.WalbiError):
+        """
+        The link is gone: the sends waiting for an OK raise exception, and so do next_state and expect_or_raise
+        once the messages received before are read. states() ends
+        """
+        if self.link_error is not None:
+            return
+        self.is_connected = False
+        self.link_error = exception
+        while self._pending_ok:
+            future = self._pending_ok.popleft()
+            if not future.done():
+                self._encoder.refuse(future)
+                future.set_exception(exception)
+        if self._state_queue is not None:  # None wakes up the readers, after the states already queued
+            if self._state_queue.full():
+                self._state_queue.get_nowait()
+                self.dropped_states += 1
+            self._state_queue.put_nowait(None)
+            self._control_queue.put_nowait((None, None))
+
+    def _pop_pending(self) -> typing.Optional[asyncio.Future]:
+        """Oldest future waiting for an OK, skipping those already done, e.g. cancelled with their task"""
+        while self._pending_ok:
+            future = self._pending_ok.popleft()
+            if not future.done():
+                return future
+        return None
+
+    async def send(self, message, param=None, expect_ok: bool = False):
+        if self.link_error is not None:
+            raise self.link_error
+        if self.debug:
+            print('sent', message)
+        future = None
+        if expect_ok:
+            future = asyncio.get_running_loop().create_future()
+            self._pending_ok.append(future)
+        self._write(self._encoder.encode(message, param, future))
+        if expect_ok:
+            try:
+                await asyncio.wait_for(future, self.expect_or_raise_timeout)
+            except asyncio.TimeoutError as e:
+                raise errors.WalbiTimeoutError(self.expect_or_raise_timeout, Message.OK) from e
+            finally:
+                if future.cancelled():  # given up on, the next OK is for the next command
+                    self._encoder.refuse(future)  # the robot may or may not have applied it
+                    try:
+                        self._pending_ok.remove(future)
+                    except ValueError:
+                        pass
+
+    async def expect_or_raise(self, expected_message: Message) -> typing.Sequence:
+        try:
+            message, param = await asyncio.wait_for(self._control_queue.get(), self.expect_or_raise_timeout)
+        except asyncio.TimeoutError as e:
+            raise errors.WalbiTimeoutError(self.expect_or_raise_timeout, expected_message) from e
+        if message is None:  # put by _end_of_link
+            self._control_queue.put_nowait((None, None))
+            raise self.link_error
+        if message == Message.ERROR:
+            raise errors.WalbiArduinoError(param[0])
+        if message != expected_message:
+            raise errors.WalbiUnexpectedMessageError(message, expected_message=expected_message)
+        return param
+
+    async def connect(self):
+        while not self.is_connected:
+            await self.send(Message.CONNECT)
+            try:
+                await self.expect_or_raise(Message.CONNECT)
+            except errors.WalbiUnexpectedMessageError as e:
+                if e.received_message == Message.ALREADY_CONNECTED:
+                    print('Arduino already connected')
+                else:
+                    raise e from e
+            except errors.WalbiError:
+                print('Waiting for Arduino...')
+                await asyncio.sleep(1)
+                continue
+            print('Connected to Arduino')
+            self.is_connected = True
+        while not self._control_queue.empty():  # late answers to repeated CONNECT
+            self._control_queue.get_nowait()
+
+    async def verify_version(self):
+        await self.send(Message.VERSION, param=[protocol.PROTOCOL_VERSION], expect_ok=True)
+        arduino_version = (await self.expect_or_raise(Message.VERSION))[0]
+        if not protocol.MIN_PROTOCOL_VERSION <= arduino_version <= protocol.PROTOCOL_VERSION:
+            raise errors.WalbiProtocolVersionError()
+        self.protocol_version = arduino_version
+        return True
+
+    async def next_state(self, timeout: typing.Optional[float] = None) -> tuple:
+        """Oldest STATE not read yet, raises link_error once the link is lost and the states received are read"""
+        try:
+            state = await asyncio.wait_for(self._state_queue.get(), timeout)
+        except asyncio.TimeoutError as e:
+            raise errors.WalbiTimeoutError(timeout, Message.STATE) from e
+        if state is None:  # put by _end_of_link, left for the other readers
+            self._state_queue.put_nowait(None)
+            raise self.link_error
+        return state
+
+    async def states(self) -> typing.AsyncIterator[tuple]:
+        """STATE frames as they arrive, until the link is lost or closed"""
+        while True:
+            try:
+                yield await self.next_state()
+            except errors.WalbiCommunicationError:
+                if self.link_error is None:
+                    raise
+                return
+
+    async def close(self):
+        print('Closing communication interface...')
+        self._end_of_link(errors.WalbiCommunicationError('Interface closed'))
+        await self._close()
+
+
+class AsyncStreamInterface(AsyncBaseInterface, ABC):
+    """Interface over asyncio streams"""
+    _reader = None
+    _writer = None
+    _read_task = None
+
+    def _start_reading(self, reader, writer):
+        self._reader, self._writer = reader, writer
+        self._read_task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    async def _read_loop(self):
+        while True:
+            free_space = self._receive_buffer.free_space()
+            try:
+                data = await self._reader.read(len(free_space))
+            except OSError as e:  # e.g. connection reset
+                self._end_of_link(errors.WalbiCommunicationError('Link lost: %s' % e))
+                return
+            if not data:  # EOF
+                self._end_of_link(errors.WalbiCommunicationError('The robot closed the link'))
+                return
+            free_space[:len(data)] = data
+            self._feed(len(data))
+
+    def _write(self, data):
+        self._writer.write(bytes(data))  # the transport may keep data until it is sent
+
+    async def _close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class AsyncSocketClientInterface(AsyncStreamInterface):
+    def __init__(self, host_address, port):
+        self.host_address = host_address
+        self.port = port
+        super().__init__()
+
+    async def _open(self):
+        self._start_reading(*await asyncio.open_connection(self.host_address, self.port))
+
+
+class AsyncSocketPairInterface(AsyncStreamInterface):
+    """Over an already connected socket, e.g. one end of socket.socketpair() given to WalbiEmulator"""
+
+    def __init__(self, client_socket):
+        self.client_socket = client_socket
+        super().__init__()
+
+    async def _open(self):
+        self._start_reading(*await asyncio.open_connection(sock=self.client_socket))
+
+
+class AsyncSocketServerInterface(AsyncStreamInterface):
+    """Waits for the robot to connect, like SocketServerInterface"""
+    _server = None
+
+    def __init__(self, host_address='', port=1):
+        self.host_address = host_address
+        self.port = port
+        super().__init__()
+
+    async def _open(self):
+        client = asyncio.get_running_loop().create_future()
+
+        def on_client(reader, writer):
+            if not client.done():
+                client.set_result((reader, writer))
+            else:
+                writer.close()
+
+        self._server = await asyncio.start_server(on_client, self.host_address, self.port)
+        self._start_reading(*await client)
+        print('Client detected over address %s' % str(self._writer.get_extra_info('peername')))
+
+    async def _close(self):
+        await super()._close()
+        if self._server is not None:
+            self._server.close()
+
+
+class AsyncSerialInterface(AsyncBaseInterface):
+    """Reads the serial file descriptor from the event loop (needs a selector loop, e.g. on Linux)"""
+    file = None
+
+    def __init__(self, serial_port='auto', baudrate=None):
+        if baudrate is None:
+            baudrate = config['communication']['baud_rate']
+        self.serial_port = serial_port
+        self.baudrate = baudrate
+        self._write_backlog = bytearray()
+        super().__init__()
+
+    async def _open(self):
+        if self.serial_port == 'auto':
+            ports = get_serial_ports()
+            if len(ports) == 0:
+                raise errors.WalbiError('No serial port found')
+            self.serial_port = ports[0]
+        # non-blocking in both directions, the event loop tells when the file is ready
+        self.file = serial.Serial(port=self.serial_port, baudrate=self.baudrate, timeout=0, writeTimeout=0)
+        asyncio.get_running_loop().add_reader(self.file.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        free_space = self._receive_buffer.free_space()
+        try:
+            nbytes = min(self.file.in_waiting, len(free_space))
+            nbytes = self.file.readinto(free_space[:nbytes]) if nbytes else 0
+        except (OSError, serial.SerialException) as e:  # e.g. the adapter was unplugged
+            self._lost(errors.WalbiCommunicationError('Link lost: %s' % e))
+            return
+        if not nbytes and len(free_space):  # readable but empty: end of file
+            self._lost(errors.WalbiCommunicationError('The robot closed the link'))
+            return
+        self._feed(nbytes)
+
+    def _lost(self, exception):
+        """Stops watching the file, which would stay readable, then ends the link"""
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self.file.fileno())
+        if self._write_backlog:
+            loop.remove_writer(self.file.fileno())
+            self._write_backlog.clear()
+        self._end_of_link(exception)
+
+    def _write(self, data):
+        if self._write_backlog:  # keep the order of frames
+            self._write_backlog += data
+            return
+        written = self._write_some(data)
+        if written < len(data):
+            self._write_backlog += data[written:]
+            asyncio.get_running_loop().add_writer(self.file.fileno(), self._on_writable)
+
+    def _write_some(self, data) -> int:
+        try:
+            return self.file.write(data) or 0
+        except serial.SerialTimeoutException:  # the output buffer is full
+            return 0
+
+    def _on_writable(self):
+        written = self._write_some(self._write_backlog)
+        del self._write_backlog[:written]
+        if not self._write_backlog:
+            asyncio.get_running_loop().remove_writer(self.file.fileno())
+
+    async def _close(self):
+        if self.file is not None:
+            loop = asyncio.get_running_loop()
+            loop.remove_reader(self.file.fileno())
+            if self._write_backlog:
+                loop.remove_writer(self.file.fileno())
+            self.file.close()
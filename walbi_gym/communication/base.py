@@ -1,4 +1,8 @@
 from abc import ABC
+import collections
+from concurrent import futures
+import io
+import selectors
 import threading
 import time
 import typing
@@ -11,6 +15,9 @@ from walbi_gym import errors
 from walbi_gym.protocol import Message
 from walbi_gym import protocol
 from walbi_gym.communication import robust_serial
+from walbi_gym.communication.framing import ReceiveBuffer, FrameEncoder
+from walbi_gym.communication.mailbox import StateMailbox
+from walbi_gym.communication.wire_log import WireLogger, RECEIVED, SENT
 from walbi_gym.configuration import config
 
 
@@ -46,24 +53,44 @@ def write_types(type_list, data, file):
 class BaseInterface(ABC):
     delay = config['communication']['delay_flush_message']  # delay for a message to be sent
     expect_or_raise_timeout = config['communication']['timeout_expect_message']
+    io_timeout = config['communication']['io_timeout']
+    state_history_size = config['communication']['state_history']
     debug = False
     file = None
     is_connected = False
+    protocol_version = None  # agreed with the robot by verify_version
+    wire_log = None
+    state_callback = None  # called by the listener with each STATE, see set_state_callback
+    link_error = None  # set once the robot closed the link, later commands fail with it
+    _selector = None
+    _selected_file = None
 
     def __init__(self):
+        # Preallocated send buffers, each frame goes out in one write
+        self._encoder = FrameEncoder()
+        # Received bytes are parsed into frames in place
+        self._receive_buffer = ReceiveBuffer()
         # Create Command queue for sending messages
         self._command_queue = CustomQueue(3)
-        self._received_queue = CustomQueue(3)
-        # Lock for accessing serial file (to avoid reading and writing at the same time)
-        self._lock = threading.Lock()
+        self._received_queue = CustomQueue(3)  # control messages, STATE frames go to the mailbox
+        self._state_mailbox = StateMailbox(history_size=self.state_history_size)
+        self.dropped_messages = 0
+        # Futures waiting for an OK, in the order their commands were written. OK carries no command id, so
+        # a future given up on must leave the deque, else every later OK would go to the command before its own
+        self._pending_ok = collections.deque()
+        self._pending_lock = threading.Lock()
+        self.state_callback_exception = None  # raised by the state callback, which was then removed
+        # The links are full-duplex: reading and writing the file have their own lock
+        self._read_lock = threading.Lock()
+        self._write_lock = threading.Lock()
         # Event to notify threads that they should terminate
         self._exit_event = threading.Event()
 
         print('Starting Communication Threads')
         # Threads for arduino communication
         self._threads = [
-            CommandThread(self, self._command_queue, self._exit_event, self._lock),
-            ListenerThread(self, self.file, self._exit_event, self._lock)
+            CommandThread(self, self._command_queue, self._exit_event, self._write_lock),
+            ListenerThread(self, self.file, self._exit_event, self._read_lock)
         ]
         for t in self._threads:
             t.start()
@@ -91,6 +118,7 @@ class BaseInterface(ABC):
             self.is_connected = True
         time.sleep(2 * self.delay)
         self._received_queue.clear()
+        self._state_mailbox.clear()
         #try:  # if we still receive CONNECT, send that we consider ourselves ALREADY_CONNECTED
         #    self.expect_or_raise(Message.CONNECT)
         #    print('Sending ALREADY_CONNECTED')
@@ -101,56 +129,243 @@ class BaseInterface(ABC):
         self._received_queue.clear()
 
     def verify_version(self):
+        """Sends our version, the robot answers with the version to speak, at most ours"""
         self.put_command(Message.VERSION, param=[protocol.PROTOCOL_VERSION], expect_ok=True)
         arduino_version = self.expect_or_raise(Message.VERSION)[0]
-        if arduino_version != protocol.PROTOCOL_VERSION:
+        if not protocol.MIN_PROTOCOL_VERSION <= arduino_version <= protocol.PROTOCOL_VERSION:
             raise errors.WalbiProtocolVersionError()
+        self.protocol_version = arduino_version
+        if self.wire_log is not None:
+            self.wire_log.set_protocol_version(arduino_version)
         return True
 
-    def _read_byte(self):
+    def _wait_readable(self, timeout: float) -> bool:
+        """Blocks until the file has bytes to read or timeout expires, polls if it cannot be waited on"""
+        if self.file is None:  # not connected yet
+            time.sleep(timeout)
+            return False
+        if self._selected_file is not self.file:
+            self._register_file()
+        if self._selector is None:
+            time.sleep(_rate)
+            return True
+        return bool(self._selector.select(timeout))
+
+    def _register_file(self):
+        self._selected_file = self.file
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
         try:
-            bytes_array = bytearray(self.file.read(1))
+            selector = selectors.DefaultSelector()
+            selector.register(self.file, selectors.EVENT_READ)
+        except (AttributeError, ValueError, OSError, io.UnsupportedOperation):  # no usable file descriptor
+            return
+        self._selector = selector
+
+    def _read_into(self, buffer: memoryview) -> int:
+        """Reads the available bytes into buffer, returns the number of bytes read"""
+        if self.file is None:  # not connected yet
+            return 0
+        try:
+            return self.file.readinto(buffer) or 0
         except (serial.SerialException, socket.error):
+            return 0
+
+    def _receive(self) -> int:
+        """Reads whatever is available into the receive buffer"""
+        free_space = self._receive_buffer.free_space()
+        nbytes = self._read_into(free_space)
+        if nbytes and self.wire_log is not None:
+            self.wire_log.log(RECEIVED, free_space[:nbytes])
+        self._receive_buffer.commit(nbytes)
+        return nbytes
+
+    def _end_of_file(self) -> bool:
+        """
+        Called by the listener when a read gave no byte. If the file was reported readable, the link was closed:
+        the futures waiting for an OK fail and the listener stops. A polled file may just have nothing to read
+        :return: (bool) whether the listener must stop
+        """
+        if self._selector is None or self._exit_event.is_set() or not len(self._receive_buffer.free_space()):
             time.sleep(_rate)
-            return None
-        if not bytes_array:
-            time.sleep(_rate)
-            return None
-        byte = bytes_array[0]
-        return byte
+            return False
+        self.link_error = errors.WalbiCommunicationError('The robot closed the link')
+        with self._pending_lock:
+            pending, self._pending_ok = self._pending_ok, collections.deque()
+        for ok_future in pending:
+            self._resolve(ok_future, self.link_error)
+        print('Link closed, listener stopping')
+        return True
+
+    def _handle_received(self):
+        # Only called by the listener thread, owner of the receive buffer
+        for message, param in self._receive_buffer.frames():
+            self._handle_message(message, param)
 
-    def _handle_message(self, message):
-        # Only called by threads respecting our _serial_lock
+    def _handle_message(self, message, param):
         if self.debug:
             print('Listener thread:', message, 'just in')
-        if message in protocol.MESSAGE_TYPES:
-            self._received_queue.put(
-                (
-                    message,
-                    read_types(protocol.MESSAGE_TYPES[message], self.file)
-                )
-            )
-            self.put_command(Message.OK)
-        else:
-            self._received_queue.put((message, None))
+        ok_future = self._pop_pending() if message in (Message.OK, Message.ERROR) else None
+        if message == Message.OK and ok_future is not None:
+            self._encoder.acknowledge(ok_future)  # before the waiter sends the next action
+            self._resolve(ok_future)
+        elif message == Message.ERROR and ok_future is not None:
+            self._encoder.refuse(ok_future)  # the refused command may have been an action
+            self._resolve(ok_future, errors.WalbiArduinoError(param[0]))
+        elif message == Message.STATE:
+            self._state_mailbox.put(param)
+        elif self._received_queue.put_drop_oldest((message, param)):  # never blocks the listener
+            self.dropped_messages += 1
+        if message in protocol.ACKNOWLEDGED_MESSAGES:
+            try:
+                self._send_reply(Message.OK)
+            except OSError as e:  # e.g. the link is lost, the listener must go on to notice it
+                print('Could not acknowledge %s: %s' % (message, e))
+                return
+        if message == Message.STATE and self.state_callback is not None:  # after the OK, the robot reads nothing else before it
+            try:
+                self.state_callback(param)
+            except Exception as e:  # the listener must go on
+                self.state_callback, self.state_callback_exception = None, e
+                print('State callback removed after raising %r' % e)
+
+    def _pop_pending(self) -> typing.Optional[futures.Future]:
+        """Oldest future waiting for an OK, skipping the cancelled ones"""
+        with self._pending_lock:
+            while self._pending_ok:
+                ok_future = self._pending_ok.popleft()
+                if not ok_future.cancelled():
+                    return ok_future
+        return None
+
+    def abandon_ok(self, ok_future):
+        """Stops waiting for the OK of ok_future, e.g. lost on the link, so that the next OK goes to the next command"""
+        with self._pending_lock:
+            ok_future.cancel()
+            try:
+                self._pending_ok.remove(ok_future)
+            except ValueError:  # already resolved
+                return
+        self._encoder.refuse(ok_future)  # the robot may or may not have applied it
+
+    def _send_reply(self, message):
+        """Answers from the listener thread directly, without waiting behind queued commands"""
+        with self._write_lock:
+            self._send_message(message, None)
+
+    def set_state_callback(self, callback: typing.Optional[typing.Callable]):
+        """
+        callback(state) is run by the listener thread with each STATE, once acknowledged. It delays the following
+        frames, so it must be short and must not wait for an OK, see send_from_listener. None removes it
+        """
+        self.state_callback = callback
 
-    def _send_message(self, message, param):
-        # Only called by threads respecting our _serial_lock
+    def send_from_listener(self, message, param=None, expect_ok: bool = False):
+        """
+        Writes a command at once from the listener thread, e.g. in a state callback, instead of queuing it
+        :return: (concurrent.futures.Future) resolved with the OK by the listener, if expect_ok
+        """
+        ok_future = futures.Future() if expect_ok else None
+        with self._write_lock:
+            self._send_message(message, param, ok_future)
+        return ok_future
+
+    def forget_last_action(self):
+        """The next ACTION_DELTA goes out as a whole ACTION, to call when an action may not have reached the robot"""
+        self._encoder.forget_last_action()
+
+    @staticmethod
+    def _resolve(future, exception=None):
+        try:
+            if exception is None:
+                future.set_result(None)
+            else:
+                future.set_exception(exception)
+        except futures.InvalidStateError:  # cancelled after a timeout
+            pass
+
+    def _send_message(self, message, param, ok_future=None):
+        # Only called by threads respecting our _write_lock
+        if self._exit_event.is_set():  # the file is being closed
+            return
+        if self.link_error is not None:  # nobody would answer
+            if ok_future is not None:
+                self._resolve(ok_future, self.link_error)
+            return
         if self.debug:
             print('Command thread: sent', message)
-        robust_serial.write_message(self.file, message)
-        if param is not None:
-            try:
-                write_types(protocol.MESSAGE_TYPES[message], param, self.file)
-            except KeyError as e:
-                raise NotImplementedError(str(message)) from e
+        if ok_future is not None:  # registered before writing, the OK cannot arrive first
+            with self._pending_lock:
+                self._pending_ok.append(ok_future)
+        frame = self._encoder.encode(message, param, ok_future)
+        self.file.write(frame)
+        if self.wire_log is not None:
+            self.wire_log.log(SENT, frame)
+
+    def start_wire_log(self, filename):
+        """Logs every received and sent byte with its host monotonic time, see ReplayInterface to play it back"""
+        self.stop_wire_log()
+        if self.protocol_version is None:  # the header is updated by verify_version
+            self.wire_log = WireLogger(filename)
+        else:
+            self.wire_log = WireLogger(filename, self.protocol_version)
+
+    def stop_wire_log(self):
+        wire_log, self.wire_log = self.wire_log, None
+        if wire_log is not None:
+            wire_log.close()
 
-    def put_command(self, message, param=None, delay: bool = True, expect_ok: bool = False):
-        self._command_queue.put((message, param))
+    def put_command(self, message, param=None, delay: bool = True, expect_ok: bool = False, block: bool = True):
+        """
+        Queues a message for the command thread
+        :param expect_ok: the robot acknowledges the message with OK, matched in order by the listener
+        :param block: wait for the OK, else return a Future resolved by the listener (param must not be modified meanwhile)
+        :return: (concurrent.futures.Future) if expect_ok and not block
+        """
+        ok_future = futures.Future() if expect_ok else None
+        self._command_queue.put((message, param, ok_future))
         if delay:
             time.sleep(self.delay)
         if expect_ok:
-            self.expect_or_raise(Message.OK)
+            if not block:
+                return ok_future
+            self.wait_ok(ok_future)
+
+    def wait_ok(self, ok_future, timeout=None):
+        """Blocks until the OK of ok_future, raises WalbiArduinoError if the robot answered ERROR instead"""
+        if timeout is None:
+            timeout = self.expect_or_raise_timeout
+        try:
+            ok_future.result(timeout=timeout)
+        except futures.TimeoutError as e:
+            self.abandon_ok(ok_future)
+            raise errors.WalbiTimeoutError(timeout, Message.OK) from e
+
+    def get_state(self, new: bool = False, timeout: typing.Optional[float] = None) -> typing.Sequence:
+        """
+        Latest received STATE, waits for the first one if there is none yet
+        :param new: wait for a STATE which was not read yet
+        """
+        if timeout is None:
+            timeout = self.expect_or_raise_timeout
+        state = self._state_mailbox.get(new=new, timeout=timeout)
+        if state is None:
+            raise errors.WalbiTimeoutError(timeout, Message.STATE)
+        return state
+
+    def state_history(self):
+        """Last state_history_size states received, oldest first"""
+        return self._state_mailbox.history()
+
+    @property
+    def states_received(self) -> int:
+        return self._state_mailbox.received
+
+    @property
+    def states_overwritten(self) -> int:
+        """STATE frames replaced by a newer one before being read"""
+        return self._state_mailbox.overwritten
 
     def expect_or_raise(self, expected_message: Message) -> typing.Sequence:
         if self.debug:
@@ -171,8 +386,16 @@ class BaseInterface(ABC):
         print('Closing communication interface...')
         self._exit_event.set()
         self._command_queue.clear()
+        self._command_queue.put_nowait((None, None, None))  # wakes up the command thread
         self.is_connected = False
+        with self._pending_lock:
+            while self._pending_ok:
+                self._pending_ok.popleft().cancel()
         for t in self._threads:
-            t.join(timeout=0.1)
+            t.join(timeout=2 * self.io_timeout)
         self._received_queue.clear()
-        self.file.close()
+        if self._selector is not None:
+            self._selector.close()
+        with self._write_lock:
+            self.file.close()
+        self.stop_wire_log()
@@ -7,7 +7,7 @@ except ImportError:
     __has_bluetooth__ = False
 
 from .socket_interface import SocketInterface, SocketServerInterface
-from walbi_gym.envs.errors import dependency_required
+from walbi_gym.errors import dependency_required
 
 
 class BluetoothServerInterface(SocketServerInterface):
@@ -0,0 +1,213 @@
+import threading
+import typing
+
+import numpy as np
+
+from walbi_gym.protocol import Message, MESSAGE_STRUCTS, ACTION_DTYPE, STATE_DTYPE, STATE_WIRE_DTYPE, \
+    ACTION_DELTA_MASK_STRUCT, ACTION_DELTA_MAX_SIZE
+from walbi_gym.configuration import config
+
+
+def _state_byte_order() -> np.ndarray:
+    """Indices of the STATE wire bytes in STATE_DTYPE order, only the motors block is reordered"""
+    motors = STATE_WIRE_DTYPE.fields['motors'][1]
+    motor_size = STATE_WIRE_DTYPE['motors'].base.itemsize
+    order = list(range(motors))  # timestamp
+    for i in range(10):  # position
+        order += [motors + i * motor_size, motors + i * motor_size + 1]
+    order += [motors + i * motor_size + 2 for i in range(10)]  # updated
+    order += list(range(motors + 10 * motor_size, STATE_WIRE_DTYPE.itemsize))  # correct_motor_reading, weight, imu
+    return np.array(order, dtype=np.intp)
+
+
+_STATE_BYTE_ORDER = _state_byte_order()
+
+
+def decode_state(payload: np.ndarray) -> np.ndarray:
+    """Decodes a STATE payload (uint8 array) into a new STATE_DTYPE record with a single gather"""
+    return payload[_STATE_BYTE_ORDER].view(STATE_DTYPE)[0]
+
+
+# Indexed by the received byte: None for unknown messages, else (Message, payload size, decode(uint8 payload array))
+_FRAME_TABLE = [None] * 256
+for _message in Message:
+    if _message == Message.ACTION_DELTA:  # only sent by the host, its size is not fixed
+        continue
+    if _message == Message.STATE:
+        _FRAME_TABLE[_message.value] = (_message, STATE_WIRE_DTYPE.itemsize, decode_state)
+    elif _message in MESSAGE_STRUCTS:
+        _FRAME_TABLE[_message.value] = (_message, MESSAGE_STRUCTS[_message].size, MESSAGE_STRUCTS[_message].unpack)
+    else:
+        _FRAME_TABLE[_message.value] = (_message, 0, None)
+
+
+class ReceiveBuffer(object):
+    """
+    Preallocated receive buffer: bytes are read straight into its free space, complete frames are
+    decoded in place and the unparsed tail is moved back to the front before the next read
+    :param size: (int) capacity in bytes, must hold the largest frame
+    """
+
+    def __init__(self, size=None):
+        if size is None:
+            size = config['communication']['receive_buffer_size']
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._array = np.frombuffer(self._buffer, dtype=np.uint8)  # payloads are handed to decoders as views
+        self._start = 0  # first unparsed byte
+        self._end = 0  # end of received bytes
+
+    def __len__(self):
+        return self._end - self._start
+
+    def free_space(self) -> memoryview:
+        """Writable view where to read new bytes, call commit with the number of bytes written"""
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._start > 0:  # at most a partial frame is left once frames are parsed
+            pending = self._end - self._start
+            self._view[:pending] = self._view[self._start:self._end]  # memmove
+            self._start, self._end = 0, pending
+        return self._view[self._end:]
+
+    def commit(self, nbytes: int):
+        self._end += nbytes
+
+    def extend(self, data):
+        """Copies data into the buffer, for readers that cannot read into a buffer"""
+        view = self.free_space()
+        view[:len(data)] = data
+        self.commit(len(data))
+
+    def frames(self) -> typing.Iterator[typing.Tuple[Message, typing.Optional[tuple]]]:
+        """
+        Yields every complete frame (message, param) in the buffer, param is None without payload,
+        a STATE_DTYPE record for STATE and a tuple of values otherwise
+        """
+        buffer, array = self._buffer, self._array
+        while self._start < self._end:
+            frame = _FRAME_TABLE[buffer[self._start]]
+            if frame is None:  # not a message, skip the byte
+                self._start += 1
+                continue
+            message, size, decode = frame
+            if decode is None:
+                self._start += 1
+                yield message, None
+                continue
+            if self._end - self._start - 1 < size:
+                return  # incomplete, wait for more bytes
+            param = decode(array[self._start + 1:self._start + 1 + size])
+            self._start += 1 + size
+            yield message, param
+
+    def clear(self):
+        self._start = self._end = 0
+
+
+class FrameEncoder(object):
+    """
+    Preallocated send buffers, the message byte followed by its payload, so that each frame goes out in one write.
+    ACTION_DELTA is encoded against the last action the robot acknowledged and the actions still waiting for their
+    OK: whichever of those the robot applied, each motor left out already has its value. The interface reports the
+    fate of each action frame with acknowledge and refuse, see encode
+    """
+
+    def __init__(self):
+        self._buffers = {}
+        for message in Message:
+            payload_size = MESSAGE_STRUCTS[message].size if message in MESSAGE_STRUCTS else 0
+            self._buffers[message] = bytearray(1 + payload_size)
+            self._buffers[message][0] = message.value
+        self._buffers[Message.ACTION_DELTA] = bytearray(1 + ACTION_DELTA_MAX_SIZE)
+        self._buffers[Message.ACTION_DELTA][0] = Message.ACTION_DELTA.value
+        # ACTION payload viewed as records to be filled straight from NumPy actions
+        self._action_records = np.frombuffer(self._buffers[Message.ACTION], dtype=ACTION_DTYPE, offset=1)
+        self._delta_records = np.frombuffer(self._buffers[Message.ACTION_DELTA], dtype=ACTION_DTYPE,
+                                            offset=1 + ACTION_DELTA_MASK_STRUCT.size)
+        self._delta_view = memoryview(self._buffers[Message.ACTION_DELTA])
+        self._action = np.zeros(10, dtype=ACTION_DTYPE)
+        self._lock = threading.Lock()  # actions are encoded and acknowledged from different threads
+        self._last_action = np.zeros(10, dtype=ACTION_DTYPE)  # acknowledged by the robot
+        self._last_action_known = False
+        self._in_flight = {}  # token: action, for the action frames waiting for their OK, in sending order
+        self._motor_bits = 1 << np.arange(10)
+
+    def forget_last_action(self):
+        """The next ACTION_DELTA is sent as a whole ACTION, e.g. after an ACTION was lost or refused"""
+        with self._lock:
+            self._last_action_known = False
+
+    def acknowledge(self, token):
+        """The frame encoded with token got its OK, the robot has its action. The OK come in sending order"""
+        with self._lock:
+            if token not in self._in_flight:  # not an action
+                return
+            while True:
+                key = next(iter(self._in_flight))
+                action = self._in_flight.pop(key)
+                if key is token:
+                    break
+            self._last_action[:] = action
+            self._last_action_known = True
+
+    def refuse(self, token):
+        """The frame encoded with token was answered with ERROR or given up on, the robot state is not known"""
+        with self._lock:
+            self._in_flight.pop(token, None)
+            self._last_action_known = False
+
+    def _track(self, action, token):
+        if token is None:  # never acknowledged, the robot state is not known once sent
+            self._in_flight.clear()
+            self._last_action_known = False
+        else:
+            self._in_flight[token] = action.copy()
+
+    def _fill_action(self, records, param):
+        if isinstance(param, np.ndarray):
+            # (10, 2) [position, span] or (10, 3) [position, span, activate]
+            records['position'] = param[:, 0]
+            records['span'] = param[:, 1]
+            records['activate'] = param[:, 2] if param.shape[1] > 2 else 1
+        else:
+            records[:] = np.frombuffer(MESSAGE_STRUCTS[Message.ACTION].pack(*param), dtype=ACTION_DTYPE)
+
+    def encode(self, message: Message, param=None, token=None) -> bytearray:
+        """
+        Fills the buffer of message with param, without allocating. The buffer is reused by the next call.
+        ACTION_DELTA takes a whole action, only its motors which differ from the last acknowledged action or from an
+        action waiting for its OK are written. The frame is a whole ACTION instead when it would not be shorter, or
+        when the acknowledged action is not known
+        :param token: identifies the OK awaited for an action frame, e.g. its future, None if no OK is awaited
+        """
+        buffer = self._buffers[message]
+        if param is None:
+            return buffer
+        if message == Message.ACTION:
+            self._fill_action(self._action_records, param)
+            with self._lock:
+                self._track(self._action_records, token)
+            return buffer
+        if message == Message.ACTION_DELTA:
+            action = self._action
+            self._fill_action(action, param)
+            with self._lock:
+                if self._last_action_known:
+                    changed = action != self._last_action
+                    for in_flight in self._in_flight.values():
+                        changed |= action != in_flight
+                    count = int(np.count_nonzero(changed))
+                if not self._last_action_known or count == len(action):  # 52 bytes, an ACTION is 50
+                    self._action_records[:] = action
+                    self._track(action, token)
+                    return self._buffers[Message.ACTION]
+                self._track(action, token)
+            ACTION_DELTA_MASK_STRUCT.pack_into(buffer, 1, int(self._motor_bits[changed].sum()))
+            self._delta_records[:count] = action[changed]
+            return self._delta_view[:1 + ACTION_DELTA_MASK_STRUCT.size + count * ACTION_DTYPE.itemsize]
+        try:
+            MESSAGE_STRUCTS[message].pack_into(buffer, 1, *param)
+        except KeyError as e:
+            raise NotImplementedError(str(message)) from e
+        return buffer
@@ -0,0 +1,60 @@
+import threading
+import typing
+
+import numpy as np
+
+from walbi_gym.protocol import STATE_DTYPE
+
+
+class StateMailbox(object):
+    """
+    Latest STATE record, replaced by the listener which never waits on the reader
+    :param history_size: (int) number of last states kept in a preallocated array, 0 keeps none
+    """
+
+    def __init__(self, history_size: int = 0):
+        self._condition = threading.Condition(threading.Lock())
+        self._latest = None
+        self._sequence = 0  # number of states put
+        self._read_sequence = 0  # sequence of the last state read
+        self.overwritten = 0  # states replaced before anyone read them
+        self._history = np.zeros(history_size, dtype=STATE_DTYPE) if history_size else None
+
+    @property
+    def received(self) -> int:
+        return self._sequence
+
+    def put(self, state):
+        with self._condition:
+            if self._read_sequence != self._sequence:
+                self.overwritten += 1
+            self._latest = state
+            if self._history is not None:
+                self._history[self._sequence % len(self._history)] = state
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def get(self, new: bool = False, timeout: typing.Optional[float] = None):
+        """
+        Returns the latest state in O(1), None if there is none within timeout
+        :param new: wait for a state that was not read yet
+        """
+        with self._condition:
+            if new or self._latest is None:
+                if not self._condition.wait_for(lambda: self._read_sequence != self._sequence and self._latest is not None, timeout):
+                    return None
+            self._read_sequence = self._sequence
+            return self._latest
+
+    def history(self) -> np.ndarray:
+        """Copy of the kept states, oldest first"""
+        if self._history is None:
+            return np.zeros(0, dtype=STATE_DTYPE)
+        with self._condition:
+            size = min(self._sequence, len(self._history))
+            return self._history[np.arange(self._sequence - size, self._sequence) % len(self._history)]
+
+    def clear(self):
+        with self._condition:
+            self._latest = None
+            self._read_sequence = self._sequence
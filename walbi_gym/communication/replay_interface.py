@@ -0,0 +1,173 @@
+import os
+import select
+import threading
+import time
+import typing
+
+from walbi_gym import errors
+from walbi_gym.protocol import Message, PROTOCOL_VERSION, MIN_PROTOCOL_VERSION
+from walbi_gym.communication.base import BaseInterface
+from walbi_gym.communication.framing import FrameEncoder, _FRAME_TABLE
+from walbi_gym.communication.wire_log import RECEIVED, read_wire_log, read_wire_log_header
+
+
+def replay_frames(filename, messages) -> typing.List[typing.Tuple[int, bytes]]:
+    """
+    Frames received in a wire log, as (timestamp [ns], bytes) where timestamp is the arrival of the
+    read which completed them, keeping only the given messages
+    """
+    frames = []
+    pending = bytearray()
+    for timestamp, direction, data in read_wire_log(filename):
+        if direction != RECEIVED:
+            continue
+        pending += data
+        kept = bytearray()
+        start = 0
+        while start < len(pending):
+            frame = _FRAME_TABLE[pending[start]]
+            if frame is None:  # not a message, as in ReceiveBuffer.frames
+                start += 1
+                continue
+            message, size, _ = frame
+            if len(pending) - start - 1 < size:
+                break
+            if message in messages:
+                kept += pending[start:start + 1 + size]
+            start += 1 + size
+        del pending[:start]
+        if kept:
+            frames.append((timestamp, bytes(kept)))
+    return frames
+
+
+class _ReplayPipe(object):
+    """
+    File of ReplayInterface: reads come from a pipe fed with the replayed frames, writes are parsed
+    so that commands expecting an acknowledgement get an OK like the robot would send.
+    Only the feeder thread writes to the pipe: write runs under the interface write lock, which the listener takes
+    to reply to the STATE it reads, so it must not wait for the pipe to drain. It counts the OKs owed instead, and
+    the feeder interleaves them with the replayed frames
+    """
+    acknowledged = (Message.ACTION, Message.ACTION_DELTA, Message.SET, Message.VERSION)
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._write_fd, False)  # a full pipe must not block close
+        self._write_lock = threading.Lock()  # held by the feeder only around os.write, so that close does not race it
+        self._ok = bytes(FrameEncoder().encode(Message.OK))
+        self._ok_lock = threading.Lock()
+        self._oks_owed = 0
+        self.ok_event = threading.Event()  # set when an OK is owed, wakes the feeder up
+        self.closed = False
+
+    def fileno(self):
+        return self._read_fd
+
+    def readinto(self, buffer):
+        return os.readv(self._read_fd, [buffer])
+
+    def feed(self, data):
+        """Writes all of data, waits while the pipe is full, raises OSError once closed. From the feeder thread only"""
+        view = memoryview(data)
+        while view:
+            with self._write_lock:
+                if self.closed:
+                    raise OSError('Replay pipe closed')
+                try:
+                    view = view[os.write(self._write_fd, view):]
+                    continue
+                except BlockingIOError:
+                    pass
+            select.select([], [self._write_fd], [], 0.1)
+
+    def feed_oks(self):
+        """Feeds the OKs owed so far"""
+        with self._ok_lock:
+            count, self._oks_owed = self._oks_owed, 0
+            self.ok_event.clear()
+        if count:
+            self.feed(self._ok * count)
+
+    def write(self, data):
+        if data and data[0] in self.acknowledged:
+            with self._ok_lock:
+                self._oks_owed += 1
+                self.ok_event.set()
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            with self._write_lock:
+                self.closed = True
+                os.close(self._write_fd)
+            os.close(self._read_fd)
+            self.ok_event.set()
+
+
+class ReplayInterface(BaseInterface):
+    """
+    Plays back the frames received in a wire log (see BaseInterface.start_wire_log) as if the robot sent them,
+    paced like the recording at speed times real time
+    :param speed: (float) 1 for real time, 0 for as fast as the listener reads
+    :param messages: received messages which are replayed, the others answered commands of the recording
+    """
+
+    def __init__(self, log_path, speed: float = 1.0, messages: typing.Sequence[Message] = (Message.STATE,)):
+        self.log_path = log_path
+        self.speed = speed
+        self.log_protocol_version = read_wire_log_header(log_path)
+        self._frames = replay_frames(log_path, set(messages))
+        self.file = _ReplayPipe()
+        self.replay_done = threading.Event()
+        self._feeder = threading.Thread(target=self._feed_loop, name='ReplayFeeder', daemon=True)
+        super().__init__()
+
+    def connect(self):
+        """Starts the playback, there is no handshake to replay"""
+        if not self._feeder.is_alive() and not self.replay_done.is_set():
+            self._feeder.start()
+        self.is_connected = True
+
+    def verify_version(self):
+        if not MIN_PROTOCOL_VERSION <= self.log_protocol_version <= PROTOCOL_VERSION:
+            raise errors.WalbiProtocolVersionError()
+        self.protocol_version = self.log_protocol_version
+        if self.wire_log is not None:
+            self.wire_log.set_protocol_version(self.protocol_version)
+        return True
+
+    def _wait(self, deadline: float = None):
+        """Feeds the OKs owed until the deadline, or once when there is none. :return: False once closed"""
+        pipe = self.file
+        while not self._exit_event.is_set():
+            pipe.feed_oks()
+            if deadline is None:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            pipe.ok_event.wait(remaining)
+        return False
+
+    def _feed_loop(self):
+        try:
+            if self._frames:
+                first = self._frames[0][0]
+                start = time.monotonic()
+                for timestamp, data in self._frames:
+                    deadline = start + (timestamp - first) / 1e9 / self.speed if self.speed else None
+                    if not self._wait(deadline):
+                        return
+                    self.file.feed(data)
+            self.replay_done.set()
+            while self._wait():  # keeps acknowledging the commands
+                self.file.ok_event.wait()
+        except OSError:  # closed
+            pass
+        finally:
+            self.replay_done.set()
+
+    def close(self):
+        super().close()
+        self._feeder.join(timeout=1)
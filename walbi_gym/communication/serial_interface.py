@@ -4,7 +4,7 @@ import glob
 
 import serial
 
-from walbi_gym.envs.errors import WalbiError
+from walbi_gym.errors import WalbiError
 from walbi_gym.configuration import config
 from walbi_gym.communication.base import BaseInterface
 
@@ -48,3 +48,10 @@ class SerialInterface(BaseInterface):
         except Exception as e:
             raise e
         super(SerialInterface, self).__init__()
+
+    def _read_into(self, buffer):
+        try:
+            nbytes = min(self.file.in_waiting, len(buffer))
+            return self.file.readinto(buffer[:nbytes]) if nbytes else 0
+        except (OSError, serial.SerialException):
+            return 0
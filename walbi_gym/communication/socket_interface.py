@@ -5,6 +5,28 @@ from warnings import warn
 from walbi_gym.communication.base import BaseInterface
 
 
+class SocketFile(object):
+    """File-like view of a connected socket, sockets do not accept new attributes such as read and write"""
+
+    def __init__(self, client_socket):
+        self.socket = client_socket
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def read(self, size=1):
+        return self.socket.recv(size)
+
+    def readinto(self, buffer):
+        return self.socket.recv_into(buffer)
+
+    def write(self, data):
+        self.socket.sendall(data)  # a frame is written at once
+
+    def close(self):
+        self.socket.close()
+
+
 class SocketInterface(BaseInterface, ABC):
     client_socket = None
     client_address = None
@@ -16,13 +38,17 @@ class SocketInterface(BaseInterface, ABC):
         self._set_client()
         if self.client_socket:
             print('Buetooth client detected over address %s' % self.client_address)
-            # Rename function to work with the lib
-            self.client_socket.read = self.client_socket.recv
-            self.client_socket.write = self.client_socket.send
-
-            self.file = self.client_socket
+            self.file = SocketFile(self.client_socket)
             super().connect()
 
+    def _read_into(self, buffer):
+        if self.file is None:
+            return 0
+        try:
+            return self.file.readinto(buffer)
+        except socket.error:
+            return 0
+
 
 class SocketServerInterface(SocketInterface):
     def __init__(self, host_address='', port=1, backlog=1):
@@ -39,3 +65,15 @@ class SocketServerInterface(SocketInterface):
         super().close()
         print("Closing server socket")	
         self.server_socket.close()
+
+
+class SocketPairInterface(SocketInterface):
+    """Over an already connected socket, e.g. one end of socket.socketpair() given to WalbiEmulator"""
+
+    def __init__(self, client_socket):
+        self.client_socket = client_socket
+        self.client_address = 'socketpair'
+        super().__init__()
+
+    def _set_client(self):
+        pass
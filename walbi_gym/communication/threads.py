@@ -1,16 +1,10 @@
 import threading
-import time
 import weakref
 try:
     import queue
 except ImportError:
     import Queue as queue
 
-from walbi_gym.protocol import Message
-from walbi_gym.configuration import config
-
-rate = config['communication']['thread_rate']
-
 
 # From https://stackoverflow.com/questions/6517953/clear-all-items-from-the-queue
 class CustomQueue(queue.Queue):
@@ -33,6 +27,21 @@ class CustomQueue(queue.Queue):
             self.queue.clear()
             self.not_full.notify_all()
 
+    def put_drop_oldest(self, item):
+        """
+        Puts item without blocking, the oldest item is dropped when the queue is full
+        :return: (bool) whether an item was dropped
+        """
+        with self.not_full:
+            dropped = 0 < self.maxsize <= self._qsize()
+            if dropped:
+                self._get()
+                self.unfinished_tasks -= 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        return dropped
+
 
 class CommandThread(threading.Thread):
     """
@@ -44,8 +53,7 @@ class CommandThread(threading.Thread):
     """
 
     def __init__(self, parent, command_queue, exit_event, lock):
-        threading.Thread.__init__(self)
-        self.deamon = True
+        threading.Thread.__init__(self, daemon=True)
         self.parent = weakref.proxy(parent)
         self.command_queue = command_queue
         self.exit_event = exit_event
@@ -53,17 +61,14 @@ class CommandThread(threading.Thread):
 
     def run(self):
         while not self.exit_event.is_set():
-            if self.exit_event.is_set():
-                break
-            try:
-                message, param = self.command_queue.get_nowait()
+            try:  # wakes up as soon as a command is queued
+                message, param, ok_future = self.command_queue.get(timeout=self.parent.io_timeout)
             except queue.Empty:
-                time.sleep(rate)
                 continue
-
+            if message is None:  # put by close
+                break
             with self.lock:
-                self.parent._send_message(message, param)
-            time.sleep(rate)
+                self.parent._send_message(message, param, ok_future)
         print('Command Thread Exited')
 
 
@@ -76,8 +81,7 @@ class ListenerThread(threading.Thread):
     """
 
     def __init__(self, parent, serial_file, exit_event, lock):
-        threading.Thread.__init__(self)
-        self.deamon = True
+        threading.Thread.__init__(self, daemon=True)
         self.parent = weakref.proxy(parent)
         self.serial_file = serial_file
         self.exit_event = exit_event
@@ -85,14 +89,14 @@ class ListenerThread(threading.Thread):
 
     def run(self):
         while not self.exit_event.is_set():
-            byte = self.parent._read_byte()
-            if byte is None:
+            if not self.parent._wait_readable(self.parent.io_timeout):
                 continue
             with self.lock:
-                try:
-                    message = Message(byte)
-                except ValueError:
-                    continue
-                self.parent._handle_message(message)
-            time.sleep(rate)
+                nbytes = self.parent._receive()
+            if not nbytes:  # readable but empty, e.g. a closed socket
+                if self.parent._end_of_file():
+                    break
+                continue
+            # parsing only touches the receive buffer, the lock is free for the command thread
+            self.parent._handle_received()
         print('Listener Thread Exited')
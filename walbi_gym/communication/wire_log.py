@@ -0,0 +1,85 @@
+import struct
+import threading
+import time
+import typing
+
+from walbi_gym import errors
+from walbi_gym.protocol import PROTOCOL_VERSION
+
+RECEIVED = 0
+SENT = 1
+
+_MAGIC = b'WALBILOG'
+_FORMAT_VERSION = 1
+_FILE_HEADER = struct.Struct('<8sBB')  # magic, format version, protocol version
+_PROTOCOL_VERSION_OFFSET = 9
+_RECORD_HEADER = struct.Struct('<qBI')  # host time.monotonic_ns(), direction, number of bytes
+
+
+class WireLogger(object):
+    """
+    Appends every chunk of bytes received or sent by an interface to a binary file, each record
+    being a host monotonic timestamp [ns], the direction (RECEIVED or SENT) and the bytes themselves
+    :param protocol_version: (int) spoken on the wire, the header is updated by set_protocol_version once the
+        robot agreed on one
+    """
+
+    def __init__(self, filename, protocol_version: int = PROTOCOL_VERSION):
+        self.filename = filename
+        self._lock = threading.Lock()  # the listener and the command thread both log
+        self._file = open(filename, 'wb')
+        self._file.write(_FILE_HEADER.pack(_MAGIC, _FORMAT_VERSION, protocol_version))
+
+    def set_protocol_version(self, protocol_version: int):
+        """Rewrites the protocol version of the header, e.g. when the log was started before the handshake"""
+        with self._lock:
+            if self._file is None:
+                return
+            position = self._file.tell()
+            self._file.seek(_PROTOCOL_VERSION_OFFSET)
+            self._file.write(bytes((protocol_version,)))
+            self._file.seek(position)
+
+    def log(self, direction: int, data):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(_RECORD_HEADER.pack(time.monotonic_ns(), direction, len(data)))
+            self._file.write(data)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_wire_log_header(filename) -> int:
+    """:return: (int) protocol version of the log"""
+    with open(filename, 'rb') as f:
+        return _read_header(f)
+
+
+def _read_header(f) -> int:
+    data = f.read(_FILE_HEADER.size)
+    if len(data) < _FILE_HEADER.size:
+        raise errors.WalbiError('%s is not a wire log' % f.name)
+    magic, format_version, protocol_version = _FILE_HEADER.unpack(data)
+    if magic != _MAGIC or format_version != _FORMAT_VERSION:
+        raise errors.WalbiError('%s is not a wire log of format %d' % (f.name, _FORMAT_VERSION))
+    return protocol_version
+
+
+def read_wire_log(filename) -> typing.Iterator[typing.Tuple[int, int, bytes]]:
+    """Yields the records (timestamp [ns], direction, data) of a wire log, a truncated last record is ignored"""
+    with open(filename, 'rb') as f:
+        _read_header(f)
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+            timestamp, direction, size = _RECORD_HEADER.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
+                return
+            yield timestamp, direction, data
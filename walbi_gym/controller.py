@@ -0,0 +1,107 @@
+import threading
+import time
+import typing
+
+import numpy as np
+
+from walbi_gym.envs.wrappers.pid_control import ArrayPID
+
+
+class StateController(object):
+    """
+    Inner control loop run by the listener thread at each STATE, so at the rate set with Walbi.apply_settings whatever
+    the speed of the agent. From the latest setpoint and the received STATE it computes motor positions and sends them
+    as an ACTION, written directly without going through the command queue. The agent only calls set_setpoint.
+    An ACTION is only sent once the previous one is acknowledged, the STATE received meanwhile are counted as skipped.
+    An OK missing for longer than the interface timeout is given up on and counted in errors.
+    The STATE interval must not be 0: the firmware could send the next STATE before the ACTION arrives, and it answers
+    any message but OK received while a STATE waits for its acknowledgement with ERROR EXPECTED_OK.
+    Example:
+        controller = StateController(walbi, K=[(0.5, 0.1, 0)] * 10)
+        controller.start()
+        controller.set_setpoint(positions)  # from the agent, at any rate
+    :param K: (p, i, d) gains per motor of an ArrayPID on raw positions, the ACTION is position - PID output
+    :param control: control(setpoint, state) -> (10,) raw positions, e.g. a trajectory tracker, replaces the PID
+    :param span: [ms] of each ACTION, a scalar or one per motor
+    :param tolerance: [ticks] motors within tolerance of their previous setpoint hold still, see ArrayPID.set_target
+    Without K nor control, the setpoint is sent as is
+    """
+
+    def __init__(self, walbi, K: typing.Sequence[typing.Tuple[float, float, float]] = None,
+                 control: typing.Callable = None, span=0, tolerance: float = 0.):
+        self.walbi = walbi
+        self.control = control
+        self.pid = None
+        if K is not None:
+            K = np.asarray(K, dtype=np.float64)
+            self.pid = ArrayPID(K[..., 0], K[..., 1], K[..., 2], shape=(10,))
+        self.tolerance = tolerance
+        self._setpoint = None  # replaced as a whole by the agent, read by the listener
+        self._action = np.zeros((10, 3), dtype=np.int16)  # [position, span, activate]
+        self._action[:, 1] = span
+        self._action[:, 2] = 1
+        self._positions = np.zeros(10)
+        self._low, self._high = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+        self._ok_future = None
+        self._sent_time = 0.
+        self._stopped = threading.Event()
+        self.states = 0
+        self.actions_sent = 0
+        self.skipped = 0  # STATE received while the previous ACTION was not acknowledged
+        self.errors = 0  # ACTION answered with ERROR or never acknowledged
+        self.exception = None  # raised by control, the controller then stops
+
+    def set_setpoint(self, positions):
+        """:param positions: (10,) raw target positions, None to stop sending actions"""
+        self._setpoint = None if positions is None else np.array(positions, dtype=np.float64)
+
+    @property
+    def setpoint(self):
+        return self._setpoint
+
+    def start(self):
+        if self.pid is not None:
+            self.pid.reset()
+        self._stopped.clear()
+        self.walbi.interface.set_state_callback(self._on_state)
+
+    def stop(self):
+        self._stopped.set()
+        if self.walbi.interface.state_callback == self._on_state:
+            self.walbi.interface.set_state_callback(None)
+
+    def _on_state(self, state):
+        self.states += 1
+        setpoint = self._setpoint
+        if setpoint is None or self._stopped.is_set():
+            return
+        ok_future = self._ok_future
+        if ok_future is not None:
+            if not ok_future.done():
+                if time.monotonic() - self._sent_time < self.walbi.interface.expect_or_raise_timeout:
+                    self.skipped += 1
+                    return
+                self.walbi.interface.abandon_ok(ok_future)  # lost, the next OK is for the next ACTION
+            if ok_future.cancelled() or ok_future.exception() is not None:
+                self.errors += 1
+        try:
+            positions = self._positions
+            if self.control is not None:
+                positions[:] = self.control(setpoint, state)
+            elif self.pid is not None:
+                feedback = state['position']
+                self.pid.set_target(setpoint, feedback, self.tolerance)
+                np.subtract(feedback, self.pid(feedback, state['timestamp'] / 1000), out=positions)
+            else:
+                positions[:] = setpoint
+            np.clip(positions, self._low, self._high, out=positions)
+            np.rint(positions, out=positions)
+            self._action[:, 0] = positions
+        except Exception as e:  # the listener thread must go on
+            self.exception = e
+            self._stopped.set()
+            return
+        self._sent_time = time.monotonic()
+        message = self.walbi.action_message
+        self._ok_future = self.walbi.interface.send_from_listener(message, self._action, expect_ok=True)
+        self.actions_sent += 1
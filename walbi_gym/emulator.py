@@ -0,0 +1,436 @@
+"""
+Python emulation of the Walbi.cpp message loop, attached to a pseudo-terminal or a socket pair so that
+the stock interfaces talk to it as to the Arduino. Example:
+    with WalbiEmulator(baud_rate=115200, latency=0.002) as emulator:
+        walbi = Walbi('serial', serial_port=emulator.port)
+"""
+import collections
+import functools
+import os
+import select
+import selectors
+import socket
+import struct
+import threading
+import time
+import tty
+
+import numpy as np
+
+from walbi_gym.protocol import Message, MESSAGE_STRUCTS, PROTOCOL_VERSION, MIN_PROTOCOL_VERSION, ACTION_DELTA_VERSION, \
+    ACTION_DELTA_MASK_STRUCT, STATE_WIRE_DTYPE, compile_types
+from walbi_gym.envs.simulated import LX16AArray
+from walbi_gym.envs.kinematics import WalbiKinematics
+from walbi_gym.configuration import config
+
+# error codes written by the firmware, see ERROR_CODES
+RECEIVED_UNKNOWN_MESSAGE = 0
+EXPECTED_OK = 1
+DID_NOT_EXPECT_MESSAGE = 3
+
+# robust_serial.cpp read timeouts [s]
+_READ_TIMEOUTS = {1: 0.1, 2: 0.1, 4: 0.2}
+
+_io_timeout = config['communication']['io_timeout']
+
+
+@functools.lru_cache(maxsize=None)
+def _delta_struct(motors: int):
+    """ACTION_DELTA payload after the mask"""
+    return compile_types(['int16', 'int16', 'int8'] * motors)
+
+
+class _Closed(Exception):
+    """The emulator is closing, unwinds the firmware loop"""
+
+
+class _Link(object):
+    """
+    One direction of the emulated link. Bytes take 10 bit times each at baud_rate (start, 8 data, stop bits),
+    arrive latency later and are dropped with probability drop_rate. Without delays bytes are handed to sink at once
+    """
+
+    def __init__(self, sink, baud_rate=None, latency=0., drop_rate=0., rng=None, name='Link'):
+        self.sink = sink
+        self.byte_time = 10. / baud_rate if baud_rate else 0.
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.rng = rng if rng is not None else np.random.RandomState()
+        self.bytes_sent = 0
+        self.bytes_dropped = 0
+        self.passthrough = not (self.byte_time or self.latency)
+        self._in_flight = collections.deque()  # (arrival time, bytes)
+        self._condition = threading.Condition()
+        self._busy_until = 0.
+        self._closed = False
+        self._thread = None
+        if not self.passthrough:
+            self._thread = threading.Thread(target=self._deliver_loop, name=name, daemon=True)
+            self._thread.start()
+
+    def send(self, data):
+        size = len(data)
+        self.bytes_sent += size
+        if self.drop_rate:
+            kept = self.rng.random_sample(size) >= self.drop_rate
+            data = np.frombuffer(data, dtype=np.uint8)[kept].tobytes()
+            self.bytes_dropped += size - len(data)
+        if self.passthrough:
+            if data:
+                self.sink(data)
+            return
+        with self._condition:
+            # dropped bytes still occupied the line
+            self._busy_until = max(time.monotonic(), self._busy_until) + size * self.byte_time
+            self._in_flight.append((self._busy_until + self.latency, bytes(data)))  # the caller reuses its buffer
+            self._condition.notify()
+
+    def _deliver_loop(self):
+        while True:
+            with self._condition:
+                while not self._in_flight and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                arrival, data = self._in_flight[0]
+                delay = arrival - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)  # woken up early by new bytes or close
+                    continue
+                self._in_flight.popleft()
+            if data:
+                try:
+                    self.sink(data)
+                except (OSError, _Closed):
+                    return
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+
+class _InputBuffer(object):
+    """Serial receive buffer of the emulated Arduino"""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._condition = threading.Condition()
+        self.closed = False
+
+    def append(self, data):
+        with self._condition:
+            self._data += data
+            self._condition.notify()
+
+    def available(self) -> int:
+        return len(self._data)
+
+    def wait(self, size=1, timeout=None) -> bool:
+        """Waits until size bytes are available, like wait_for_bytes, raises _Closed once closed"""
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._data) >= size or self.closed, timeout)
+            if self.closed:
+                raise _Closed()
+            return len(self._data) >= size
+
+    def peek(self) -> int:
+        return self._data[0]
+
+    def read(self, size) -> bytes:
+        """Reads up to size bytes without waiting, missing bytes read as 0xFF like Serial.read returning -1"""
+        with self._condition:
+            data = bytes(self._data[:size])
+            del self._data[:size]
+        return data + b'\xff' * (size - len(data))
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class WalbiEmulator(object):
+    """
+    Emulates the Arduino running Walbi.cpp: the CONNECT / ALREADY_CONNECTED handshake, VERSION, SET of the STATE interval,
+    ACTION and ACTION_DELTA answered with OK and STATE frames sent every interval, each waiting for its OK. The ten
+    motors are LX16A models moving in real time (the span of an ACTION is not modelled), weight and IMU come from
+    WalbiKinematics.
+    The host connects with Walbi('serial', serial_port=emulator.port) or Walbi('socket_pair', client_socket=emulator.host_socket)
+    :param link: 'pty' for a Linux pseudo-terminal, 'socketpair' for socket.socketpair()
+    :param baud_rate: (int) emulated bandwidth in both directions, None for as fast as the link goes
+    :param latency: (float) [s] added to every byte in both directions
+    :param drop_rate: (float) probability for each byte to be lost, in both directions
+    :param sensors: (bool) compute weight and IMU, else they are sent as 0
+    :param initial_position: motor positions at start, the centred pose by default
+    :param seed: (int) seed of the byte drops
+    :param strict_acknowledge: (bool) as Walbi.cpp, any byte but OK received while a STATE or VERSION awaits its OK
+    is answered with ERROR EXPECTED_OK, e.g. a command sent while STATE are streamed. Else such messages are handled
+    while waiting
+    :param acknowledge_timeout: (float) [s] give up waiting for an OK, the firmware waits forever, e.g. for a dropped OK
+    :param protocol_version: (int) of the emulated firmware, e.g. 8 to answer ACTION_DELTA like a firmware without it
+    """
+    protocol_version = PROTOCOL_VERSION
+
+    def __init__(self, link='pty', baud_rate=None, latency=0., drop_rate=0., sensors=True,
+                 initial_position=None, seed=None, strict_acknowledge=False, acknowledge_timeout=None,
+                 protocol_version=None):
+        if link == 'pty':
+            self._fd, slave = os.openpty()
+            tty.setraw(self._fd)
+            tty.setraw(slave)
+            self.port = os.ttyname(slave)
+            self._slave = slave  # kept open so that the master does not fail while the host reopens the port
+            self.host_socket = None
+        elif link == 'socketpair':
+            self._socket, self.host_socket = socket.socketpair()
+            self._fd = self._socket.fileno()
+            self._slave = None
+            self.port = None
+        else:
+            raise ValueError('Unknown link %s, choose from pty or socketpair' % link)
+        self.link = link
+        if protocol_version is not None:
+            self.protocol_version = protocol_version
+        self.strict_acknowledge = strict_acknowledge
+        self.acknowledge_timeout = acknowledge_timeout
+        os.set_blocking(self._fd, False)
+        rng = np.random.RandomState(seed)
+        self._stopped = threading.Event()
+        self._input = _InputBuffer()
+        self.uplink = _Link(self._input.append, baud_rate, latency, drop_rate, rng, name='EmulatorUplink')
+        self.downlink = _Link(self._write_fd, baud_rate, latency, drop_rate, rng, name='EmulatorDownlink')
+
+        if initial_position is None:
+            initial_position = WalbiKinematics.neutral_positions
+        self.motors = LX16AArray(initial_position=np.array(initial_position, dtype=np.float64), integrator='exact')
+        self.targets = self.motors.position_encoder.copy()
+        self.kinematics = WalbiKinematics() if sensors else None
+        self._state = np.zeros((), dtype=STATE_WIRE_DTYPE)
+        self._state['motors']['updated'] = 1
+        self._state['correct_motor_reading'] = 1
+        self._state_frame = bytearray(1 + STATE_WIRE_DTYPE.itemsize)
+        self._state_frame[0] = Message.STATE.value
+        self._start_time = time.monotonic()
+        self._last_move = self._last_refresh = self._start_time
+
+        self.is_connected = False
+        self.state_interval = 0  # [ms] intervalSendState_
+        self._last_state_sent = 0.  # [ms]
+        self.last_action = None
+        self.messages_received = collections.Counter()
+        self.actions_received = 0
+        self.states_sent = 0
+        self.errors_sent = 0
+        self.acknowledge_timeouts = 0
+
+        self._threads = [
+            threading.Thread(target=self._read_loop, name='EmulatorReader', daemon=True),
+            threading.Thread(target=self._run, name='EmulatorFirmware', daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def millis(self) -> float:
+        return (time.monotonic() - self._start_time) * 1000
+
+    # Link
+
+    def _read_loop(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._fd, selectors.EVENT_READ)
+        try:
+            while not self._stopped.is_set():
+                if not selector.select(_io_timeout):
+                    continue
+                try:
+                    data = os.read(self._fd, 4096)
+                except BlockingIOError:
+                    continue
+                except OSError:  # the pty has no reader, the host may open it again
+                    self._stopped.wait(_io_timeout)
+                    continue
+                if not data:  # the host closed its socket
+                    break
+                self.uplink.send(data)
+        finally:
+            selector.close()
+
+    def _write_fd(self, data):
+        view = memoryview(data)
+        while view:
+            if self._stopped.is_set():
+                raise _Closed()
+            try:
+                view = view[os.write(self._fd, view):]
+            except BlockingIOError:  # the host does not read, wait like a full serial buffer
+                select.select([], [self._fd], [], _io_timeout)
+
+    def _write(self, data):
+        self.downlink.send(data)
+
+    def _write_error(self, code):
+        self.errors_sent += 1
+        self._write(bytes((Message.ERROR.value, code)))
+
+    def _read(self, size) -> bytes:
+        """Reads size bytes with the timeout of robust_serial.cpp"""
+        self._input.wait(size, _READ_TIMEOUTS[size])
+        return self._input.read(size)
+
+    def _read_payload(self, message) -> tuple:
+        return self._read_struct(MESSAGE_STRUCTS[message])
+
+    def _read_struct(self, frame_struct) -> tuple:
+        """Reads field by field like the firmware, at once when all the bytes are there"""
+        if self._input.available() >= frame_struct.size:
+            return frame_struct.unpack(self._input.read(frame_struct.size))
+        data = b''.join(self._read(struct.calcsize(code)) for code in frame_struct.format[1:])
+        return frame_struct.unpack(data)
+
+    def _wait_acknowledge(self) -> bool:
+        while True:
+            if not self._input.wait(1, self.acknowledge_timeout):  # waitForSerial blocks until a byte arrives
+                self.acknowledge_timeouts += 1
+                return False
+            if self._input.peek() == Message.OK.value:
+                self._input.read(1)
+                return True
+            if self.strict_acknowledge:
+                self._input.read(1)
+                self._write_error(EXPECTED_OK)
+                return False
+            self._handle_message()
+
+    # Firmware
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                self._handle_message()
+                if self.is_connected:
+                    remaining = self.state_interval - (self.millis() - self._last_state_sent)
+                    if remaining <= 0:
+                        self._send_state()
+                        continue
+                    timeout = remaining / 1000
+                else:
+                    timeout = _io_timeout
+                self._input.wait(1, timeout)
+        except (OSError, _Closed):  # stopped, or the host closed the socket pair
+            pass
+
+    def _handle_message(self):
+        """Walbi::handleMessagesFromSerial, handles at most one message"""
+        if not self._input.available():
+            return
+        byte = self._input.read(1)[0]
+        try:
+            message = Message(byte)
+        except ValueError:
+            message = None
+        self.messages_received[message] += 1
+        if message == Message.CONNECT:
+            if not self.is_connected:
+                self.is_connected = True
+                self._write(bytes((Message.CONNECT.value,)))
+            else:
+                self._write(bytes((Message.ALREADY_CONNECTED.value,)))
+        elif message == Message.ALREADY_CONNECTED:
+            self.is_connected = True
+        elif message == Message.ERROR:
+            self._write_error(DID_NOT_EXPECT_MESSAGE)
+        elif message == Message.VERSION:
+            host_version = self._read_payload(Message.VERSION)[0]
+            version = self.protocol_version
+            if host_version >= MIN_PROTOCOL_VERSION:  # else the host rejects our version
+                version = min(version, host_version)
+            self._write(bytes((Message.OK.value, Message.VERSION.value, version)))
+            self._wait_acknowledge()
+        elif message == Message.SET:
+            self.state_interval = self._read_payload(Message.SET)[0]
+            self._write(bytes((Message.OK.value,)))
+        elif message == Message.ACTION:
+            action = np.array(self._read_payload(Message.ACTION)).reshape(10, 3)
+            self._write(bytes((Message.OK.value,)))
+            self.act(action)
+        elif message == Message.ACTION_DELTA and self.protocol_version >= ACTION_DELTA_VERSION:
+            mask = self._read_struct(ACTION_DELTA_MASK_STRUCT)[0]
+            motors = [i for i in range(10) if mask >> i & 1]
+            records = self._read_struct(_delta_struct(len(motors)))
+            self._write(bytes((Message.OK.value,)))
+            action = self.current_action()
+            action[motors] = np.array(records).reshape(-1, 3)
+            self.act(action)
+        elif message == Message.STATE:
+            self._write(bytes((Message.OK.value,)))
+            self._send_state()
+        else:  # including OK when no acknowledgement is awaited
+            self._write_error(RECEIVED_UNKNOWN_MESSAGE)
+
+    def current_action(self) -> np.ndarray:
+        """(10, 3) copy of the command of each motor, the base of an ACTION_DELTA"""
+        if self.last_action is not None:
+            return self.last_action.copy()
+        return np.stack([self.targets, np.zeros(10), np.ones(10)], axis=1).astype(np.int64)
+
+    def act(self, action):
+        """:param action: (10, 3) [position, span, activate], unloaded motors stop where they are"""
+        self.actions_received += 1
+        self.last_action = action
+        active = action[:, 2] != 0
+        if active.all() and np.array_equal(action[:, 0], self.targets):
+            return  # the motors keep moving as they are, no need to catch up now
+        self._move_motors()  # the previous targets applied until now
+        self.targets[active] = action[active, 0]
+        self.targets[~active] = np.trunc(self.motors.position_encoder[~active])
+        self.motors.reset(self.targets[~active], where=~active)
+
+    def _move_motors(self):
+        now = time.monotonic()
+        dt = now - self._last_move
+        self._last_move = now
+        if dt > 0:
+            self.motors.step(dt, self.targets)
+
+    def refresh_state(self) -> np.ndarray:
+        """Moves the motors up to now and fills the STATE record, as Walbi::getState"""
+        self._move_motors()
+        dt = self._last_move - self._last_refresh
+        self._last_refresh = self._last_move
+        positions = np.rint(self.motors.position_encoder)
+        self._state['timestamp'] = int(self.millis()) & 0x7FFFFFFF
+        self._state['motors']['position'] = positions
+        if self.kinematics is not None:
+            self._state['weight'], self._state['imu'] = self.kinematics.sensors(positions, dt)
+        return self._state
+
+    def _send_state(self):
+        self._state_frame[1:] = self.refresh_state().tobytes()
+        self._write(self._state_frame)
+        self.states_sent += 1
+        if self._wait_acknowledge():
+            self._last_state_sent = self.millis()
+
+    def close(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._input.close()
+        self.uplink.close()
+        self.downlink.close()
+        for t in self._threads:
+            t.join(timeout=1)
+        if self.link == 'pty':
+            os.close(self._fd)
+            os.close(self._slave)
+        else:
+            self._socket.close()
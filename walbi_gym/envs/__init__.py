@@ -1,2 +1,3 @@
-from walbi_gym.envs.walbi import WalbiEnv
-from walbi_gym.envs.mock import WalbiMockEnv
+from walbi_gym.envs.env import WalbiEnv
+from walbi_gym.envs.mock import WalbiMockEnv, WalbiMockVecEnv
+from walbi_gym.envs.control_loop import ControlLoop, LoopStatistics
@@ -0,0 +1,171 @@
+import threading
+import time
+import typing
+
+import numpy as np
+
+OVERRUN_POLICIES = ('skip', 'catch_up', 'degrade')
+
+
+class LoopStatistics(object):
+    """
+    Timings of the iterations of a ControlLoop, kept in fixed log-spaced histograms so that memory does not grow.
+    Latency is the duration of the policy and the step, jitter the delay of the start of an iteration after its deadline
+    """
+    bin_edges = np.geomspace(1e-6, 10, 141)  # [s] 20 bins per decade, plus one below and one above
+
+    def __init__(self, period: float):
+        self.period = period
+        self.iterations = 0
+        self.missed_deadlines = 0  # iterations which ended after the deadline of the next one
+        self.skipped_deadlines = 0  # deadlines dropped by the 'skip' policy or after too much catching up
+        self.degraded_iterations = 0  # iterations run at a lower rate by the 'degrade' policy
+        self.latency_histogram = np.zeros(len(self.bin_edges) + 1, dtype=np.int64)
+        self.jitter_histogram = np.zeros(len(self.bin_edges) + 1, dtype=np.int64)
+        self.latency_sum = self.jitter_sum = 0.
+        self.latency_max = self.jitter_max = 0.
+
+    def record(self, latency: float, jitter: float, missed: bool):
+        self.iterations += 1
+        self.missed_deadlines += missed
+        self.latency_histogram[np.searchsorted(self.bin_edges, latency)] += 1
+        self.jitter_histogram[np.searchsorted(self.bin_edges, jitter)] += 1
+        self.latency_sum += latency
+        self.jitter_sum += jitter
+        self.latency_max = max(self.latency_max, latency)
+        self.jitter_max = max(self.jitter_max, jitter)
+
+    def percentile(self, histogram: np.ndarray, q: float, maximum: float = np.inf) -> float:
+        """Upper edge of the bin holding the q-th percentile, within 12% above the exact value, at most maximum"""
+        if not histogram.any():
+            return 0.
+        index = np.searchsorted(np.cumsum(histogram), q / 100 * histogram.sum())
+        return float(min(self.bin_edges[min(index, len(self.bin_edges) - 1)], maximum))
+
+    def summary(self) -> dict:
+        iterations = max(self.iterations, 1)
+        return {
+            'rate': 1 / self.period,
+            'iterations': self.iterations,
+            'missed_deadlines': self.missed_deadlines,
+            'skipped_deadlines': self.skipped_deadlines,
+            'degraded_iterations': self.degraded_iterations,
+            'latency_mean': self.latency_sum / iterations,
+            'latency_p50': self.percentile(self.latency_histogram, 50, self.latency_max),
+            'latency_p99': self.percentile(self.latency_histogram, 99, self.latency_max),
+            'latency_max': self.latency_max,
+            'jitter_mean': self.jitter_sum / iterations,
+            'jitter_p99': self.percentile(self.jitter_histogram, 99, self.jitter_max),
+            'jitter_max': self.jitter_max,
+        }
+
+    def __str__(self):
+        summary = self.summary()
+        return ('%d iterations at %.0f Hz, %d missed and %d skipped deadlines, %d degraded, latency p50 %.2f ms p99 %.2f ms '
+                'max %.2f ms, jitter p99 %.2f ms max %.2f ms') % (
+            summary['iterations'], summary['rate'], summary['missed_deadlines'], summary['skipped_deadlines'],
+            summary['degraded_iterations'], 1e3 * summary['latency_p50'], 1e3 * summary['latency_p99'],
+            1e3 * summary['latency_max'], 1e3 * summary['jitter_p99'], 1e3 * summary['jitter_max'])
+
+
+class ControlLoop(object):
+    """
+    Runs action = policy(observation) and env.step(action) at a fixed rate. Iteration k is due at start + k * period on the
+    monotonic clock, so that late wake-ups do not accumulate into drift. Works with WalbiEnv and its wrappers.
+    Example:
+        loop = ControlLoop(env, rate=100, overrun='skip')
+        statistics = loop.run(policy, steps=1000)
+    :param rate: (float) [Hz]
+    :param overrun: when an iteration ends after the deadline of the next one,
+        'skip' drops the missed deadlines and waits for the next one of the schedule,
+        'catch_up' runs the late iterations back to back until on schedule again, at most max_catch_up periods behind,
+        'degrade' divides the rate by degrade_factor (down to max_degrade times) and restores it once
+        recover_after iterations in a row fit in the nominal period
+    :param spin: (float) [s] the end of each wait is spent polling the clock, time.sleep wakes up late by about 0.1 ms
+    :param reset_on_done: reset the env when a step returns done, within the same iteration
+    """
+
+    def __init__(self, env, rate: float = 100., overrun: str = 'skip', max_catch_up: int = 10,
+                 degrade_factor: int = 2, max_degrade: int = 3, recover_after: int = 10,
+                 spin: float = 0.0002, reset_on_done: bool = True, clock: typing.Callable[[], float] = time.monotonic):
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError('Unknown overrun policy %s, choose from %s' % (overrun, OVERRUN_POLICIES))
+        self.env = env
+        self.period = 1. / rate
+        self.overrun = overrun
+        self.max_catch_up = max_catch_up
+        self.degrade_factor = degrade_factor
+        self.max_degrade = max_degrade
+        self.recover_after = recover_after
+        self.spin = spin
+        self.reset_on_done = reset_on_done
+        self.clock = clock
+        self.degrade_level = 0
+        self.statistics = LoopStatistics(self.period)
+        self._stop_event = threading.Event()
+
+    @property
+    def current_period(self) -> float:
+        return self.period * self.degrade_factor ** self.degrade_level
+
+    def stop(self):
+        """Ends run after the current iteration, from any thread"""
+        self._stop_event.set()
+
+    def _wait_until(self, deadline: float):
+        while not self._stop_event.is_set():
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                return
+            if remaining > self.spin:
+                time.sleep(min(remaining - self.spin, 0.1))  # oversleeps less than Event.wait
+
+    def run(self, policy: typing.Callable, steps: int = None, observation=None,
+            on_step: typing.Callable = None) -> LoopStatistics:
+        """
+        :param policy: action = policy(observation)
+        :param steps: (int) iterations to run, until stop by default
+        :param observation: first observation, the env is reset if None
+        :param on_step: called with (observation, reward, done, info) after each step, outside of the timing
+        :return: the statistics, accumulated over the runs of this loop
+        """
+        self._stop_event.clear()
+        if observation is None:
+            observation = self.env.reset()
+        statistics = self.statistics
+        anchor, index = self.clock(), 0  # deadline of iteration index is anchor + index * current_period
+        on_time = 0
+        iteration = 0
+        while (steps is None or iteration < steps) and not self._stop_event.is_set():
+            period = self.current_period
+            deadline = anchor + index * period
+            self._wait_until(deadline)
+            start = self.clock()
+            observation, reward, done, info = self.env.step(policy(observation))
+            if self.reset_on_done and np.ndim(done) == 0 and done:  # vectorized envs reset their robots themselves
+                observation = self.env.reset()
+            end = self.clock()
+            next_deadline = deadline + period
+            missed = end > next_deadline
+            statistics.record(end - start, max(start - deadline, 0.), missed)
+            statistics.degraded_iterations += self.degrade_level > 0
+            iteration += 1
+            index += 1
+            if missed:
+                late = int((end - deadline) // period)  # later deadlines passed during this iteration
+                if self.overrun == 'skip' or (self.overrun == 'catch_up' and late > self.max_catch_up):
+                    statistics.skipped_deadlines += late
+                    index += late
+                elif self.overrun == 'degrade':
+                    self.degrade_level = min(self.degrade_level + 1, self.max_degrade)
+                    anchor, index = end, 0
+                on_time = 0
+            elif self.degrade_level and end - start <= self.period:
+                on_time += 1
+                if on_time >= self.recover_after:
+                    self.degrade_level -= 1
+                    anchor, index = next_deadline, 0
+                    on_time = 0
+            if on_step is not None:
+                on_step(observation, reward, done, info)
+        return statistics
@@ -1,10 +1,11 @@
+import collections
 from typing import TypeVar, List, Tuple, Sequence
 
 import numpy as np
 from gym import Env, spaces
 
 from walbi_gym.configuration import config
-from walbi_gym.envs.utils import constrain_spaces
+from walbi_gym.envs.utils import SpaceConverter
 from walbi_gym.walbi import Walbi
 
 
@@ -39,14 +40,25 @@ class WalbiEnv(Env):
         dtype=np.int16
     )
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, max_pending_actions: int = 0, reuse_observation: bool = False, **kwargs):
+        """
+        :param max_pending_actions: number of actions step may leave unacknowledged, 0 waits for the OK of each action
+        :param reuse_observation: the observation and info['is_position_updated'] are written in place at each step
+            and reset instead of being new arrays, copy them to keep them
+        """
         self.walbi = Walbi(*args, **kwargs)
+        self.max_pending_actions = max_pending_actions
+        self._pending_actions = collections.deque()
+        self._observation, self._is_position_updated = None, None  # new arrays each time
+        if reuse_observation:
+            self._observation = np.empty(self.observation_space.shape, dtype=self.observation_space.dtype)
+            self._is_position_updated = np.empty(self.raw_observation_space.shape, dtype=np.bool_)
 
     def reset(self, return_interpretation: bool=False) -> ObservationType:
         state = self.walbi.get_last_state()
         observation = self._state_to_observation(state)
         if not return_interpretation:
-            return self._state_to_observation(state)
+            return observation
         else:
             reward, done, info = self._state_interpretation(state)
             return observation, reward, done, info
@@ -60,32 +72,55 @@ class WalbiEnv(Env):
 
     def _send_action(self, action: ActionType):
         int16_action = self._convert_action_norm_to_raw(action)
-        self.walbi.send_action(int16_action)
+        self._pending_actions.append(self.walbi.send_action(int16_action, block=False))
+        # raises as soon as possible if the robot answered ERROR, waits only when too many actions are in flight
+        while self._pending_actions and (self._pending_actions[0].done() or len(self._pending_actions) > self.max_pending_actions):
+            self.walbi.interface.wait_ok(self._pending_actions.popleft())
 
     @classmethod
-    def _convert_action_norm_to_raw(cls, action: ActionType) -> np.ndarray:
-        return constrain_spaces(action, cls.action_space, cls.raw_action_space, clip=True)
-    
+    def _converters(cls) -> dict:
+        """SpaceConverter between normalised and raw spaces, built once per class"""
+        converters = cls.__dict__.get('_space_converters')
+        if converters is None:
+            converters = {
+                'action_norm_to_raw': SpaceConverter(cls.action_space, cls.raw_action_space, clip=True),
+                'action_raw_to_norm': SpaceConverter(cls.raw_action_space, cls.action_space, clip=True),
+                'obs_norm_to_raw': SpaceConverter(cls.observation_space, cls.raw_observation_space, clip=False),
+                'obs_raw_to_norm': SpaceConverter(cls.raw_observation_space, cls.observation_space, clip=False),
+            }
+            cls._space_converters = converters
+        return converters
+
+    @classmethod
+    def _convert_action_norm_to_raw(cls, action: ActionType, out: np.ndarray = None) -> np.ndarray:
+        return cls._converters()['action_norm_to_raw'](action, out=out)
+
     @classmethod
-    def _convert_obs_norm_to_raw(cls, obs: ObservationType) -> np.ndarray:
-        return constrain_spaces(obs, cls.observation_space, cls.raw_observation_space, clip=False)
+    def _convert_action_raw_to_norm(cls, raw_action: Sequence[int], out: np.ndarray = None) -> ActionType:
+        return cls._converters()['action_raw_to_norm'](raw_action, out=out)
 
     @classmethod
-    def _convert_obs_raw_to_norm(cls, raw_obs: Sequence[int]) -> ObservationType:
-        return constrain_spaces(raw_obs, cls.raw_observation_space, cls.observation_space, clip=False)
+    def _convert_obs_norm_to_raw(cls, obs: ObservationType, out: np.ndarray = None) -> np.ndarray:
+        return cls._converters()['obs_norm_to_raw'](obs, out=out)
+
+    @classmethod
+    def _convert_obs_raw_to_norm(cls, raw_obs: Sequence[int], out: np.ndarray = None) -> ObservationType:
+        return cls._converters()['obs_raw_to_norm'](raw_obs, out=out)
 
     def _state_interpretation(self, state) -> Tuple[float, bool, dict]:
         """Calculates reward and termination. Provides the info dict"""
-        timestamp = state[0]
-        is_position_updated = [bool(state[update_flag_index]) for update_flag_index in range(2, 21, 2)]
         reward, termination = 0, False  # TODO
-        info = {'timestamp': timestamp, 'is_position_updated': is_position_updated}
+        if self._is_position_updated is None:
+            is_position_updated = np.array(state['updated'], dtype=np.bool_)
+        else:
+            is_position_updated = self._is_position_updated
+            np.copyto(is_position_updated, state['updated'])
+        info = {'timestamp': int(state['timestamp']), 'is_position_updated': is_position_updated}
         return reward, termination, info
 
     def _state_to_observation(self, state) -> ObservationType:
-        raw_observation = [state[position_index] for position_index in range(1, 20, 2)]
-        observation = self._convert_obs_raw_to_norm(raw_observation)
-        return observation
+        """state is a protocol.STATE_DTYPE record, converted into the reused observation if any"""
+        return self._convert_obs_raw_to_norm(state['position'], out=self._observation)
 
     def render(self, mode='human'):
         """TODO"""
@@ -0,0 +1,119 @@
+import numpy as np
+
+from walbi_gym.configuration import config
+
+
+class WalbiKinematics(object):
+    """
+    Simplified kinematic model of Walbi standing on both feet. From the ten motor positions it computes
+    the centre of mass, the load on each foot and what the IMU on the torso would measure, in the raw units of
+    the STATE message (see the sensors section of config.yaml). Positions may have leading batch dimensions, e.g. (N, 10).
+
+    Motors 0 to 4 are the left leg and 5 to 9 the right leg, each ordered [ankle pitch, ankle roll, knee, hip roll, hip pitch]:
+    as in the Walbi_CenterOfMassResearch sketch, the ankle (1, 6) and hip (3, 8) shift the weight from one foot to the other.
+    Joint angles are measured from that sketch's centred pose, right leg mirrored.
+    Each leg gives a pelvis pose from its foot, the two are averaged (the closed chain is not solved)
+    and the load is split between the feet by the lateral position of the centre of mass
+    """
+    resolution = np.radians(0.24)  # [rad/tick]
+    neutral_positions = np.array([425, 487, 491, 785, 515, 472, 618, 484, 543, 533])  # centred pose
+    joint_signs = np.array([1, 1, 1, 1, 1, -1, -1, -1, -1, -1])
+    shin_length = 0.1  # [m]
+    thigh_length = 0.1  # [m]
+    pelvis_width = 0.08  # [m] also the distance between the feet
+    torso_com_height = 0.08  # [m] above the pelvis
+    imu_height = 0.05  # [m] above the pelvis
+    shin_mass = 120  # [g]
+    thigh_mass = 120  # [g]
+    torso_mass = 700  # [g]
+    gravity = 9.81  # [m/s2]
+
+    def __init__(self, sensors_config=None):
+        if sensors_config is None:
+            sensors_config = config['sensors']
+        weight = sensors_config['weight']
+        self.weight_scale = np.array([weight['scale_factor_left'], weight['scale_factor_right']])
+        self.weight_offset = np.array([weight['scale_offset_left'], weight['scale_offset_right']])
+        imu = sensors_config['imu']
+        # [ax, ay, az, gx, gy, gz, roll, pitch, yaw] as sent by the firmware
+        self.imu_scale = np.repeat([imu['scale_factor_accel'], imu['scale_factor_gyro'], imu['scale_factor_angle_deg']], 3)
+        self.mass = 2 * (self.shin_mass + self.thigh_mass) + self.torso_mass
+        self._last_imu_position = None
+        self._last_imu_speed = None
+        self._last_angles = None
+
+    def reset(self, where=None):
+        """Forgets the motion history of the robots selected by the boolean mask where, all by default"""
+        if where is None or self._last_imu_position is None or self._last_imu_position.shape[:-1] != np.shape(where):
+            self._last_imu_position = self._last_imu_speed = self._last_angles = None
+            return
+        self._last_imu_speed[where] = 0
+        self._last_imu_position[where] = np.nan  # set back at the next call
+        self._last_angles[where] = np.nan
+
+    @staticmethod
+    def _direction(pitch, roll):
+        """Unit vector of a link tilted forward by pitch then sideways by roll, R(pitch, roll) = Rx(-roll) Ry(pitch) applied to z"""
+        return np.stack([np.sin(pitch), np.cos(pitch) * np.sin(roll), np.cos(pitch) * np.cos(roll)], axis=-1)
+
+    def pose(self, positions):
+        """
+        :param positions: (..., 10) motor positions [ticks]
+        :return: centre of mass (..., 3) [m], IMU position (..., 3) [m], torso roll and pitch (..., 2) [rad]
+        """
+        angles = (np.asarray(positions, dtype=np.float64) - self.neutral_positions) * (self.joint_signs * self.resolution)
+        legs = angles.reshape(angles.shape[:-1] + (2, 5))  # (..., leg, joint)
+        ankle_pitch, ankle_roll, knee, hip_roll, hip_pitch = np.moveaxis(legs, -1, 0)
+        feet = np.array([[0, self.pelvis_width / 2, 0], [0, - self.pelvis_width / 2, 0]])
+        shin = self._direction(ankle_pitch, ankle_roll)
+        thigh = self._direction(ankle_pitch + knee, ankle_roll)
+        knees = feet + self.shin_length * shin
+        hips = knees + self.thigh_length * thigh
+        pelvis = (hips - feet * [0, 1, 0]).mean(axis=-2)
+        roll = (ankle_roll + hip_roll).mean(axis=-1)
+        pitch = (ankle_pitch + knee + hip_pitch).mean(axis=-1)
+        torso = self._direction(pitch, roll)
+        com = (self.shin_mass * (feet + knees).sum(axis=-2) / 2
+               + self.thigh_mass * (knees + hips).sum(axis=-2) / 2
+               + self.torso_mass * (pelvis + self.torso_com_height * torso)) / self.mass
+        imu = pelvis + self.imu_height * torso
+        return com, imu, np.stack([roll, pitch], axis=-1)
+
+    def weights(self, com):
+        """Load on the [left, right] feet [g], split by the lateral position of the centre of mass"""
+        left = np.clip(com[..., 1] / self.pelvis_width + 0.5, 0, 1)
+        return self.mass * np.stack([left, 1 - left], axis=-1)
+
+    def sensors(self, positions, dt=None):
+        """
+        Weight and IMU channels of the STATE message, in raw units
+        :param dt: (float) [s] time since the previous call, accelerations and rotation rates are 0 without it
+        :return: weight (..., 2) int32, imu (..., 9) int16 [ax, ay, az, gx, gy, gz, roll, pitch, yaw]
+        """
+        com, imu_position, angles = self.pose(positions)
+        weight = self.weights(com)
+        acceleration = np.zeros_like(imu_position)
+        rates = np.zeros_like(angles)
+        if dt and self._last_imu_position is not None and self._last_imu_position.shape == imu_position.shape:
+            last_position = np.where(np.isnan(self._last_imu_position), imu_position, self._last_imu_position)
+            last_angles = np.where(np.isnan(self._last_angles), angles, self._last_angles)
+            speed = (imu_position - last_position) / dt
+            acceleration = (speed - self._last_imu_speed) / dt
+            rates = (angles - last_angles) / dt
+            self._last_imu_speed = speed
+        else:
+            self._last_imu_speed = np.zeros_like(imu_position)
+        self._last_imu_position, self._last_angles = imu_position, angles
+        # the accelerometer measures the specific force in the torso frame, R(pitch, roll).T @ force
+        roll, pitch = angles[..., 0], angles[..., 1]
+        specific_force = acceleration + [0, 0, self.gravity]
+        fx, fy, fz = np.moveaxis(specific_force, -1, 0)
+        y_rotated = np.cos(roll) * fy - np.sin(roll) * fz
+        z_rotated = np.sin(roll) * fy + np.cos(roll) * fz
+        accel = np.stack([np.cos(pitch) * fx - np.sin(pitch) * z_rotated, y_rotated, np.sin(pitch) * fx + np.cos(pitch) * z_rotated], axis=-1)
+        gyro = np.concatenate([rates, np.zeros(rates.shape[:-1] + (1,))], axis=-1)
+        euler = np.concatenate([np.degrees(angles), np.zeros(angles.shape[:-1] + (1,))], axis=-1)
+        imu = np.concatenate([accel, gyro, euler], axis=-1)
+        raw_weight = np.rint(weight * self.weight_scale + self.weight_offset).astype(np.int32)
+        raw_imu = np.rint(imu * self.imu_scale).astype(np.int64).astype(np.int16)  # wraps around like the firmware int16 fields
+        return raw_weight, raw_imu
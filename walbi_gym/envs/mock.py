@@ -1,8 +1,9 @@
 import numpy as np
+from gym import spaces
 
-
-from .walbi import WalbiEnv
-from .simulated import LX16A
+from .env import WalbiEnv
+from .simulated import LX16AArray
+from .kinematics import WalbiKinematics
 
 
 class WalbiMockEnv(WalbiEnv):
@@ -10,12 +11,32 @@ class WalbiMockEnv(WalbiEnv):
     simulation_step = 0.001  # [s]
     reward_range = (-1, 1)
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, substeps: int = 1, integrator: str = 'euler', sensors: bool = False, **kwargs):
+        """
+        :param substeps: simulation steps integrated per agent step
+        :param integrator: 'euler' or 'exact', which integrates substeps * simulation_step in one go, see LX16AArray
+        :param sensors: add the raw 'weight' and 'imu' channels of a WalbiKinematics model to info
+        """
+        self.substeps = substeps
+        self.integrator = integrator
+        self._kinematics = WalbiKinematics() if sensors else None
         self.sample_obs()
 
     def sample_obs(self):
         self.raw_observation = self.raw_observation_space.sample()
-        self._motors = [LX16A(initial_position=raw_obs) for raw_obs in self.raw_observation]
+        self._motors = LX16AArray(initial_position=self.raw_observation, integrator=self.integrator)
+
+    def _add_sensors(self, info, dt=None):
+        if self._kinematics is not None:
+            info['weight'], info['imu'] = self._kinematics.sensors(self.raw_observation, dt=dt)
+        return info
+
+    def _sample_interpretation(self):
+        """Random reward and termination (p=0.1) from a single draw"""
+        uniform = np.random.random_sample(2)
+        reward = float(self.reward_range[0] + (self.reward_range[1] - self.reward_range[0]) * uniform[0])
+        terminal = bool(uniform[1] < 0.1)
+        return reward, terminal
 
     @property
     def observation(self):
@@ -23,23 +44,94 @@ class WalbiMockEnv(WalbiEnv):
 
     def reset(self, return_interpretation: bool=False):
         self.sample_obs()
+        if self._kinematics is not None:
+            self._kinematics.reset()
         if not return_interpretation:
             return self.observation
         else:
-            reward = np.random.uniform(*self.reward_range)
-            terminal = bool(np.random.binomial(1, 0.1))  # p=0.1
-            info = {'debug': 'mock', 'timestamp': self._time}
+            reward, terminal = self._sample_interpretation()
+            info = self._add_sensors({'debug': 'mock', 'timestamp': self._time})
             return self.observation, reward, terminal, info
 
     def step(self, action):
-        self._time += self.simulation_step
+        self._time += self.simulation_step * self.substeps
         raw_action = self._convert_action_norm_to_raw(action)
-        for i in range(len(self._motors)):
-            self.raw_observation[i] = self._motors[i].step(dt=self.simulation_step, target_encoder=raw_action[i, 0])
-        reward = np.random.uniform(*self.reward_range)
-        terminal = bool(np.random.binomial(1, 0.1))  # p=0.1
-        info = {'debug': 'mock', 'timestamp': self._time}
+        positions = self._motors.step(dt=self.simulation_step, target_encoder=raw_action[:, 0], substeps=self.substeps)
+        np.copyto(self.raw_observation, positions, casting='unsafe')
+        reward, terminal = self._sample_interpretation()
+        info = self._add_sensors({'debug': 'mock', 'timestamp': self._time}, dt=self.simulation_step * self.substeps)
         return self.observation, reward, terminal, info
 
     def close(self):
         pass
+
+
+class WalbiMockVecEnv(WalbiMockEnv):
+    """
+    num_envs mock robots stepped together: actions are (num_envs, 10, 2), observations (num_envs, 10),
+    rewards and dones (num_envs,). A robot is reset as soon as it terminates, the observation returned for it
+    is then the first of its next episode and info['terminal_observation'] holds the last ones of the done robots
+    """
+
+    def __init__(self, num_envs: int = 1000, *args, substeps: int = 1, integrator: str = 'euler', sensors: bool = False, **kwargs):
+        self.num_envs = num_envs
+        self.substeps = substeps
+        self.integrator = integrator
+        self._kinematics = WalbiKinematics() if sensors else None
+        self.single_action_space = self.action_space
+        self.single_observation_space = self.observation_space
+        self.action_space = self._batch_space(self.single_action_space)
+        self.observation_space = self._batch_space(self.single_observation_space)
+        self._time = np.zeros(num_envs)
+        self.raw_observation = np.empty((num_envs,) + self.raw_observation_space.shape, dtype=self.raw_observation_space.dtype)
+        self._motors = LX16AArray(initial_position=self.raw_observation, integrator=integrator)
+        self.sample_obs()
+
+    def _batch_space(self, space):
+        return spaces.Box(
+            low=np.broadcast_to(space.low, (self.num_envs,) + space.shape),
+            high=np.broadcast_to(space.high, (self.num_envs,) + space.shape),
+            dtype=space.dtype
+        )
+
+    def sample_obs(self, where=None):
+        """Random positions for the robots selected by the boolean mask where, all by default"""
+        count = self.num_envs if where is None else np.count_nonzero(where)
+        space = self.raw_observation_space
+        positions = np.random.randint(space.low, space.high.astype(np.int64) + 1, size=(count,) + space.shape)
+        if where is None:
+            self.raw_observation[:] = positions
+            self._time[:] = 0
+        else:
+            self.raw_observation[where] = positions
+            self._time[where] = 0
+        self._motors.reset(positions, where)
+        if self._kinematics is not None:
+            self._kinematics.reset(where)
+
+    def _sample_interpretation(self):
+        uniform = np.random.random_sample((2, self.num_envs))
+        rewards = self.reward_range[0] + (self.reward_range[1] - self.reward_range[0]) * uniform[0]
+        dones = uniform[1] < 0.1
+        return rewards, dones
+
+    def reset(self, return_interpretation: bool=False):
+        self.sample_obs()
+        if not return_interpretation:
+            return self.observation
+        else:
+            rewards, dones = self._sample_interpretation()
+            info = self._add_sensors({'debug': 'mock', 'timestamp': self._time.copy()})
+            return self.observation, rewards, dones, info
+
+    def step(self, actions):
+        self._time += self.simulation_step * self.substeps
+        raw_actions = self._convert_action_norm_to_raw(actions)
+        positions = self._motors.step(dt=self.simulation_step, target_encoder=raw_actions[..., 0], substeps=self.substeps)
+        np.copyto(self.raw_observation, positions, casting='unsafe')
+        rewards, dones = self._sample_interpretation()
+        info = self._add_sensors({'debug': 'mock', 'timestamp': self._time.copy()}, dt=self.simulation_step * self.substeps)
+        if dones.any():
+            info['terminal_observation'] = self._convert_obs_raw_to_norm(self.raw_observation[dones])
+            self.sample_obs(where=dones)
+        return self.observation, rewards, dones, info
@@ -1,3 +1,7 @@
+from warnings import warn
+
+import numpy as np
+
 from walbi_gym.envs.utils import _clip
 
 class LX16A(object):
@@ -31,3 +35,130 @@ class LX16A(object):
             self.speed = self.first_order_speed * self.speed + (1 - self.first_order_speed) * new_speed
         self.position_encoder = _clip(self.position_encoder +  dt * self.speed, self.min_position_encoder, self.max_position_encoder)
         return self.position_encoder
+
+
+def _travel_time(distance, speed, acceleration, min_time=1e-12):
+    """First time t > min_time with speed * t + acceleration * t ** 2 / 2 = distance, inf if never"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # stable roots of a t^2 + b t + c = 0 with a = acceleration / 2, b = speed, c = - distance
+        discriminant = speed * speed + 2 * acceleration * distance
+        q = -0.5 * (speed + np.copysign(np.sqrt(np.maximum(discriminant, 0)), speed))
+        root_1 = np.where(acceleration != 0, q / (0.5 * acceleration), np.inf)
+        root_2 = np.where(q != 0, - distance / q, np.inf)
+        linear = np.where(speed != 0, distance / speed, np.inf)
+        root_1 = np.where(acceleration == 0, linear, root_1)
+        root_2 = np.where(acceleration == 0, np.inf, root_2)
+        roots = np.where(discriminant < 0, np.inf, np.stack([root_1, root_2]))
+    roots = np.where(roots > min_time, roots, np.inf)
+    return roots.min(axis=0)
+
+
+class LX16AArray(LX16A):
+    """
+    LX16A motors of any shape, e.g. (10,) or (N, 10), advanced together with array operations
+    :param integrator: 'euler' repeats the LX16A.step update, 'exact' integrates the continuous time limit of
+    that update over any duration, stopping only at events (target crossed, speed limit reached, end stop reached)
+    """
+    max_events = 10000  # per step call, motors still moving after that many events are stopped with a warning
+    rest_amplitude = 0.5  # [tick] motors which would swing around their target by less than this are settled on it
+
+    def __init__(self, initial_position=512, integrator='euler'):
+        if integrator not in ('euler', 'exact'):
+            raise ValueError('Unknown integrator %s' % integrator)
+        self.integrator = integrator
+        self.position_encoder = np.array(initial_position, dtype=np.float64)
+        self.speed = np.zeros_like(self.position_encoder)
+        self.first_order_speed = _clip(self.first_order_speed, 0, 1)
+        self._direction = np.empty_like(self.position_encoder)
+
+    def reset(self, position, where=None):
+        """Sets the positions of the motors selected by the boolean mask where (all by default) and stops them"""
+        if where is None:
+            where = slice(None)
+        self.position_encoder[where] = position
+        self.speed[where] = 0
+
+    def step(self, dt, target_encoder, substeps=1):
+        """
+        Same update as LX16A.step for every motor, substeps times with the same target.
+        With the exact integrator, dt * substeps is integrated in one go
+        :return: (np.ndarray) positions, updated in place at the next step
+        """
+        target_encoder = np.trunc(target_encoder)
+        if self.integrator == 'exact':
+            self._integrate(dt * substeps, np.broadcast_to(target_encoder, self.position_encoder.shape))
+            return self.position_encoder
+        direction = self._direction
+        for _ in range(substeps):
+            np.subtract(target_encoder, self.position_encoder, out=direction)
+            np.sign(direction, out=direction)
+            if self.time_to_reach_max_speed == 0:
+                np.multiply(direction, self.max_speed, out=self.speed)
+            else:
+                new_speed = np.clip(self.speed + direction * (dt / self.time_to_reach_max_speed * self.max_speed), - self.max_speed, self.max_speed)
+                self.speed *= self.first_order_speed
+                self.speed += (1 - self.first_order_speed) * new_speed
+            self.position_encoder += dt * self.speed
+            np.clip(self.position_encoder, self.min_position_encoder, self.max_position_encoder, out=self.position_encoder)
+        return self.position_encoder
+
+    def _integrate(self, duration, target):
+        """
+        As dt goes to 0 the Euler update accelerates towards the target at (1 - first_order_speed) * max_speed / time_to_reach_max_speed
+        up to max_speed, overshoots and swings back. Below max_speed, speed ** 2 / 2 + acceleration * |target - position|
+        is conserved, so a motor swings around its target with a constant amplitude: once that amplitude is below
+        rest_amplitude, the motor is put on its target at rest.
+        As the Euler update clips the position only, an end stop holds the position while the speed still follows the
+        acceleration: a motor pushed into a stop keeps a speed towards it, up to max_speed, and leaves the stop once the
+        acceleration has brought that speed back to zero.
+        The acceleration is constant between events, so each interval is solved in closed form
+        """
+        low, high, max_speed = self.min_position_encoder, self.max_position_encoder, self.max_speed
+        position, speed = self.position_encoder, self.speed
+        if self.time_to_reach_max_speed == 0:  # instant speed, motors move straight to the target
+            direction = np.sign(target - position)
+            position += np.clip(target - position, - max_speed * duration, max_speed * duration)
+            np.clip(position, low, high, out=position)
+            speed[:] = np.where(position == target, 0, direction * max_speed)
+            return
+        acceleration_norm = (1 - self.first_order_speed) * max_speed / self.time_to_reach_max_speed
+        remaining = np.full(position.shape, float(duration))
+        for _ in range(self.max_events):
+            moving = remaining > 0
+            if not moving.any():
+                return
+            settled = moving & (np.abs(target - position) + speed * speed / (2 * acceleration_norm) < self.rest_amplitude)
+            position[:] = np.where(settled, target, position)
+            speed[settled] = 0
+            pushing = ((position <= low) & (speed < 0)) | ((position >= high) & (speed > 0))
+            direction = np.sign(target - position)
+            # on the target, the motor is passing through it unless an end stop holds it there
+            direction = np.where((direction == 0) & ~pushing, - np.sign(speed), direction)
+            saturated = (np.abs(speed) >= max_speed) & (np.sign(speed) == direction)
+            acceleration = np.where(saturated, 0., direction * acceleration_norm)
+            held = pushing | ((position <= low) & (speed == 0) & (acceleration < 0)) | ((position >= high) & (speed == 0) & (acceleration > 0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                to_saturation = np.where(acceleration != 0, (direction * max_speed - speed) / acceleration, np.inf)
+                to_release = np.where(held & (acceleration * speed < 0), - speed / acceleration, np.inf)
+            free_speed = np.where(held, 0., speed)
+            free_acceleration = np.where(held, 0., acceleration)
+            to_target = _travel_time(target - position, free_speed, free_acceleration)
+            to_low = _travel_time(low - position, free_speed, free_acceleration)
+            to_high = _travel_time(high - position, free_speed, free_acceleration)
+            dt = np.minimum.reduce([remaining, to_saturation, to_release, to_target, to_low, to_high])
+            dt = np.where(moving, dt, 0.)
+            position += free_speed * dt + 0.5 * free_acceleration * dt * dt
+            speed += acceleration * dt
+            # snap to the event to avoid drifting past it
+            position[:] = np.where(dt == to_target, target, position)
+            position[:] = np.where(dt == to_low, low, position)
+            position[:] = np.where(dt == to_high, high, position)
+            speed[:] = np.where(dt == to_saturation, direction * max_speed, speed)
+            speed[:] = np.where(dt == to_release, 0., speed)
+            np.clip(position, low, high, out=position)
+            remaining -= dt
+        still_moving = remaining > 0
+        if still_moving.any():
+            warn('%d motors still moving after %d events, they are stopped' % (np.count_nonzero(still_moving), self.max_events),
+                 RuntimeWarning)
+            speed[still_moving] = 0
@@ -1,3 +1,5 @@
+import threading
+
 import numpy as np
 
 
@@ -11,29 +13,49 @@ def constrain(x, in_min,  in_max, out_min, out_max, clip=False):
     return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
 
 
+class SpaceConverter(object):
+    """
+    Affine map between two Box spaces of the same shape, bounds are precomputed once.
+    Inputs may carry leading batch dimensions, e.g. (N, 10, 2) for a (10, 2) space.
+    Integer outputs are rounded to the nearest value. The float64 intermediate is computed in out when it is a float64
+    array, in a work buffer kept per thread otherwise
+    :param clip: (bool) clip inputs to the bounds of in_space
+    """
+
+    def __init__(self, in_space, out_space, clip):
+        assert in_space.shape == out_space.shape
+        self.clip = clip
+        self.dtype = out_space.dtype
+        self.in_low = np.asarray(in_space.low, dtype=np.float64)
+        self.in_range = np.asarray(in_space.high, dtype=np.float64) - self.in_low
+        self.out_low = np.asarray(out_space.low, dtype=np.float64)
+        self.scale = (np.asarray(out_space.high, dtype=np.float64) - self.out_low) / self.in_range
+        self._round = np.issubdtype(self.dtype, np.integer)
+        self._local = threading.local()  # converters are shared by all envs of a class, whatever their thread
+
+    def __call__(self, x, out=None):
+        """:param out: (np.ndarray) written in place when given, of any dtype"""
+        if out is not None and out.dtype == np.float64:
+            work = out
+        else:
+            work = getattr(self._local, 'work', None)
+            if work is None or work.shape != np.shape(x):
+                shape = np.broadcast_shapes(np.shape(x), self.in_low.shape)
+                if work is None or work.shape != shape:
+                    work = self._local.work = np.empty(shape, dtype=np.float64)
+        np.subtract(x, self.in_low, out=work)
+        if self.clip:
+            np.clip(work, 0, self.in_range, out=work)
+        np.multiply(work, self.scale, out=work)
+        np.add(work, self.out_low, out=work)
+        if self._round:
+            np.rint(work, out=work)
+        if out is None:
+            return work.astype(self.dtype)  # a copy, the work buffer is reused
+        if out is not work:
+            np.copyto(out, work, casting='unsafe')
+        return out
+
+
 def constrain_spaces(x, in_space, out_space, clip):
-    assert in_space.shape == out_space.shape
-    if len(in_space.shape) == 1:
-        return np.array([
-            constrain(
-                value,
-                in_space.low[index],
-                in_space.high[index],
-                out_space.low[index],
-                out_space.high[index],
-                clip=clip
-            ) for index, value in enumerate(x)
-        ], dtype=out_space.dtype)
-    elif len(in_space.shape) == 2:
-        return np.array([
-            [
-                constrain(
-                    subvalue,
-                    in_space.low[index][subindex],
-                    in_space.high[index][subindex],
-                    out_space.low[index][subindex],
-                    out_space.high[index][subindex],
-                    clip=clip
-                ) for subindex, subvalue in enumerate(value)
-            ] for index, value in enumerate(x)
-        ], dtype=out_space.dtype)
+    return SpaceConverter(in_space, out_space, clip)(x)
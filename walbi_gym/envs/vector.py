@@ -0,0 +1,240 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import traceback
+import typing
+
+import numpy as np
+from gym import spaces
+
+from walbi_gym import errors
+from walbi_gym.envs.env import WalbiEnv
+
+
+class _SharedArray(object):
+    """NumPy array in a shared memory block, created by the parent and attached to by the workers"""
+
+    def __init__(self, shape, dtype, name=None):
+        self.shape, self.dtype = tuple(shape), np.dtype(dtype)
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.memory.buf)
+
+    def __reduce__(self):
+        return _SharedArray, (self.shape, self.dtype, self.memory.name)
+
+    def close(self, unlink=False):
+        self.array = None  # the buffer cannot be released while exported
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def _worker(index, remote, parent_remote, env_fn, actions, observations, rewards, dones):
+    """Owns one env, reads its action row and writes its results in the shared arrays"""
+    parent_remote.close()
+    env = None
+    try:
+        env = env_fn()
+        while True:
+            command, data = remote.recv()
+            if command == 'step':
+                observation, reward, done, info = env.step(actions.array[index])
+                if done:
+                    info['terminal_observation'] = np.array(observation, copy=True)  # reset may reuse its buffer
+                    observation = env.reset()
+                observations.array[index] = observation
+                rewards.array[index] = reward
+                dones.array[index] = done
+                remote.send(('ok', info))
+            elif command == 'reset':
+                observations.array[index] = env.reset()
+                remote.send(('ok', None))
+            elif command == 'seed':
+                _seed(env, data)
+                remote.send(('ok', None))
+            elif command == 'close':
+                break
+    except (KeyboardInterrupt, EOFError):  # the parent went away
+        pass
+    except Exception:
+        try:
+            remote.send(('error', traceback.format_exc()))
+        except (OSError, EOFError):
+            pass
+    finally:
+        if env is not None:
+            env.close()
+        for shared in (actions, observations, rewards, dones):
+            shared.close()
+        remote.close()
+
+
+def _seed(env, seed):
+    if seed is None:
+        return
+    np.random.seed(seed)  # the mock draws from the global generator
+    env.action_space.seed(seed)
+    env.observation_space.seed(seed)
+
+
+class SubprocVecEnv(object):
+    """
+    Steps one env per worker process. Actions, observations, rewards and dones are exchanged through
+    shared memory arrays, only commands and info dicts go through the pipes.
+    A worker is reset as soon as its env terminates, info['terminal_observation'] then holds the last observation.
+    A worker which raises or dies is restarted, its step is reported done with info['worker_error'].
+    A worker restarted by reset is reset all the same, reset_infos then holds its info['worker_error']
+    :param env_fns: picklable callables creating each env, e.g. functools.partial(WalbiMockEnv)
+    :param seed: (int) worker i is seeded with seed + i
+    :param start_method: multiprocessing start method, forkserver when available
+    """
+
+    def __init__(self, env_fns: typing.Sequence[typing.Callable], seed: int = None, start_method: str = None,
+                 observation_space=WalbiEnv.observation_space, action_space=WalbiEnv.action_space):
+        self.num_envs = len(env_fns)
+        self.single_observation_space = observation_space
+        self.single_action_space = action_space
+        self.observation_space = self._batch_space(observation_space)
+        self.action_space = self._batch_space(action_space)
+        if start_method is None:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(start_method)
+        self._env_fns = list(env_fns)
+        self._seeds = [None if seed is None else seed + i for i in range(self.num_envs)]
+        self._actions = _SharedArray((self.num_envs,) + action_space.shape, action_space.dtype)
+        self._observations = _SharedArray((self.num_envs,) + observation_space.shape, observation_space.dtype)
+        self._rewards = _SharedArray((self.num_envs,), np.float64)
+        self._dones = _SharedArray((self.num_envs,), np.bool_)
+        self._remotes = [None] * self.num_envs
+        self._processes = [None] * self.num_envs
+        self._send_errors = [None] * self.num_envs  # why a command could not be sent, answered by _receive
+        self.reset_infos = [{} for _ in range(self.num_envs)]
+        self.restarts = 0
+        self._waiting = False
+        self.closed = False
+        for index in range(self.num_envs):
+            self._start_worker(index)
+        if seed is not None:
+            self.seed(seed)
+
+    def _batch_space(self, space):
+        return spaces.Box(
+            low=np.broadcast_to(space.low, (self.num_envs,) + space.shape),
+            high=np.broadcast_to(space.high, (self.num_envs,) + space.shape),
+            dtype=space.dtype
+        )
+
+    def _start_worker(self, index):
+        remote, worker_remote = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker,
+            args=(index, worker_remote, remote, self._env_fns[index],
+                  self._actions, self._observations, self._rewards, self._dones),
+            daemon=True
+        )
+        process.start()
+        worker_remote.close()
+        self._remotes[index], self._processes[index] = remote, process
+        self._send_errors[index] = None
+
+    def _send(self, index, command, data=None):
+        """Sends a command to worker index, if it died _receive answers ('error', message) instead"""
+        try:
+            self._remotes[index].send((command, data))
+        except (BrokenPipeError, EOFError, ConnectionResetError):
+            self._processes[index].join(timeout=1)
+            self._send_errors[index] = 'worker %d exited with code %s' % (index, self._processes[index].exitcode)
+
+    def _receive(self, index):
+        """Answer of worker index, ('error', message) if it raised or died"""
+        if self._send_errors[index] is not None:
+            return 'error', self._send_errors[index]
+        try:
+            return self._remotes[index].recv()
+        except (EOFError, ConnectionResetError):
+            self._processes[index].join(timeout=1)
+            return 'error', 'worker %d exited with code %s' % (index, self._processes[index].exitcode)
+
+    def _restart_worker(self, index):
+        self.restarts += 1
+        self._remotes[index].close()
+        self._processes[index].join(timeout=1)
+        if self._processes[index].is_alive():
+            self._processes[index].terminate()
+        self._start_worker(index)
+        for command, data in (('seed', self._seeds[index]), ('reset', None)):
+            self._send(index, command, data)
+            status, payload = self._receive(index)
+            if status == 'error':
+                raise errors.WalbiError('Worker %d failed again after a restart:\n%s' % (index, payload))
+
+    def seed(self, seed: int = None):
+        """Reseeds worker i with seed + i"""
+        if seed is not None:
+            self._seeds = [seed + i for i in range(self.num_envs)]
+        self._broadcast('seed', self._seeds)  # also used when a worker is restarted
+        return self._seeds
+
+    def _broadcast(self, command, data=None) -> typing.List[dict]:
+        """
+        Runs a seed or reset command in all workers, those which fail are restarted, which seeds and resets them
+        :param data: (list) one item per worker
+        :return: (list) one info per worker, with the worker_error of those restarted
+        """
+        for index in range(self.num_envs):
+            self._send(index, command, None if data is None else data[index])
+        infos = []
+        for index in range(self.num_envs):
+            status, payload = self._receive(index)
+            if status == 'error':
+                self._restart_worker(index)
+                infos.append({'worker_error': payload})
+            else:
+                infos.append({})
+        return infos
+
+    def reset(self) -> np.ndarray:
+        self.reset_infos = self._broadcast('reset')
+        return self._observations.array.copy()
+
+    def step_async(self, actions: np.ndarray):
+        """Writes the actions and lets the workers step, results are collected by step_wait"""
+        np.copyto(self._actions.array, actions, casting='unsafe')
+        for index in range(self.num_envs):
+            self._send(index, 'step')
+        self._waiting = True
+
+    def step_wait(self) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray, typing.List[dict]]:
+        infos = []
+        for index in range(self.num_envs):
+            status, info = self._receive(index)
+            if status == 'error':
+                self._restart_worker(index)
+                self._rewards.array[index] = 0
+                self._dones.array[index] = True
+                info = {'worker_error': info}
+            infos.append(info)
+        self._waiting = False
+        return self._observations.array.copy(), self._rewards.array.copy(), self._dones.array.copy(), infos
+
+    def step(self, actions: np.ndarray):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        if self._waiting:
+            for index in range(self.num_envs):
+                self._receive(index)
+        for index in range(self.num_envs):
+            self._send(index, 'close')
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for remote in self._remotes:
+            remote.close()
+        for shared in (self._actions, self._observations, self._rewards, self._dones):
+            shared.close(unlink=True)
+        self.closed = True
@@ -5,28 +5,116 @@ import numpy as np
 from gym import ActionWrapper
 from gym import spaces
 
-from pid_controller.pid import PID
 
-from walbi_gym.envs.utils import _clip
+class ArrayPID(object):
+    """
+    PID controllers of any shape, e.g. (10,) or (N, 10), updated together with array operations into reused buffers.
+    Each motor computes what a pid_controller.PID(get_time=lambda: 0) did: - (Kp error + Ki error dt + Kd dfeedback / dt),
+    the integral term covering the last dt only and the derivative being taken on the feedback. The first update
+    measures dt from time 0 and the feedback change from 0
+    :param p, i, d: gains, broadcast to shape
+    :param shape: the last dimension is the motors, leading dimensions are a batch with one time each
+    """
+
+    def __init__(self, p, i, d, shape):
+        self.shape = tuple(shape)
+        self.kp, self.ki, self.kd = (np.broadcast_to(np.asarray(k, dtype=np.float64), self.shape).copy() for k in (p, i, d))
+        self._has_integral, self._has_derivative = bool(self.ki.any()), bool(self.kd.any())  # skip the terms of 0 gain
+        self._integral_or_derivative = self._has_integral or self._has_derivative
+        self.target = np.zeros(self.shape)
+        self.error = np.zeros(self.shape)
+        self.previous_feedback = np.zeros(self.shape)
+        self.output = np.zeros(self.shape)
+        self._batched = len(self.shape) > 1  # one time per batch row, else Python floats are cheaper
+        self._previous_time = np.zeros(self.shape[:-1]) if self._batched else 0.  # [s]
+        self._dt = np.zeros(self.shape[:-1] + (1,))
+        self._dt_rows = self._dt[..., 0]
+        self._inverse_dt = np.zeros(self.shape[:-1] + (1,))
+        self._buffer = np.zeros(self.shape)
+        self._held = np.zeros(self.shape, dtype=np.bool_)
+
+    def reset(self, where=None):
+        """Starts the batch rows selected by the boolean mask where, all by default, over as new controllers"""
+        if where is None:
+            where = Ellipsis
+        self.previous_feedback[where] = 0
+        if self._batched:
+            self._previous_time[where] = 0
+        else:
+            self._previous_time = 0.
+
+    def set_target(self, target, feedback, tolerance=0.):
+        """
+        Sets the target of the motors whose previous target is further than tolerance from the feedback, the others
+        hold still: their target becomes the feedback
+        :param tolerance: a scalar or one per motor
+        """
+        held = self._held
+        np.subtract(self.target, feedback, out=self._buffer)
+        np.abs(self._buffer, out=self._buffer)
+        np.less_equal(self._buffer, tolerance, out=held)
+        self.target[...] = target
+        np.copyto(self.target, feedback, where=held)
+
+    def __call__(self, feedback, time) -> np.ndarray:
+        """
+        :param time: [s] scalar or one per batch row
+        :return: - (Kp error + Ki error dt + Kd dfeedback / dt), overwritten by the next call
+        """
+        error, buffer, output = self.error, self._buffer, self.output
+        np.subtract(self.target, feedback, out=error)
+        np.multiply(self.kp, error, out=output)
+        if self._integral_or_derivative:
+            if self._batched:
+                dt = self._dt
+                np.subtract(time, self._previous_time, out=self._dt_rows)
+            else:
+                dt = time - self._previous_time
+            if self._has_integral:
+                np.multiply(error, dt, out=buffer)
+                buffer *= self.ki
+                output += buffer
+            if self._has_derivative:
+                if self._batched:
+                    inverse_dt = self._inverse_dt
+                    inverse_dt.fill(0)
+                    np.divide(1., dt, out=inverse_dt, where=dt > 0)
+                else:
+                    inverse_dt = 1. / dt if dt > 0 else 0.
+                np.subtract(feedback, self.previous_feedback, out=buffer)
+                buffer *= inverse_dt
+                buffer *= self.kd
+                output += buffer
+                self.previous_feedback[...] = feedback
+        np.negative(output, out=output)
+        if self._batched:
+            self._previous_time[...] = time
+        else:
+            self._previous_time = float(time)
+        return output
 
 
 class PidWrapper(ActionWrapper):
+    """
+    Actions are target positions, a PID per motor turns them into position commands at the highest speed.
+    Also wraps vectorized envs such as WalbiMockVecEnv, with one PID per robot
+    """
     _nb_motors = 10
     last_observation = None
     last_timestamp = None
-    last_action = None  # is the action ultimately sent
+    last_action = None  # is the action ultimately sent, overwritten at the next step
 
     def __init__(self, env, K: Sequence[Tuple[float, float, float]]):
+        super().__init__(env)
         assert isinstance(env.action_space, spaces.Box)
-        assert env.action_space.shape == (self._nb_motors, 2)
-        self.action_space = spaces.Box(low=env.action_space.low[:, 0], high=env.action_space.high[:, 0])
-        assert self.action_space.shape == (self._nb_motors,)
-        self.pids = [PID(p=K[i][0], i=K[i][1], d=K[i][2], get_time=lambda: 0) for i in range(self._nb_motors)]
-        self.env = env
-        self.observation_space = env.observation_space
-        self.reward_range = env.reward_range
-        self.metadata = env.metadata
-        self.spec = getattr(env, 'spec', None)
+        assert env.action_space.shape[-2:] == (self._nb_motors, 2)
+        self.action_space = spaces.Box(low=env.action_space.low[..., 0], high=env.action_space.high[..., 0])
+        K = np.asarray(K, dtype=np.float64)
+        self.pids = ArrayPID(K[..., 0], K[..., 1], K[..., 2], shape=self.action_space.shape)
+        self._action = np.empty(env.action_space.shape)
+        self._action[..., 1] = env.action_space.low[..., 1]  # the highest speed is the lowest span
+        self._low = np.array(env.action_space.low)
+        self._high = np.array(env.action_space.high)
 
     def reset(self, **kwargs):
         return_interpretation = kwargs.pop('return_interpretation', False)
@@ -43,30 +131,27 @@ class PidWrapper(ActionWrapper):
         observation, reward, done, info = self.env.step(self.last_action)
         self.last_observation = observation
         self.last_timestamp = info['timestamp']  # [ms]
+        if np.ndim(done):  # robots reset by a vectorized env start over
+            self.pids.reset(where=done)
         return observation, reward, done, info
 
     def action(self, action, clip, tolerance):
-        """creates new action avoiding """
-        new_action = np.zeros((self._nb_motors, 2))
-        new_action[:, 0] = action
-        new_action[:, 1] = self.env.action_space.low[:, 1]  # the highest speed is the lowest span
-        for i, pid in enumerate(self.pids):
-            curr_tm = self.last_timestamp / 1000  # [s]
-            feedback = self.last_observation[i]
-            pid.target = action[i] if abs(pid.target - feedback) > tolerance else feedback  # errors under tolerance are ignored
-            new_action[i, 0] = feedback - pid(feedback=self.last_observation[i], curr_tm=curr_tm)
+        """Position commands towards action, in a buffer reused at each step"""
+        self.pids.set_target(action, self.last_observation, tolerance)  # errors under tolerance are ignored
+        command = self._action[..., 0]
+        np.subtract(self.last_observation, self.pids(self.last_observation, self.last_timestamp / 1000), out=command)
         if clip:
-            return self.clip(new_action)
+            return self.clip(self._action)
         else:
-            return new_action
+            return self._action
 
     def action_target(self):
         """returns the action state we are aiming for"""
-        return np.array([pid.target for pid in self.pids], dtype=self.action_space.dtype)
+        return self.pids.target.astype(self.action_space.dtype)
 
     def clip(self, action, dim=0):
-        for i, x in enumerate(action):
-            action[i, dim] = _clip(x[dim], self.env.action_space.low[i, dim], self.env.action_space.high[i, dim])
+        np.maximum(action[..., dim], self._low[..., dim], out=action[..., dim])
+        np.minimum(action[..., dim], self._high[..., dim], out=action[..., dim])
         return action
 
 if __name__ == '__main__':
@@ -2,15 +2,13 @@ import typing
 import time
 import os.path
 from os import makedirs
+import queue
+import threading
 
 import numpy as np
 from gym import Wrapper
 from ruamel.yaml import YAML
 
-from walbi_gym.envs.errors import dependency_required
-
-yaml = YAML()   # typ='safe', if not specfied, is 'rt' (round-trip)
-
 
 class Transition(typing.NamedTuple):
     observation: np.float16
@@ -35,14 +33,130 @@ class RawTransition(typing.NamedTuple):
 T = typing.TypeVar('T', Transition, RawTransition)
 
 
+class ChunkedRecorder(object):
+    """
+    Streams transitions into one binary file per column (observation, action, next_observation, reward,
+    terminal, step, timestamp) in a session folder. Rows are copied into preallocated chunks, full chunks are written
+    by a background thread and recycled, so memory stays constant whatever the length of the run.
+    The session header.yaml describes the columns, non empty agent_info dicts go to agent_info.yaml with their row index
+    :param buffers: (int) number of chunks, recording waits for the writer when they are all full
+    """
+    header_name = 'header.yaml'
+    agent_info_name = 'agent_info.yaml'
+    format_version = 1
+
+    def __init__(self, folder: str, observation_space, action_space, chunk_size: int = 4096, buffers: int = 3, extras=None):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.columns = {
+            'observation': (np.dtype(observation_space.dtype), observation_space.shape),
+            'action': (np.dtype(action_space.dtype), action_space.shape),
+            'next_observation': (np.dtype(observation_space.dtype), observation_space.shape),
+            'reward': (np.dtype(np.float64), ()),
+            'terminal': (np.dtype(np.bool_), ()),
+            'step': (np.dtype(np.int64), ()),
+            'timestamp': (np.dtype(np.float64), ()),  # env_info['timestamp'], nan if missing
+        }
+        self.rows = 0  # rows recorded
+        self._free = queue.Queue()
+        for _ in range(buffers):
+            self._free.put(self._new_chunk())
+        self._full = queue.Queue()
+        self._chunk, self._chunk_infos = self._free.get(), []
+        self._row = 0  # in the current chunk
+        self._writer_error = None
+        self._yaml = YAML()  # round-trip, not thread-safe: only used here, then by the writer thread
+        makedirs(folder, exist_ok=True)
+        header = {
+            'format_version': self.format_version,
+            'chunk_size': chunk_size,
+            'columns': {name: {'dtype': dtype.str, 'shape': list(shape)} for name, (dtype, shape) in self.columns.items()},
+        }
+        if extras:
+            header.update(extras)
+        with open(os.path.join(folder, self.header_name), 'w') as f:
+            self._yaml.dump(header, f)
+        self._files = {name: open(os.path.join(folder, name + '.bin'), 'ab') for name in self.columns}
+        self._agent_info_file = open(os.path.join(folder, self.agent_info_name), 'a')
+        self._writer = threading.Thread(target=self._write_loop, name='RecorderWriter', daemon=True)
+        self._writer.start()
+
+    def _new_chunk(self) -> dict:
+        return {name: np.zeros((self.chunk_size,) + shape, dtype=dtype) for name, (dtype, shape) in self.columns.items()}
+
+    def record(self, observation, action, next_observation, reward, terminal, step, timestamp=np.nan, agent_info=None):
+        chunk, row = self._chunk, self._row
+        chunk['observation'][row] = observation if observation is not None else np.nan
+        chunk['action'][row] = action
+        chunk['next_observation'][row] = next_observation
+        chunk['reward'][row] = reward
+        chunk['terminal'][row] = terminal
+        chunk['step'][row] = step
+        chunk['timestamp'][row] = timestamp
+        if agent_info:
+            self._chunk_infos.append({'row': self.rows, 'agent_info': agent_info})
+        self._row += 1
+        self.rows += 1
+        if self._row == self.chunk_size:
+            self._submit()
+
+    def _submit(self):
+        if self._writer_error is not None:
+            raise self._writer_error
+        self._full.put((self._chunk, self._row, self._chunk_infos))
+        self._chunk, self._chunk_infos, self._row = self._free.get(), [], 0
+
+    def _write_loop(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                return
+            chunk, rows, infos = item
+            try:
+                for name, f in self._files.items():
+                    f.write(chunk[name][:rows].tobytes())
+                    f.flush()
+                if infos:
+                    self._yaml.dump(infos, self._agent_info_file)
+                    self._agent_info_file.flush()
+            except Exception as e:  # raised in the recording thread at the next chunk
+                self._writer_error = e
+            self._free.put(chunk)
+
+    def flush(self):
+        """Hands the rows of the current chunk to the writer"""
+        if self._row:
+            self._submit()
+
+    def close(self):
+        self.flush()
+        self._full.put(None)
+        self._writer.join()
+        for f in self._files.values():
+            f.close()
+        self._agent_info_file.close()
+        if self._writer_error is not None:
+            raise self._writer_error
+
+
 class RecordWrapper(Wrapper):
+    """
+    Records the transitions of env in save_to_folder
+    :param backend: 'binary' streams them with a ChunkedRecorder, 'yaml' keeps them in memory until flush
+    """
     file_format = '-%Y-%m-%d-%H-%M.yaml'
+    session_format = '-%Y-%m-%d-%H-%M-%S'
 
-    def __init__(self, env, save_to_folder: str):
+    def __init__(self, env, save_to_folder: str, backend: str = 'binary', chunk_size: int = 4096):
+        if backend not in ('binary', 'yaml'):
+            raise ValueError('Unknown backend %s' % backend)
         self.save_to = save_to_folder
+        self.backend = backend
+        self.chunk_size = chunk_size
         self.step_counter = 0
         self._last_observation = None
         self.transitions: typing.List[Transition] = []
+        self.recorder = None  # created with the first transition
         super().__init__(env)
 
     def step(self, action, agent_info=None):  # pylint: disable=E0202
@@ -50,38 +164,76 @@ class RecordWrapper(Wrapper):
             agent_info = {}
         next_observation, reward, done, env_info = self.env.step(action)
         env_info['step'] = self.step_counter  # step goes to env_info rather than agent_info
-        self.transitions.append(
-            Transition(
-                self._last_observation,
-                action,
-                next_observation,
-                reward,
-                done,
-                agent_info,
-                env_info
+        if self.backend == 'binary':
+            if self.recorder is None:
+                self.recorder = self._new_recorder()
+            self.recorder.record(self._last_observation, action, next_observation, reward, done,
+                                 self.step_counter, env_info.get('timestamp', np.nan), agent_info)
+            self._keep_observation(next_observation)
+        else:
+            kept_observation = np.array(next_observation)  # kept until flush, the env may reuse its buffers
+            self.transitions.append(
+                Transition(
+                    self._last_observation,
+                    action,
+                    kept_observation,
+                    reward,
+                    done,
+                    agent_info,
+                    {k: np.array(v) if isinstance(v, np.ndarray) else v for k, v in env_info.items()}
+                )
             )
-        )
+            self._last_observation = kept_observation
         self.step_counter += 1
-        self._last_observation = next_observation
         return next_observation, reward, done, env_info
 
+    def _keep_observation(self, observation):
+        """Copies observation, which the env overwrites at the next step"""
+        if self._last_observation is None:
+            self._last_observation = np.array(observation)
+        else:
+            np.copyto(self._last_observation, observation)
+
+    def _extras(self) -> dict:
+        try:
+            return {
+                'protocol_version': self.env.protocol_version,
+                'config': dict(self.env.config),  # TODO try keeping the OrderedDict
+            }
+        except AttributeError:
+            return {}
+
+    def _new_recorder(self) -> ChunkedRecorder:
+        session = os.path.join(self.save_to, self._get_name() + time.strftime(self.session_format))
+        suffix = 1
+        while os.path.exists(session + ('_%d' % suffix if suffix > 1 else '')):
+            suffix += 1
+        if suffix > 1:
+            session += '_%d' % suffix
+        print('Recording to', session)
+        return ChunkedRecorder(session, self.env.observation_space, self.env.action_space,
+                               chunk_size=self.chunk_size, extras=self._extras())
+
     def reset(self, **kwargs):  # pylint: disable=E0202
-        self._last_observation = self.env.reset(**kwargs)
+        result = self.env.reset(**kwargs)
+        self._last_observation = np.array(result[0] if kwargs.get('return_interpretation') else result)
         self.step_counter = 0
-        return self._last_observation
+        return result
 
     def close(self):
-        self.flush()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        else:
+            self.flush()
         return self.env.close()
 
     def flush(self):
-        try:
-            extras = {
-                'protocol_version': self.env.protocol_version,
-                'config': dict(self.env.config),  # TODO try keeping the OrderedDict
-            }
-        except AttributeError:
-            extras = {}
+        if self.backend == 'binary':
+            if self.recorder is not None:
+                self.recorder.flush()
+            return
+        extras = self._extras()
         makedirs(self.save_to, exist_ok=True)
         savename = self._get_name() + time.strftime(self.file_format)
         savepath = os.path.join(self.save_to, savename)
@@ -110,6 +262,8 @@ def dump_transitions(transitions: typing.Sequence[T], filename, to_dict=True, ex
         for k, v in d.items():
             if isinstance(v, np.ndarray):
                 d[k] = v.tolist()
+            elif isinstance(v, dict):  # info dicts may hold arrays too, e.g. is_position_updated
+                d[k] = {kk: vv.tolist() if isinstance(vv, np.ndarray) else vv for kk, vv in v.items()}
         if isinstance(t, Transition):
             name = 'transition'
         elif isinstance(t, RawTransition):
@@ -118,14 +272,12 @@ def dump_transitions(transitions: typing.Sequence[T], filename, to_dict=True, ex
             name = 'data'
         data['transitions'].append({name: d})
     with open(filename, 'w') as f:
-        yaml.dump(data, f)
+        YAML().dump(data, f)
 
 
 def load_transitions(filename) -> typing.Sequence[T]:
-    if not __has_yaml:
-        raise WalbiMissingDependencyError(__dependency_name__)
     with open(filename) as f:
-        data = yaml.load(f)
+        data = YAML().load(f)
     transitions = []
     for d in data['transitions']:
         if 'transition' in d:
@@ -147,6 +299,146 @@ def load_transitions(filename) -> typing.Sequence[T]:
     return transitions
 
 
+class TransitionDataset(object):
+    """
+    Sessions recorded by ChunkedRecorder, memory-mapped and seen as one table of rows. Indexing with an int, a slice
+    or an array of indices returns a dict of column arrays, nothing is read from disk before it is accessed
+    :param paths: session folders, or folders holding session folders
+    """
+    index_name = 'episodes.npy'  # cached episode starts, with the number of indexed rows first
+
+    def __init__(self, paths: typing.Union[str, typing.Sequence[str]]):
+        if isinstance(paths, str):
+            paths = [paths]
+        self.sessions = []
+        for path in paths:
+            if os.path.exists(os.path.join(path, ChunkedRecorder.header_name)):
+                self.sessions.append(path)
+            else:
+                self.sessions += sorted(
+                    os.path.join(path, name) for name in os.listdir(path)
+                    if os.path.exists(os.path.join(path, name, ChunkedRecorder.header_name)))
+        if not self.sessions:
+            raise FileNotFoundError('No recording in %s' % str(paths))
+        self._columns = [self._map_session(session) for session in self.sessions]
+        schema = self._schema(self._columns[0])
+        for session, columns in zip(self.sessions[1:], self._columns[1:]):
+            if self._schema(columns) != schema:  # take gathers the rows of every session into the same arrays
+                raise ValueError('%s does not have the columns of %s: %s instead of %s'
+                                 % (session, self.sessions[0], self._schema(columns), schema))
+        self.column_names = list(self._columns[0])
+        lengths = [len(columns['step']) for columns in self._columns]
+        self._offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.episode_starts = np.concatenate([
+            offset + self._episode_starts(session, columns['step'])
+            for session, columns, offset in zip(self.sessions, self._columns, self._offsets)])
+
+    @staticmethod
+    def _map_session(session) -> dict:
+        with open(os.path.join(session, ChunkedRecorder.header_name)) as f:
+            header = YAML(typ='safe').load(f)
+        specs = {name: (np.dtype(spec['dtype']), tuple(spec['shape'])) for name, spec in header['columns'].items()}
+        # a session cut short may hold partial rows, only complete rows of every column are kept
+        rows = min(os.path.getsize(os.path.join(session, name + '.bin')) // (dtype.itemsize * int(np.prod(shape)))
+                   for name, (dtype, shape) in specs.items())
+        columns = {}
+        for name, (dtype, shape) in specs.items():
+            if rows:
+                columns[name] = np.memmap(os.path.join(session, name + '.bin'), dtype=dtype, mode='r', shape=(rows,) + shape)
+            else:  # empty files cannot be mapped
+                columns[name] = np.zeros((0,) + shape, dtype=dtype)
+        return columns
+
+    @staticmethod
+    def _schema(columns) -> dict:
+        """:return: dtype and row shape of each column"""
+        return {name: (column.dtype.str, column.shape[1:]) for name, column in columns.items()}
+
+    def _episode_starts(self, session, step) -> np.ndarray:
+        """Rows where the step counter restarts, read from the cached index when it covers every row"""
+        index_path = os.path.join(session, self.index_name)
+        try:
+            index = np.load(index_path)
+            if index[0] == len(step):
+                return index[1:]
+        except (OSError, ValueError, IndexError):
+            pass
+        starts = np.flatnonzero(step == 0)
+        if len(step) and (not len(starts) or starts[0] != 0):
+            starts = np.concatenate([[0], starts])  # recording started mid episode
+        try:
+            np.save(index_path, np.concatenate([[len(step)], starts]).astype(np.int64))
+        except OSError:  # read-only recordings
+            pass
+        return starts
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    @property
+    def episode_bounds(self) -> np.ndarray:
+        """(episodes, 2) [start, stop) rows of each episode"""
+        stops = np.concatenate([self.episode_starts[1:], [len(self)]])
+        return np.stack([self.episode_starts, stops], axis=-1)
+
+    def __getitem__(self, index) -> typing.Dict[str, np.ndarray]:
+        if isinstance(index, slice):
+            start, stop, stride = index.indices(len(self))
+            session = int(np.searchsorted(self._offsets, start, side='right') - 1)
+            if stride == 1 and start < stop <= self._offsets[session + 1]:  # views of a single session
+                offset = self._offsets[session]
+                return {name: column[start - offset:stop - offset] for name, column in self._columns[session].items()}
+            index = np.arange(start, stop, stride)
+        if np.ndim(index) == 0:
+            index = int(index)
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('Row %d out of %d' % (index, len(self)))
+            session = int(np.searchsorted(self._offsets, index, side='right') - 1)
+            return {name: column[index - self._offsets[session]] for name, column in self._columns[session].items()}
+        return self.take(index)
+
+    def take(self, indices) -> typing.Dict[str, np.ndarray]:
+        """Gathers the rows at indices into (N, ...) arrays, one fancy-indexing read per session and column"""
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if indices.size and (indices.min() < 0 or indices.max() >= len(self)):
+            raise IndexError('Rows out of %d' % len(self))
+        sessions = np.searchsorted(self._offsets, indices, side='right') - 1
+        batch = {name: np.empty(indices.shape + column.shape[1:], dtype=column.dtype)
+                 for name, column in self._columns[0].items()}
+        for session in np.unique(sessions):
+            where = sessions == session
+            rows = indices[where] - self._offsets[session]
+            for name, column in self._columns[session].items():
+                batch[name][where] = column[rows]
+        return batch
+
+    def sample(self, batch_size: int, rng: np.random.Generator = None) -> typing.Dict[str, np.ndarray]:
+        """Uniform minibatch of rows, with replacement"""
+        if rng is None:
+            rng = np.random.default_rng()
+        return self.take(rng.integers(0, len(self), size=batch_size))
+
+    def iter_batches(self, batch_size: int = 4096) -> typing.Iterator[typing.Dict[str, np.ndarray]]:
+        """Consecutive rows of every session in order, as memory-mapped views which never span two sessions"""
+        for session in range(len(self.sessions)):
+            for start in range(self._offsets[session], self._offsets[session + 1], batch_size):
+                yield self[start:min(start + batch_size, self._offsets[session + 1])]
+
+    def agent_infos(self) -> typing.Dict[int, dict]:
+        """agent_info of the rows which had one, by row"""
+        infos = {}
+        for session, offset in zip(self.sessions, self._offsets):
+            path = os.path.join(session, ChunkedRecorder.agent_info_name)
+            if os.path.exists(path):
+                with open(path) as f:
+                    for item in YAML(typ='safe').load(f) or []:
+                        infos[int(offset) + item['row']] = item['agent_info']
+        return infos
+
+
 if __name__ == '__main__':
     import gym
     import walbi_gym
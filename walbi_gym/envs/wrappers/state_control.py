@@ -0,0 +1,44 @@
+import numpy as np
+
+from gym import Wrapper
+from gym import spaces
+
+from walbi_gym.controller import StateController
+
+
+class StateControlWrapper(Wrapper):
+    """
+    Actions are target positions as for PidWrapper, but the PID runs in a StateController at each STATE received,
+    whatever the rate of the agent. step only updates the setpoint and returns the latest STATE
+    :param env: a WalbiEnv
+    """
+
+    def __init__(self, env, K, tolerance: float = 0.002):
+        super().__init__(env)
+        assert env.action_space.shape == (10, 2)
+        self.action_space = spaces.Box(low=env.action_space.low[:, 0], high=env.action_space.high[:, 0])
+        raw_low, raw_high = env.raw_action_space.low[:, 0], env.raw_action_space.high[:, 0]
+        scale = (raw_high - raw_low) / (env.action_space.high[:, 0] - env.action_space.low[:, 0])
+        self._action = np.empty((10, 2))
+        self._action[:, 1] = env.action_space.low[:, 1]  # the highest speed is the lowest span
+        self.controller = StateController(env.walbi, K=K, span=env.raw_action_space.low[:, 1], tolerance=tolerance * scale)
+
+    def reset(self, **kwargs):
+        self.controller.set_setpoint(None)
+        result = self.env.reset(**kwargs)
+        self.controller.start()
+        return result
+
+    def step(self, action):
+        self._action[:, 0] = action
+        self.controller.set_setpoint(self.env._convert_action_norm_to_raw(self._action)[:, 0])
+        if self.controller.exception is not None:
+            raise self.controller.exception
+        state = self.env.walbi.get_last_state()
+        observation = self.env._state_to_observation(state)
+        reward, done, info = self.env._state_interpretation(state)
+        return observation, reward, done, info
+
+    def close(self):
+        self.controller.stop()
+        return self.env.close()
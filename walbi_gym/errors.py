@@ -1,3 +1,5 @@
+import functools
+
 from gym.error import Error
 
 from walbi_gym.protocol import ERROR_CODES
@@ -37,3 +39,22 @@ class WalbiUnexpectedMessageError(WalbiError):
         self.expected_message = expected_message
         message = 'Expected %s but got %s' % (expected_message, received_message)
         super().__init__(message, received_message, *args)
+
+
+class WalbiMissingDependencyError(WalbiError):
+    def __init__(self, dependency, *args):
+        self.dependency = dependency
+        message = 'Missing optional dependency %s' % dependency
+        super().__init__(message, dependency, *args)
+
+
+def dependency_required(dependency, condition):
+    """Decorator raising WalbiMissingDependencyError when condition is False"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not condition:
+                raise WalbiMissingDependencyError(dependency)
+            return function(*args, **kwargs)
+        return wrapper
+    return decorator
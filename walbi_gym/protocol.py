@@ -1,7 +1,12 @@
+import struct
 from enum import IntEnum
 from collections import namedtuple
 
-PROTOCOL_VERSION = 8  # int: protocol version
+import numpy as np
+
+PROTOCOL_VERSION = 9  # int: protocol version
+MIN_PROTOCOL_VERSION = 8  # oldest version still spoken, the robot answers VERSION with the lowest of both versions
+ACTION_DELTA_VERSION = 9  # first version with ACTION_DELTA
 
 class Message(IntEnum):
     """
@@ -15,6 +20,11 @@ class Message(IntEnum):
     SET = 6
     ACTION = 7
     STATE = 8
+    ACTION_DELTA = 9
+
+# the robot waits for an OK after sending these, see waitAcknowledge in Walbi.cpp. An OK after anything else,
+# e.g. an ERROR, would be answered with ERROR RECEIVED_UNKNOWN_MESSAGE
+ACKNOWLEDGED_MESSAGES = (Message.STATE, Message.VERSION)
 
 ERROR_CODES = {  # must be coherent with what Walbi.cpp throws
     -1: 'UNKNOWN_ERROR_CODE',
@@ -36,3 +46,48 @@ MESSAGE_TYPES = {
     Message.VERSION: ['int8'],
     Message.SET: ['int32'],
 }
+
+TYPE_FORMATS = {  # little-endian struct codes, sizes are the same as on the Arduino
+    'int8': 'b',
+    'int16': 'h',
+    'int32': 'l',
+}
+
+
+def compile_types(type_list) -> struct.Struct:
+    """Compiles a list of types into a single little-endian Struct covering the whole payload"""
+    return struct.Struct('<' + ''.join(TYPE_FORMATS[t] for t in type_list))
+
+
+# one precompiled Struct per message, decoding a whole payload in one call
+MESSAGE_STRUCTS = {message: compile_types(types) for message, types in MESSAGE_TYPES.items()}
+
+# ACTION payload as packed NumPy records, for writing straight from action arrays
+ACTION_DTYPE = np.dtype([('position', '<i2'), ('span', '<i2'), ('activate', 'i1')])
+assert ACTION_DTYPE.itemsize * 10 == MESSAGE_STRUCTS[Message.ACTION].size
+
+# ACTION_DELTA payload: a bitmask of the motors (bit i for motor i), then one ACTION_DTYPE record per motor in the
+# mask, in motor order. Motors out of the mask keep their last command
+ACTION_DELTA_MASK_STRUCT = compile_types(['int16'])
+ACTION_DELTA_MAX_SIZE = ACTION_DELTA_MASK_STRUCT.size + ACTION_DTYPE.itemsize * 10
+
+# STATE payload as laid out on the wire, position and is_position_updated alternate for each motor
+STATE_WIRE_DTYPE = np.dtype([
+    ('timestamp', '<i4'),
+    ('motors', [('position', '<i2'), ('updated', 'i1')], (10,)),
+    ('correct_motor_reading', 'i1'),
+    ('weight', '<i4', (2,)),  # [left, right]
+    ('imu', '<i2', (9,)),  # [ax, ay, az, gx, gy, gz, roll, pitch, yaw]
+])
+assert STATE_WIRE_DTYPE.itemsize == MESSAGE_STRUCTS[Message.STATE].size
+
+# STATE as decoded by the interfaces, one field per quantity, packed to the same size as on the wire
+STATE_DTYPE = np.dtype([
+    ('timestamp', '<i4'),  # [ms]
+    ('position', '<i2', (10,)),
+    ('updated', '?', (10,)),
+    ('correct_motor_reading', '?'),
+    ('weight', '<i4', (2,)),  # [left, right]
+    ('imu', '<i2', (9,)),  # [ax, ay, az, gx, gy, gz, roll, pitch, yaw]
+])
+assert STATE_DTYPE.itemsize == STATE_WIRE_DTYPE.itemsize
@@ -0,0 +1,220 @@
+import collections
+import threading
+import time
+import typing
+
+import numpy as np
+
+from walbi_gym.envs.env import WalbiEnv
+from walbi_gym.envs.simulated import LX16A
+
+INTERPOLATIONS = ('previous', 'linear', 'cubic')
+
+
+class Trajectory(object):
+    """
+    Normalised poses reached at given times, interpolated for all motors and sample times at once.
+    Example:
+        trajectory = Trajectory.from_durations([standing, squat, standing], [1, 1])
+        send_times, actions = trajectory.to_actions(rate=20)
+    :param poses: (N, 10) normalised positions, as the first column of a WalbiEnv action
+    :param times: (N,) [s] increasing, when each pose is reached
+    :param interpolation: 'previous' holds each pose until the next one, 'linear', or 'cubic' Hermite splines through
+        the poses with finite difference tangents, zero at the ends. Cubic positions are clipped to [-1, 1]
+    :param periodic: the trajectory repeats, the last pose must be the first one. Positions are then given modulo the
+        duration and the cubic tangent at the first and last poses goes across the loop
+    """
+
+    def __init__(self, poses, times, interpolation: str = 'linear', periodic: bool = False):
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError('Unknown interpolation %s, choose from %s' % (interpolation, INTERPOLATIONS))
+        self.poses = np.array(poses, dtype=np.float64)
+        self.times = np.array(times, dtype=np.float64)
+        if self.poses.ndim != 2 or len(self.poses) != len(self.times) or len(self.times) < 2:
+            raise ValueError('Expected (N, motors) poses and (N,) times with N >= 2, got %s and %s'
+                             % (self.poses.shape, self.times.shape))
+        if np.any(np.diff(self.times) <= 0):
+            raise ValueError('Times must be increasing')
+        if periodic and not np.allclose(self.poses[0], self.poses[-1]):
+            raise ValueError('A periodic trajectory must end on its first pose')
+        self.interpolation = interpolation
+        self.periodic = periodic
+        self._tangents = self._cubic_tangents() if interpolation == 'cubic' else None
+
+    @classmethod
+    def from_durations(cls, poses, durations, start: float = 0., **kwargs) -> 'Trajectory':
+        """:param durations: (N - 1,) [s] between consecutive poses"""
+        return cls(poses, start + np.concatenate([[0.], np.cumsum(durations)]), **kwargs)
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1] - self.times[0])
+
+    def _cubic_tangents(self) -> np.ndarray:
+        tangents = np.zeros_like(self.poses)
+        tangents[1:-1] = (self.poses[2:] - self.poses[:-2]) / (self.times[2:] - self.times[:-2])[:, None]
+        if self.periodic and len(self.times) > 2:
+            steps = np.diff(self.times)
+            tangents[0] = tangents[-1] = (self.poses[1] - self.poses[-2]) / (steps[0] + steps[-1])
+        return tangents
+
+    def positions(self, t) -> np.ndarray:
+        """:param t: [s] scalar or (M,) times, clamped to the trajectory. :return: (10,) or (M, 10) normalised positions"""
+        t = np.asarray(t, dtype=np.float64)
+        if self.periodic:
+            t = self.times[0] + np.mod(t - self.times[0], self.duration)
+        t = np.clip(t, self.times[0], self.times[-1])
+        index = np.clip(np.searchsorted(self.times, t, side='right') - 1, 0, len(self.times) - 2)
+        start, end = self.poses[index], self.poses[index + 1]
+        if self.interpolation == 'previous':
+            return np.where((t >= self.times[-1])[..., None], end, start)
+        step = self.times[index + 1] - self.times[index]
+        u = ((t - self.times[index]) / step)[..., None]
+        if self.interpolation == 'linear':
+            return start + u * (end - start)
+        u2, u3 = u * u, u * u * u
+        positions = ((2 * u3 - 3 * u2 + 1) * start + (-2 * u3 + 3 * u2) * end
+                     + (u3 - 2 * u2 + u) * step[..., None] * self._tangents[index]
+                     + (u3 - u2) * step[..., None] * self._tangents[index + 1])
+        return np.clip(positions, -1, 1, out=positions)
+
+    def resample(self, rate: float) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """:return: (M,) times every 1 / rate seconds, the last pose included, and the (M, 10) positions at those times"""
+        times = np.arange(self.times[0], self.times[-1], 1. / rate)
+        times = np.append(times, self.times[-1]) if self.times[-1] - times[-1] > 1e-9 else times
+        return times, self.positions(times)
+
+    def to_actions(self, rate: float = None, speed_limit: float = LX16A.max_speed) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Raw actions to send so that the motors pass by the samples at their times. The action sent at a sample
+        targets the next one, with a span per motor of the time between both samples: the servo interpolates in
+        between on its own, so a sparse trajectory still moves smoothly. A span is lengthened for a motor which would
+        otherwise exceed speed_limit, and clipped to the span range of WalbiEnv.raw_action_space
+        :param rate: [Hz] resamples the trajectory, by default one action per pose
+        :param speed_limit: [tick/s]
+        :return: (M - 1,) [s] send times relative to the first sample, (M - 1, 10, 3) int16 [position, span, activate]
+        """
+        if rate is None:
+            times, positions = self.times, self.poses
+        else:
+            times, positions = self.resample(rate)
+        raw = WalbiEnv._convert_action_norm_to_raw(np.stack([positions, -np.ones_like(positions)], axis=-1))
+        raw_positions = raw[..., 0].astype(np.float64)
+        spans = np.diff(times)[:, None] * 1000  # [ms]
+        spans = np.maximum(spans, np.abs(np.diff(raw_positions, axis=0)) / speed_limit * 1000)
+        span_low, span_high = WalbiEnv.raw_action_space.low[:, 1], WalbiEnv.raw_action_space.high[:, 1]
+        actions = np.empty((len(times) - 1, raw.shape[1], 3), dtype=np.int16)
+        actions[..., 0] = raw[1:, :, 0]
+        actions[..., 1] = np.rint(np.clip(spans, span_low, span_high))
+        actions[..., 2] = 1
+        return times[:-1] - times[0], actions
+
+
+class TrajectoryPlayer(object):
+    """
+    Streams the actions of a Trajectory to the robot at their send times. The actions are all converted beforehand and
+    sent without waiting for their OK: up to max_pending_actions are in flight, so a waypoint costs no round trip.
+    As the firmware applies an ACTION when it receives it, each action leaves at the time of the sample before its
+    target and the servos interpolate over its span (see Trajectory.to_actions). The rate can then stay much lower
+    than the control loop of a policy.
+    Example:
+        player = TrajectoryPlayer(walbi, trajectory, rate=20, cycles=4)
+        player.play()  # or start() and join() to keep the calling thread
+    :param rate: [Hz] resampling of the trajectory, by default one action per pose
+    :param cycles: plays the trajectory that many times, e.g. for a periodic gait
+    :param approach: [s] span of a first action moving to the first pose, from wherever the motors are. 0 to skip it
+    :param spin: [s] the end of each wait is spent polling the clock, as in ControlLoop
+    """
+
+    def __init__(self, walbi, trajectory: Trajectory, rate: float = None, cycles: int = 1, approach: float = 1.,
+                 max_pending_actions: int = 8, spin: float = 0.0002,
+                 speed_limit: float = LX16A.max_speed, clock: typing.Callable[[], float] = time.monotonic):
+        self.walbi = walbi
+        self.trajectory = trajectory
+        self.max_pending_actions = max_pending_actions
+        self.spin = spin
+        self.clock = clock
+        send_times, actions = trajectory.to_actions(rate, speed_limit=speed_limit)
+        cycle = trajectory.duration
+        self.send_times = np.concatenate([send_times + i * cycle for i in range(cycles)])
+        self.actions = np.concatenate([actions] * cycles)
+        if approach > 0:
+            first = np.empty((1,) + actions.shape[1:], dtype=np.int16)
+            first[0, :, 0] = WalbiEnv._convert_obs_norm_to_raw(np.clip(trajectory.poses[0], -1, 1))
+            first[0, :, 1] = np.rint(np.clip(approach * 1000, WalbiEnv.raw_action_space.low[:, 1],
+                                             WalbiEnv.raw_action_space.high[:, 1]))
+            first[0, :, 2] = 1
+            self.send_times = np.concatenate([[0.], self.send_times + approach])
+            self.actions = np.concatenate([first, self.actions])
+        self._pending_actions = collections.deque()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.exception = None
+        self.actions_sent = 0
+        self.late_actions = 0  # sent after the send time of the next action
+        self.max_lateness = 0.  # [s]
+
+    @property
+    def duration(self) -> float:
+        """[s] until the last action is sent, the motors reach its target one span later"""
+        return float(self.send_times[-1])
+
+    def _wait_until(self, deadline: float):
+        while not self._stop_event.is_set():
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                return
+            if remaining > self.spin:
+                time.sleep(min(remaining - self.spin, 0.1))
+
+    def _acknowledge(self, wait: bool):
+        """Raises as soon as an action was answered with ERROR, waits only when too many actions are in flight"""
+        interface = self.walbi.interface
+        while self._pending_actions and (self._pending_actions[0].done() or
+                                         (wait and len(self._pending_actions) > self.max_pending_actions)):
+            interface.wait_ok(self._pending_actions.popleft())
+
+    def play(self):
+        """Sends all actions from the calling thread, then waits for their OK"""
+        self._stop_event.clear()
+        start = self.clock()
+        send_times = self.send_times
+        for i in range(len(send_times)):
+            deadline = start + send_times[i]
+            self._wait_until(deadline)
+            if self._stop_event.is_set():
+                break
+            lateness = self.clock() - deadline
+            self.max_lateness = max(self.max_lateness, lateness)
+            self.late_actions += i + 1 < len(send_times) and lateness > send_times[i + 1] - send_times[i]
+            self._pending_actions.append(self.walbi.send_action(self.actions[i], block=False))
+            self.actions_sent += 1
+            self._acknowledge(wait=True)
+        while self._pending_actions:
+            self.walbi.interface.wait_ok(self._pending_actions.popleft())
+
+    def _run(self):
+        try:
+            self.play()
+        except Exception as e:  # raised again by join
+            self.exception = e
+
+    def start(self):
+        """Plays from a thread"""
+        self.exception = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def join(self, timeout: float = None) -> bool:
+        """:return: (bool) whether the thread is done, raises what stopped it"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return False
+        if self.exception is not None:
+            raise self.exception
+        return True
+
+    def stop(self):
+        """Stops sending after the current action, from any thread"""
+        self._stop_event.set()
@@ -1,8 +1,8 @@
 import numpy as np
 
-from walbi_gym.protocol import Message, PROTOCOL_VERSION
+from walbi_gym.protocol import Message, PROTOCOL_VERSION, ACTION_DELTA_VERSION
 from walbi_gym import errors
-from walbi_gym.communication import BaseInterface, make_interface
+from walbi_gym.communication import BaseInterface, make_interface, make_async_interface
 from walbi_gym.configuration import config
 
 
@@ -10,16 +10,28 @@ class Walbi(object):
     protocol_version = PROTOCOL_VERSION
     config = config
 
-    def __init__(self, interface='serial', autoconnect=True, verify_version=True, *args, **kwargs):
+    def __init__(self, interface='serial', autoconnect=True, verify_version=True, *args, wire_log=None, **kwargs):
+        """:param wire_log: (str) file where to log every byte exchanged with the robot, from the handshake on"""
         self.interface = make_interface(interface, *args, **kwargs)
         self.settings = None
+        if wire_log is not None:
+            self.interface.start_wire_log(wire_log)
         if autoconnect and not self.interface.is_connected:
             self.interface.connect()
         if verify_version and self.interface.is_connected and self.interface.verify_version():
             print('Version OK')
 
-    def send_action(self, int16_action):
-        self.interface.put_command(Message.ACTION, param=int16_action, expect_ok=True)
+    @property
+    def action_message(self) -> Message:
+        """ACTION_DELTA once the robot agreed on a version which has it, sending only the motors changed"""
+        version = self.interface.protocol_version
+        return Message.ACTION_DELTA if version is not None and version >= ACTION_DELTA_VERSION else Message.ACTION
+
+    def send_action(self, int16_action, block=True):
+        """Sends the action, without block the OK is not awaited and a Future is returned (see BaseInterface.wait_ok)"""
+        if not block:
+            int16_action = np.array(int16_action)  # the caller may modify its array before it is sent
+        return self.interface.put_command(self.action_message, param=int16_action, expect_ok=True, block=block)
 
     def apply_settings(self, interval_send_state_millis):
         self.settings = (interval_send_state_millis,)
@@ -28,26 +40,75 @@ class Walbi(object):
     def read_message(self, block=True, timeout=None):
         return self.interface.queue.get(block=block, timeout=timeout)
 
-    def get_last_state(self, raise_if_error=True):
+    def get_last_state(self, raise_if_error=True, new=False):
+        """Latest STATE, after raising (or printing) the control messages received in the meantime"""
         while not self.interface.queue.empty():
-            message, values = self.read_message()
-            if message == Message.STATE:
-                state = values
+            message, param = self.read_message(block=False)
+            if message == Message.ERROR:
+                error = errors.WalbiArduinoError(param[0])
+            else:
+                error = errors.WalbiUnexpectedMessageError(message, Message.STATE)
+            if raise_if_error:
+                raise error
             else:
-                if message == Message.ERROR:
-                    error = errors.WalbiArduinoError(param[0])
-                else:
-                    error = WalbiUnexpectedMessageError(message, Message.STATE)
-                if raise_if_error:
-                    raise error
-                else:
-                    print(error)
-        return state
+                print(error)
+        return self.interface.get_state(new=new)
 
     def close(self):
         if self.interface.is_connected:
             self.interface.close()
 
 
+class AsyncWalbi(object):
+    """
+    Walbi for asyncio applications, one event loop can drive several robots without any thread
+    Example:
+        async with AsyncWalbi('socket_client', '192.168.1.10', 5000) as walbi:
+            await walbi.apply_settings(20)
+            async for state in walbi:
+                await walbi.send_action(controller(state))
+    """
+    protocol_version = PROTOCOL_VERSION
+    config = config
+
+    def __init__(self, interface='serial', *args, **kwargs):
+        self.interface = make_async_interface(interface, *args, **kwargs)
+        self.settings = None
+
+    async def connect(self, verify_version=True):
+        await self.interface.open()
+        await self.interface.connect()
+        if verify_version and await self.interface.verify_version():
+            print('Version OK')
+
+    action_message = Walbi.action_message
+
+    async def send_action(self, int16_action):
+        await self.interface.send(self.action_message, param=int16_action, expect_ok=True)
+
+    async def apply_settings(self, interval_send_state_millis):
+        self.settings = (interval_send_state_millis,)
+        await self.interface.send(Message.SET, param=self.settings, expect_ok=True)
+
+    async def next_state(self, timeout=None):
+        return await self.interface.next_state(timeout=timeout)
+
+    def get_last_state(self):
+        return self.interface.last_state
+
+    def __aiter__(self):
+        return self.interface.states()
+
+    async def close(self):
+        await self.interface.close()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
 if __name__ == '__main__':
     pass